@@ -1,6 +1,7 @@
 import sys
 sys.path.append ("../lib")
 import lib.pwm as pwm
+import lib.common_i2c as common_i2c
 import common
 import time
 import numpy
@@ -51,7 +52,7 @@ def apply_pw (params):
     # end for
 
     bf_i2c = time.time ()
-    (status, message) = pwm.set_pwm_ai (params['pwm'], params['minch'], values)
+    (status, message) = common_i2c.retried (params['pwm_recovery'], 'pwm', pwm.set_pwm_ai_fast, params['pwm'], params['minch'], values)
     if not status:
         return (False, "Unable to set the pwm signal. The error was %s" % message)
 
@@ -78,8 +79,9 @@ def act (params):
             params['m%s' % motor] = 0
         # end for
 
-        apply_pw (params)
-        params['motors_stopped'] = True
+        (status, message) = apply_pw (params)
+        if status:
+            params['motors_stopped'] = True
 
         # Register time
         af = time.time ()
@@ -97,7 +99,7 @@ def act (params):
             params['con_time'][0]['i2c_act'].append (params['diff_i2c'])
         # end if
 
-        return (True, None)
+        return (status, message)
     # end if
     
     # Check battery
@@ -108,7 +110,7 @@ def act (params):
                     params['m%s' % motor] = 0
                 # end for
                     
-                apply_pw (params)
+                (status, message) = apply_pw (params)
 
                 # Register time
                 af = time.time ()
@@ -126,7 +128,7 @@ def act (params):
                     params['con_time'][0]['i2c_act'].append (params['diff_i2c'])
                 # end if
 
-                return (True, None)
+                return (status, message)
             # end if
         # end for
     # end if
@@ -139,7 +141,7 @@ def act (params):
 
         params ['reset'] = False
 
-        apply_pw (params)
+        (status, message) = apply_pw (params)
 
         # Register time
         af = time.time ()
@@ -157,7 +159,7 @@ def act (params):
             params['con_time'][0]['i2c_act'].append (params['diff_i2c'])
         # end if
 
-        return (True, None)
+        return (status, message)
     # end if
 
     # Check if has to be incremented the power of all motors
@@ -169,7 +171,7 @@ def act (params):
 
         params['power'] = 0
         params['inc_pw'] = False
-        apply_pw (params)
+        (status, message) = apply_pw (params)
 
         # Register time
         af = time.time ()
@@ -187,7 +189,7 @@ def act (params):
             params['con_time'][0]['i2c_act'].append (params['diff_i2c'])
         # end if
 
-        return (True, None)
+        return (status, message)
     # end if
 
     if not params ['start']:
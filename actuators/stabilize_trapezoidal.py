@@ -1,6 +1,7 @@
 import sys
 sys.path.append ("../lib")
 import lib.pwm as pwm
+import lib.common_i2c as common_i2c
 import common
 import time
 import numpy
@@ -251,7 +252,7 @@ def apply_pw (params):
     # end for
 
     bf_i2c = time.time ()
-    (status, message) = pwm.set_pwm_ai (params['pwm'], params['minch'], values)
+    (status, message) = common_i2c.retried (params['pwm_recovery'], 'pwm', pwm.set_pwm_ai_fast, params['pwm'], params['minch'], values)
     if not status:
         return (False, "Unable to set the pwm signal. The error was %s" % message)
     # end if
@@ -283,8 +284,8 @@ def act (params):
                 params['m%s' % motor] = 0
         # end for
 
-        apply_pw (params)
-        if engines_stopped == 4:
+        (status, message) = apply_pw (params)
+        if status and engines_stopped == 4:
             params['motors_stopped'] = True
 
         # Register time
@@ -303,7 +304,7 @@ def act (params):
             params['con_time'][0]['i2c_act'].append (params['diff_i2c'])
         # end if
 
-        return (True, None)
+        return (status, message)
     # end if
     
     # Check battery
@@ -314,7 +315,7 @@ def act (params):
                     params['m%s' % motor] = 0
                 # end for
                     
-                apply_pw (params)
+                (status, message) = apply_pw (params)
 
                 # Register time
                 af = time.time ()
@@ -332,7 +333,7 @@ def act (params):
                     params['con_time'][0]['i2c_act'].append (params['diff_i2c'])
                 # end if
 
-                return (True, None)
+                return (status, message)
             # end if
         # end for
     # end if
@@ -345,7 +346,7 @@ def act (params):
 
         params ['reset'] = False
 
-        apply_pw (params)
+        (status, message) = apply_pw (params)
 
         # Register time
         af = time.time ()
@@ -363,7 +364,7 @@ def act (params):
             params['con_time'][0]['i2c_act'].append (params['diff_i2c'])
         # end if
 
-        return (True, None)
+        return (status, message)
     # end if
 
     # Check if has to be incremented the power of all motors
@@ -375,7 +376,7 @@ def act (params):
 
         params['power'] = 0
         params['inc_pw'] = False
-        apply_pw (params)
+        (status, message) = apply_pw (params)
 
         # Register time
         af = time.time ()
@@ -393,7 +394,7 @@ def act (params):
             params['con_time'][0]['i2c_act'].append (params['diff_i2c'])
         # end if
 
-        return (True, None)
+        return (status, message)
     # end if
 
     if not params ['start']:
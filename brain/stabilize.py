@@ -8,7 +8,14 @@ import re
 import importlib
 import time
 sys.path.append ("../lib")
+sys.path.append ("../")
 import common
+import common_i2c
+import lib.common_i2c
+import record_i2c
+import sim_i2c
+import raw_i2c
+import io_worker
 import threading
 import numpy
 import signal
@@ -24,6 +31,21 @@ VREF = 4.82                   # Used value when Rpi is supplied through t
 INIT_POWER = 0.0
 DUTY_MAX = 800.0
 DUTY_MIN = 400.0
+SNAPSHOT = True               # Read the IMU devices with combined I2C_RDWR transfers
+FIFO_WATERMARK = True         # Set the FIFO thresholds of the gyro and the accelerometer to the samples of a period
+GYRO_TEMP_PERIOD = None       # Iterations between the reads of the gyro temperature to follow the drift of its bias with temp_bias.npz (None to disable)
+ACC_FILTER = 'boxcar'         # Low-pass filter of the accelerometer: 'boxcar', 'exponential' or 'biquad'
+ACC_WINDOW = 20               # Number of samples of the window of the accelerometer filter
+RECORD_I2C = None             # File to record the i2c traffic of the flight (None to disable)
+REPLAY_I2C = None             # File with the i2c traffic to replay instead of using the devices
+SIM_I2C = None                # Latency in seconds of the simulated devices to use instead of the real ones (None to disable)
+I2C_BUS_ID = 1                # Bus id of the i2c devices
+I2C_STATS = False             # Collect the statistics of the i2c operations of the flight
+I2C_ARBITER = True            # Serialize the i2c operations of the threads by priority
+I2C_WORKER = False            # Read the IMU on a thread while the actuators compute
+I2C_RAW = False               # Read the devices through the raw i2c backend, into preallocated buffers
+I2C_BUDGET = 0.01             # Bus time in seconds of each iteration before skipping the low priority devices (None to disable)
+I2C_RECOVERY = 500            # Time in microseconds to retry the failed i2c operations before using the last values (None to disable)
 
 FIGWIDTH = 20
 FIGHEIGTH = 10
@@ -156,6 +178,17 @@ def main():
     ctx['minch'] = MIN_CHANNEL
     # Reference voltage for the ADC device
     ctx['vref'] = VREF
+    # Flag to read the IMU devices with snapshots
+    ctx['snapshot'] = SNAPSHOT
+    # Flag to set the FIFO thresholds to the samples of a period
+    ctx['fifo_watermark'] = FIFO_WATERMARK
+    # Iterations between the reads of the gyro temperature
+    ctx['gyro_temp_period'] = GYRO_TEMP_PERIOD
+    # Filter of the accelerometer data
+    ctx['acc_filter'] = ACC_FILTER
+    ctx['acc_window'] = ACC_WINDOW
+    # Budget to retry the failed i2c operations
+    ctx['i2c_recovery'] = I2C_RECOVERY
     # Initial power for the motors
     ctx['init_power'] = INIT_POWER
     # Current power of the motors
@@ -272,6 +305,54 @@ def main():
     # Buffer for the values from the altimeter
     ctx['alt_data'] = []
 
+    # Record, replay or simulate the i2c traffic of the flight. The
+    # snapshots use the i2c device interface directly, so they are disabled
+    i2c_bus = None
+    if REPLAY_I2C != None:
+        i2c_bus = record_i2c.ReplayBus (REPLAY_I2C)
+    elif SIM_I2C != None:
+        i2c_bus = sim_i2c.imu_bus (sim_i2c.RealClock (), latency = SIM_I2C)
+        i2c_bus.attach (sim_i2c.SimPCA9685 ())
+    elif RECORD_I2C != None:
+        i2c_bus = record_i2c.RecordBus (common_i2c.open_bus (I2C_BUS_ID), RECORD_I2C)
+    # end if
+
+    if i2c_bus != None:
+        ctx['snapshot'] = False
+        # The drivers are imported as lib.* by some collectors and actuators
+        for module in [common_i2c, lib.common_i2c]:
+            module.set_bus_factory (lambda bus_id: i2c_bus)
+        # end for
+    # end if
+
+    # The raw backend opens the real devices, so the snapshots are kept
+    if I2C_RAW and i2c_bus == None:
+        for module in [common_i2c, lib.common_i2c]:
+            module.set_bus_factory (raw_i2c.RawBus)
+        # end for
+    # end if
+
+    if I2C_STATS:
+        for module in [common_i2c, lib.common_i2c]:
+            module.enable_stats ()
+        # end for
+    # end if
+
+    # The arbiter has to be shared by the drivers imported as lib.*
+    arbiter = None
+    if I2C_ARBITER:
+        arbiter = common_i2c.BusArbiter ()
+        for module in [common_i2c, lib.common_i2c]:
+            module.set_arbiter (arbiter)
+        # end for
+    # end if
+
+    # Thread to take the snapshots of the IMU while the loop computes
+    ctx['io_worker'] = None
+    if I2C_WORKER:
+        ctx['io_worker'] = io_worker.start ()
+    # end if
+
     # Initialize the collectors
     for collector in collectors:
         if hasattr (collector, 'initialize'):
@@ -290,6 +371,16 @@ def main():
         else:
             index += 1
 
+    # The budget of bus time has to be shared by the drivers imported
+    # as lib.* and it is set after the initialization of the devices
+    budget = None
+    if I2C_BUDGET != None:
+        budget = common_i2c.BusBudget (I2C_BUDGET)
+        for module in [common_i2c, lib.common_i2c]:
+            module.set_budget (budget)
+        # end for
+    # end if
+
     interface = th (ctx)
     interface.start ()
 
@@ -351,6 +442,16 @@ def main():
         if time_to_sleep > 0:
             time.sleep (time_to_sleep)
 
+        # Register the bus time of the last iteration and start the next
+        if budget != None:
+            used = budget.start ()
+            if not ctx['con_time'][0].has_key('i2c_budget'):
+                ctx['con_time'][0]['i2c_budget'] = [used]
+            else:
+                ctx['con_time'][0]['i2c_budget'].append (used)
+            # end if
+        # end if
+
         # Collect information
         for collector in collectors:
             if hasattr (collector, 'SKIP') and collector.SKIP:
@@ -360,8 +461,11 @@ def main():
             if hasattr (collector, 'get_info'):
                 (status, message) = collector.get_info (ctx)
                 if not status:
+                    # The recovery had no values to serve. Stop the
+                    # motors instead of leaving them running
                     print message
-                    sys.exit(0)
+                    ctx['stop'] = True
+                    break
                 # end if
                     
             # end if
@@ -406,7 +510,76 @@ def main():
 
     file_data = "data"
     print "data saved in the file %s" % file_data
-    numpy.savez (file_data, p12_values = ctx['powers_p12'], p13_values = ctx['powers_p13'], p14_values = ctx['powers_p14'], p15_values = ctx['powers_p15'], p_corr=ctx['p_corr'], p_notcorr = ctx['p_notcorr'], p_180=ctx['p_180'], p_acc = ctx['p_acc'], r_corr=ctx['r_corr'], r_notcorr = ctx['r_notcorr'], r_180=ctx['r_180'], r_acc = ctx['r_acc'], accsr_iter = ctx['accsr_iter'], accsp_iter = ctx['accsp_iter'], p_gts_iter = ctx['p_gts_iter'], r_gts_iter = ctx['r_gts_iter'], p_Qs = ctx['p_Qs'], p_Qts = ctx['p_Qts'], p_Qgs = ctx['p_Qgs'], r_Qs = ctx['r_Qs'], r_Qts = ctx['r_Qts'], r_Qgs = ctx['r_Qgs'], velsp_gyro_iter=ctx['velsp_gyro_iter'], velsr_gyro_iter=ctx['velsr_gyro_iter'], con_time=ctx['con_time'], acc_nvalues= ctx['acc_nvalues'], gyro_nvalues= ctx['gyro_nvalues'], p_Ts=ctx['p_Ts'], p_Tas=ctx['p_Tas'], p_Tds=ctx['p_Tds'], r_Ts=ctx['r_Ts'], r_Tas=ctx['r_Tas'], r_Tds=ctx['r_Tds'], acc_data=ctx['acc_data'], alt_data=ctx['alt_data'])
+    if ctx['io_worker'] != None:
+        ctx['io_worker'].stop ()
+    # end if
+
+    if i2c_bus != None:
+        i2c_bus.close ()
+    # end if
+
+    if I2C_STATS:
+        file_stats = "i2c_stats.txt"
+        print "i2c statistics saved in the file %s" % file_stats
+        f = open (file_stats, 'w')
+        for module in [common_i2c, lib.common_i2c]:
+            (status, lines) = module.format_stats ()
+            f.write ("\n".join (lines) + "\n")
+        # end for
+        if arbiter != None:
+            f.write ("%-8s %8s %10s %10s %10s\n" % ('priority', 'count', 'contended', 'wait(s)', 'max(s)'))
+            for (priority, stats) in sorted (arbiter.stats.items ()):
+                f.write ("%-8s %8d %10d %10.6f %10.6f\n" % (priority, stats['count'], stats['contended'], stats['wait'], stats['max_wait']))
+            # end for
+        # end if
+        f.close ()
+    # end if
+
+    if budget != None:
+        budget.start ()
+        print "i2c budget of %s s exceeded in %s of %s iterations (maximum %s s). Skipped work: %s" % (budget.limit, budget.overruns, budget.iterations - 1, budget.max_used, budget.skipped)
+    # end if
+
+    # Drains, watermarks and overruns of the FIFOs
+    if ctx.has_key ('imu') and ctx['imu'].has_key ('fifo'):
+        file_fifo = "fifo_counters.txt"
+        print "FIFO counters saved in the file %s" % file_fifo
+        f = open (file_fifo, 'w')
+        for collector in collectors:
+            if hasattr (collector, 'format_fifo'):
+                (status, lines) = collector.format_fifo (ctx['imu'])
+                f.write ("\n".join (lines) + "\n")
+            # end if
+        # end for
+        f.close ()
+    # end if
+
+    # Retries and time lost by the errors of the bus
+    if I2C_RECOVERY != None:
+        file_recovery = "i2c_recovery.txt"
+        print "i2c recovery counters saved in the file %s" % file_recovery
+        f = open (file_recovery, 'w')
+        if ctx.has_key ('imu') and ctx['imu'].has_key ('recovery'):
+            (status, lines) = common_i2c.format_recovery (ctx['imu']['recovery'])
+            f.write ("imu\n" + "\n".join (lines) + "\n")
+        # end if
+        if ctx.has_key ('pwm_recovery'):
+            (status, lines) = common_i2c.format_recovery (ctx['pwm_recovery'])
+            f.write ("pwm\n" + "\n".join (lines) + "\n")
+        # end if
+        f.close ()
+    # end if
+
+    # Counters of the FIFOs as rows of [drains, samples, watermark, overrun]
+    fifo = []
+    if ctx.has_key ('imu') and ctx['imu'].has_key ('fifo'):
+        for key in ['gyro', 'accel']:
+            counters = ctx['imu']['fifo'][key]
+            fifo.append ([counters['drains'], counters['samples'], counters['watermark'], counters['overrun']])
+        # end for
+    # end if
+
+    numpy.savez (file_data, p12_values = ctx['powers_p12'], p13_values = ctx['powers_p13'], p14_values = ctx['powers_p14'], p15_values = ctx['powers_p15'], p_corr=ctx['p_corr'], p_notcorr = ctx['p_notcorr'], p_180=ctx['p_180'], p_acc = ctx['p_acc'], r_corr=ctx['r_corr'], r_notcorr = ctx['r_notcorr'], r_180=ctx['r_180'], r_acc = ctx['r_acc'], accsr_iter = ctx['accsr_iter'], accsp_iter = ctx['accsp_iter'], p_gts_iter = ctx['p_gts_iter'], r_gts_iter = ctx['r_gts_iter'], p_Qs = ctx['p_Qs'], p_Qts = ctx['p_Qts'], p_Qgs = ctx['p_Qgs'], r_Qs = ctx['r_Qs'], r_Qts = ctx['r_Qts'], r_Qgs = ctx['r_Qgs'], velsp_gyro_iter=ctx['velsp_gyro_iter'], velsr_gyro_iter=ctx['velsr_gyro_iter'], con_time=ctx['con_time'], acc_nvalues= ctx['acc_nvalues'], gyro_nvalues= ctx['gyro_nvalues'], p_Ts=ctx['p_Ts'], p_Tas=ctx['p_Tas'], p_Tds=ctx['p_Tds'], r_Ts=ctx['r_Ts'], r_Tas=ctx['r_Tas'], r_Tds=ctx['r_Tds'], acc_data=ctx['acc_data'], alt_data=ctx['alt_data'], fifo=fifo)
 
     return
 
@@ -7,6 +7,7 @@ import adc
 import os
 import common
 import common_gpio as gpio
+import common_i2c
 
 SKIP = True
 
@@ -23,6 +24,10 @@ def get_info (params):
     if not common.check_keys (keys, params):
         return (False, "Unable to get the information from the battery monitor. The params parameter does not contain the necesary key value 'bm'")
 
+    # The battery is checked when the iteration has bus time left
+    if not common_i2c.budget_allows ('battery'):
+        return (True, None)
+
     values = adc.readadc (params['bm'])
     for i in xrange (3):
         cell = values [i]
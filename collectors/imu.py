@@ -8,6 +8,9 @@ import accel
 import mag
 import alt
 import common
+import common_i2c
+import lowpass
+import temp_bias
 import os
 import numpy
 import time
@@ -81,6 +84,54 @@ def apply_scale (value, scales):
 
     return (value * scale, scale)
 
+def count_fifo (counters, status):
+    '''
+    Count a drain of a FIFO in the counters of the device: the drains,
+    the samples, the drains holding at least the samples of a period of
+    the loop (watermark) and the drains that lost samples (overrun)
+    status: (level, watermark, overrun) status of the FIFO
+    '''
+    (level, watermark, overrun) = status
+    counters['drains'] += 1
+    counters['samples'] += level
+    if watermark:
+        counters['watermark'] += 1
+    # end if
+    if overrun:
+        counters['overrun'] += 1
+    # end if
+
+def format_fifo (imu):
+    ''' Get the lines of text with the counters of the FIFOs '''
+    lines = ["%-8s %8s %8s %10s %8s" % ('device', 'drains', 'samples', 'watermark', 'overrun')]
+    for key in ['gyro', 'accel']:
+        counters = imu['fifo'][key]
+        lines.append ("%-8s %8d %8d %10d %8d" % (key, counters['drains'], counters['samples'], counters['watermark'], counters['overrun']))
+    # end for
+    return (True, lines)
+
+def calibrate_gyro (G, samples):
+    '''
+    Calibrate the angular rates of the gyro: the garbage data is set to
+    0 and the bias is removed depending on the sign of the values. The
+    scales are not applied as they are not working properly
+    samples: (N,3) array of angular rates
+    '''
+    cal = G['cal']
+
+    # Detect garbage data
+    garbage = ((samples >= cal['min_gd']) & (samples <= cal['max_gd'])) | \
+              ((samples >= cal['min_cd']) & (samples <= cal['max_cd']))
+
+    # Apply offset depending on the sign of the value. The negative
+    # values do not change their sign
+    negative = samples < 0
+    values = numpy.where (negative, samples - cal['neg_bias'], samples - cal['pos_bias'])
+    values = numpy.where (negative & (values > 0), -values, values)
+    values[garbage] = 0.0
+
+    return values * cal['sign']
+
 def get_gyro_info (params):
     ''' Function to get info from gyro '''
 
@@ -100,11 +151,19 @@ def get_gyro_info (params):
 
     diff_i2c = 0
     bf_i2c = time.time ()
+
+    # Get the data taken in the snapshot of the iteration, if any
+    raw = imu['raw']
     
-    (status,level) = gyro.get_fifolevel(G)
-    if not status:
-        return (False, "Unable to get the fifo level on gyro device. The error was %s" % level)
+    if raw != None:
+        status = raw['gyro_fifo']
+    else:
+        # Drain the FIFO with block reads of several samples
+        samples = gyro.read_fifo_fast (G)
+        status = G['fifo_status']
     # end if
+    level = status[0]
+    count_fifo (imu['fifo']['gyro'], status)
 
     # Store the level value
     params['gyro_nvalues'].append (level)
@@ -112,11 +171,6 @@ def get_gyro_info (params):
     af_i2c = time.time ()
     diff_i2c += (af_i2c - bf_i2c)
 
-    # Check fifo overrun
-    if level == 31:
-        print "Fifo overrun on gyro device"
-    # end if
-
     G['x'] = 0.0
     G['y'] = 0.0
     G['z'] = 0.0
@@ -143,73 +197,20 @@ def get_gyro_info (params):
         return (True, None)
 
     params['new_gyro_data'] = True
-    while level > 0:
-
-        bf_i2c = time.time ()
-
-        (status, xyz) = gyro.get_block_xyz(G)
-        if not status:
-            return (False, "Unable to get the values on gyro device. The error was %s" % xyz)
-        # end if
 
-        af_i2c = time.time ()
-        diff_i2c += (af_i2c - bf_i2c)
-
-        i = 0
-        for axis in ['x', 'y', 'z']:
-
-            value = xyz[i]
-
-            garbage_data = False
-            # Detect garbage data
-            if value <= imu['gyro']['max_gd'][axis] and value >= imu['gyro']['min_gd'][axis]:
-                value = 0
-                garbage_data = True
-            elif value <= imu['gyro']['max_cd'][axis] and value >= imu['gyro']['min_cd'][axis]:
-                value = 0
-                garbage_data = True
-            # end if
-
-            scale = 0
-            if not garbage_data:
-                apply_sc = True
-                # Apply offset depending on the sign of the value
-                if value < 0:
-                    value = value - imu['gyro']['neg_bias'][axis]
-                    if value > 0:
-                        apply_sc = False
-                        value = -value
-                    # end if
-                else:
-                    value = value - imu['gyro']['pos_bias'][axis]
-                # end if
-
-                # Commented. The scales are not working properly
-                # if apply_sc:
-                #     (value, scale) = apply_scale (value, imu['gyro']['scales'][axis])
-                # # end if
-            # end if 
-
-            # Sign conversion to aling axis with accelerometer (to
-            # follow the convention of axis that is explained in the
-            # AN3192 file)
-            if axis == 'y':
-                value = -value
-            # end if                
-            
-            G[axis] += value*imu['gyro']['dr']
-                    
-            i += 1
-        # end for
+    # Decode all the samples of the snapshot at once
+    if raw != None:
+        samples = gyro.decode_block_xyz_array (G, raw['gyro'])
+    # end if
 
-        level -= 1
-    # end while
+    # Integrate the calibrated angular rates of all the samples
+    (G['x'], G['y'], G['z']) = calibrate_gyro (G, samples).sum (axis = 0) * G['dr']
 
     # It is warranted that at least there is one value available
     #  (r->x, p->y) Set data for the actuators (y axis has the sign
     #  inverted to follow the convention)
-    params['velr_gyro'] = xyz[0]
-    params['velp_gyro'] = -xyz[1]
+    params['velr_gyro'] = samples[-1][0]
+    params['velp_gyro'] = -samples[-1][1]
 
     # Register time
     af = time.time ()
@@ -229,6 +230,35 @@ def get_gyro_info (params):
 
     return (True, None)
 
+def update_gyro_temp (params):
+    '''
+    Function to read the temperature of the gyro and move its biases by
+    the drift of the table from the temperature of the initialization
+    '''
+
+    bf = time.time ()
+
+    imu = params['imu']
+    G = imu['gyro']
+    T = G['temp_comp']
+
+    temp = gyro.get_temp_fast (G)
+    drift = T['table'].lookup (temp) - T['reference']
+    G['cal']['pos_bias'] = T['pos_bias'] + drift
+    G['cal']['neg_bias'] = T['neg_bias'] + drift
+    G['t'] = temp
+    imu['tg'] = temp
+
+    # Register time to perform i2c operations
+    diff = time.time () - bf
+    if not params['con_time'][0].has_key('i2c_gyro_temp'):
+        params['con_time'][0]['i2c_gyro_temp'] = [diff]
+    else:
+        params['con_time'][0]['i2c_gyro_temp'].append (diff)
+    # end if
+
+    return (True, None)
+
 def get_acc_info (params):
     ''' Function to get info from the accelerometer '''
 
@@ -249,10 +279,18 @@ def get_acc_info (params):
     diff_i2c = 0
     bf_i2c = time.time ()
 
-    (status,alevel) = accel.get_fifolevel(A)
-    if not status:
-        return (False, "Unable to get the fifo level on the accelerometer device. The error was %s" % alevel)
+    # Get the data taken in the snapshot of the iteration, if any
+    raw = imu['raw']
+
+    if raw != None:
+        status = raw['acc_fifo']
+    else:
+        # Drain the FIFO with block reads of several samples
+        samples = accel.read_fifo_fast (A)
+        status = A['fifo_status']
     # end if
+    alevel = status[0]
+    count_fifo (imu['fifo']['accel'], status)
 
     # Store the level value
     params['acc_nvalues'].append (alevel)
@@ -260,10 +298,6 @@ def get_acc_info (params):
     af_i2c = time.time ()
     diff_i2c += (af_i2c - bf_i2c)
 
-    if alevel == 31:
-        print "Fifo overrun on the accelerometer device"
-    # end if
-
     if alevel == 0:
         # Nothing to do
 
@@ -286,43 +320,16 @@ def get_acc_info (params):
         return (True, None)
     # end if
 
-    values = {}
-    while alevel > 0:
-
-        bf_i2c = time.time ()
-
-        (status, dxyz) = accel.get_block_xyz(A)
-        if not status:
-            return (False, "Unable to get the accelerometer values. The error was %s" % dxyz)
-        # end if
-
-        af_i2c = time.time ()
-        diff_i2c += (af_i2c - bf_i2c)
-
-        # Store data for debug porposes
-        params['acc_data'].append (dxyz)
-
-        values['x'],values['y'],values['z'] = dxyz
-
-        for axis in ['x','y', 'z']:
-
-            # Take out the first item
-            imu['accel']['mean_data'][axis].pop (0)
-
-            # Insert the obtained new value        
-            imu['accel']['mean_data'][axis].append (values[axis])
-        # end for
-
-        alevel -= 1
-    # end while
+    # Decode all the samples of the snapshot at once
+    if raw != None:
+        samples = accel.decode_block_xyz_array (A, raw['accel'])
+    # end if
 
-    values['x'] = numpy.mean (imu['accel']['mean_data']['x'])
-    values['y'] = numpy.mean (imu['accel']['mean_data']['y'])
-    values['z'] = numpy.mean (imu['accel']['mean_data']['z'])
+    # Store data for debug porposes
+    params['acc_data'].extend (map (tuple, samples))
 
-    x_a = values['x']
-    y_a = values['y']
-    z_a = values['z']
+    # Smooth all the samples at once
+    (x_a, y_a, z_a) = imu['accel']['filter'].update (samples)
 
     norm = numpy.sqrt (x_a**2 + y_a**2 + z_a**2)
     if norm == 0:
@@ -375,9 +382,10 @@ def get_mag_info (params):
     bf_i2c = time.time ()
 
     # Get raw data from the magnetometer
-    (status, values) = mag.get_block_xyz (M)
-    if not status:
-        return (False, "Unable to get the heading. The error was %s" % values)
+    if imu['raw'] != None:
+        values = mag.decode_block_xyz (M, imu['raw']['mag'])
+    else:
+        values = mag.decode_block_xyz (M, read_request (imu, mag.block_xyz_request (M)))
     # end if
 
     af_i2c = time.time ()
@@ -424,7 +432,11 @@ def get_alt_info (params):
     bf_i2c = time.time ()
 
     # Calculate altitude
-    (status, values) = alt.get_alt_ai (P)
+    if imu['raw'] != None:
+        (status, values) = alt.decode_alt_ai (P, imu['raw']['alt'])
+    else:
+        (status, values) = alt.decode_alt_ai (P, read_request (imu, alt.alt_ai_request (P)))
+    # end if
     if not status:
         return (False, "Unable to get the information from IMU device. The error was %s" % values)
 
@@ -455,6 +467,100 @@ def get_alt_info (params):
     return (True, None)
 
 
+def last_time (params, key):
+    ''' Get the last time registered under the key, or 0 if there is none '''
+    if not params['con_time'][0].has_key (key):
+        return 0.0
+    # end if
+    return params['con_time'][0][key][-1]
+
+def read_request (imu, request):
+    '''
+    Read the block of a request (as the ones of the snapshots) into the
+    buffer of the IMU, so the reads do not create lists
+    '''
+    (DEV, start_address, nbytes) = request
+    common_i2c.read_block_into_fast (DEV, start_address, imu['buffer'], nbytes)
+    return imu['buffer']
+
+def take_snapshot (params):
+    '''
+    Read the FIFO levels of the gyro and the accelerometer, the
+    magnetometer and the altimeter with one combined transfer and then
+    the samples stored in the FIFOs with another one
+    '''
+    try:
+        return (True, take_snapshot_fast (params))
+    except common_i2c.I2CError as e:
+        return (False, str (e))
+
+def without_samples (raw):
+    '''
+    Get a copy of a snapshot without the samples of the FIFOs. A stale
+    snapshot is served with the values of the magnetometer and the
+    altimeter, but its samples were already integrated and filtered
+    '''
+    raw = dict (raw)
+    raw['gyro_fifo'] = (0, False, False)
+    raw['acc_fifo'] = (0, False, False)
+    raw['gyro_level'] = 0
+    raw['acc_level'] = 0
+    raw.pop ('gyro', None)
+    raw.pop ('accel', None)
+    return raw
+
+def take_snapshot_fast (params):
+    '''
+    Function to take the snapshot returning the raw data and raising
+    I2CError on failure
+    '''
+    
+    bf = time.time ()
+
+    imu = params['imu']
+    S = imu['snapshot']
+
+    blocks = common_i2c.snapshot_fast (S['levels'])
+
+    raw = {}
+    raw['gyro_fifo'] = gyro.decode_fifo_status (imu['gyro'], blocks[0])
+    raw['acc_fifo'] = accel.decode_fifo_status (imu['accel'], blocks[1])
+    raw['gyro_level'] = raw['gyro_fifo'][0]
+    raw['acc_level'] = raw['acc_fifo'][0]
+    raw['mag'] = blocks[2]
+    raw['alt'] = blocks[3]
+
+    # Drain the FIFOs with data
+    key = (raw['gyro_level'] > 0, raw['acc_level'] > 0)
+    lengths = []
+    if key[0]:
+        lengths.append (6*raw['gyro_level'])
+    # end if
+    if key[1]:
+        lengths.append (6*raw['acc_level'])
+    # end if
+
+    if len (lengths) > 0:
+        blocks = common_i2c.snapshot_fast (S['samples'][key], lengths)
+
+        if key[0]:
+            raw['gyro'] = blocks.pop (0)
+        # end if
+        if key[1]:
+            raw['accel'] = blocks.pop (0)
+        # end if
+    # end if
+
+    # Register time to perform i2c operations
+    diff = time.time () - bf
+    if not params['con_time'][0].has_key('i2c_snapshot'):
+        params['con_time'][0]['i2c_snapshot'] = [diff]
+    else:
+        params['con_time'][0]['i2c_snapshot'].append (diff)
+    # end if
+
+    return raw
+
 def get_info (params):
     '''
     Get information from IMU device
@@ -490,12 +596,47 @@ def get_info (params):
     # Variable to indicate if there is new data available from gyro
     params['new_gyro_data'] = False
 
+    if imu['recovery'] != None:
+        recovery_time = imu['recovery']['time']
+    # end if
+
+    # Read all the devices at once if the snapshots are enabled. With
+    # the i2c worker the snapshot was requested on the previous iteration
+    imu['raw'] = None
+    if imu['snapshot'] != None:
+        if imu['prefetch'] != None:
+            (status, raw) = imu['prefetch'].result ()
+            imu['prefetch'] = None
+        else:
+            (status, raw) = common_i2c.recovered (imu['recovery'], 'snapshot', take_snapshot_fast, params)
+        # end if
+        if not status:
+            return (False, "Unable to get the snapshot of the IMU device. The error was %s" % raw)
+        # end if
+        if common_i2c.isstale (imu['recovery'], 'snapshot'):
+            raw = without_samples (raw)
+        # end if
+        imu['raw'] = raw
+    # end if
+
     # Get info from the gyro device
-    (status, message) = get_gyro_info (params)
+    try:
+        (status, message) = common_i2c.recovered_fast (imu['recovery'], 'gyro', get_gyro_info, params)
+    except common_i2c.I2CError as e:
+        (status, message) = (False, e)
+    # end try
     if not status:
         return (False, "Unable to get info from the gyro device. The error was %s" % message)
     # end if
 
+    # A stale result of the gyro has no new samples to integrate
+    if common_i2c.isstale (imu['recovery'], 'gyro'):
+        G['x'] = 0.0
+        G['y'] = 0.0
+        G['z'] = 0.0
+        params['new_gyro_data'] = False
+    # end if
+
     # Set pitch, roll and heading with the data from the gyro
     imu['r'] += G['x']*imu['r_quadrants']['sign']
     imu['r_tocheck'] += G['x']*imu['r_quadrants_tocheck']['sign']
@@ -513,7 +654,11 @@ def get_info (params):
 
 
     # Get info from the acelerometer device
-    (status, message) = get_acc_info (params)
+    try:
+        (status, message) = common_i2c.recovered_fast (imu['recovery'], 'accel', get_acc_info, params)
+    except common_i2c.I2CError as e:
+        (status, message) = (False, e)
+    # end try
     if not status:
         return (False, "Unable to get info from the acclerometer device. The error was %s" % message)
     # end if
@@ -522,28 +667,51 @@ def get_info (params):
     imu['p'] = imu['p']*params['comp'] + (1-params['comp'])*imu['accel']['p']
     imu['r'] = imu['r']*params['comp'] + (1-params['comp'])*imu['accel']['r']
 
-    # Get info from the magnetometer device
-    (status, message) = get_mag_info (params)
-    if not status:
-        return (False, "Unable to get info from the magnetometer device. The error was %s" % message)
+    # Get info from the magnetometer device, unless the bus time of the iteration is spent
+    # (the values of the last read are kept until the next iteration)
+    if common_i2c.budget_allows ('mag', last_time (params, 'i2c_mag')):
+        try:
+            (status, message) = common_i2c.recovered_fast (imu['recovery'], 'mag', get_mag_info, params)
+        except common_i2c.I2CError as e:
+            (status, message) = (False, e)
+        # end try
+        if not status:
+            return (False, "Unable to get info from the magnetometer device. The error was %s" % message)
+        # end if
     # end if
 
-    # Get info grom the altimeter device
-    (status, message) = get_alt_info (params)
-    if not status:
-        return (False, "Unable to get info from the altimeter device. The error was %s" % message)
+    # Get info grom the altimeter device, unless the bus time of the iteration is spent
+    # (the values of the last read are kept until the next iteration)
+    if common_i2c.budget_allows ('alt', last_time (params, 'i2c_alt')):
+        try:
+            (status, message) = common_i2c.recovered_fast (imu['recovery'], 'alt', get_alt_info, params)
+        except common_i2c.I2CError as e:
+            (status, message) = (False, e)
+        # end try
+        if not status:
+            return (False, "Unable to get info from the altimeter device. The error was %s" % message)
+        # end if
     # end if
 
-    # Get temperatures
-    # (status, temp) = gyro.get_temp (G)
-    # if not status:
-    #     return (False, "Unable to get the information from IMU device. The error was %s" % temp)
+    # Get the temperature of the gyro every few iterations to follow the
+    # drift of its bias (the bias of the last read is kept meanwhile)
+    if G.has_key ('temp_comp'):
+        T = G['temp_comp']
+        T['count'] += 1
+        if T['count'] >= T['period'] and common_i2c.budget_allows ('gyro_temp', last_time (params, 'i2c_gyro_temp')):
+            T['count'] = 0
+            try:
+                (status, message) = common_i2c.recovered_fast (imu['recovery'], 'gyro_temp', update_gyro_temp, params)
+            except common_i2c.I2CError as e:
+                (status, message) = (False, e)
+            # end try
+            if not status:
+                return (False, "Unable to get the temperature of the gyro device. The error was %s" % message)
+            # end if
+        # end if
     # end if
 
-    # temp = 0
-    # imu['tg'] = temp
-    # G['t'] = temp
-
+    # Get temperatures
     # (status, temp) = mag.get_temp (M)
     # if not status:
     #     return (False, "Unable to get the information from IMU device. The error was %s" % temp)
@@ -554,6 +722,22 @@ def get_info (params):
     # A['t'] = temp
     # M['t'] = temp
 
+    # Request the snapshot of the next iteration to the i2c worker, so
+    # it is taken while the actuators compute the outputs
+    if imu['snapshot'] != None and params.has_key ('io_worker') and params['io_worker'] != None:
+        imu['prefetch'] = params['io_worker'].submit (common_i2c.recovered, imu['recovery'], 'snapshot', take_snapshot_fast, params)
+    # end if
+
+    # Register the time lost recovering from the errors of the bus
+    if imu['recovery'] != None:
+        diff = imu['recovery']['time'] - recovery_time
+        if not params['con_time'][0].has_key('i2c_recovery_imu'):
+            params['con_time'][0]['i2c_recovery_imu'] = [diff]
+        else:
+            params['con_time'][0]['i2c_recovery_imu'].append (diff)
+        # end if
+    # end if
+
     # Register time
     af = time.time ()
     diff = af - bf
@@ -614,7 +798,7 @@ def init_gyro (imu):
     gyro.reset ()
 
     # Create the gyro context
-    G = gyro.Init (scale = '500dps')
+    G = gyro.Init (scale = '500dps', shadow = 'cache')
     if G['error'][0]:
         return (False, "Unable to initialize the IMU device. The gyro context could not be created. The error was %s" % G['error'][1])
     # end if
@@ -679,6 +863,17 @@ def init_gyro (imu):
         i += 1
     # end for
 
+    # Calibration data as arrays of the x, y and z values, to calibrate
+    # all the samples of an iteration at once
+    G['cal'] = {}
+    for key in ['pos_bias', 'neg_bias', 'min_gd', 'max_gd', 'min_cd', 'max_cd']:
+        G['cal'][key] = numpy.array ([G[key]['x'], G[key]['y'], G[key]['z']])
+    # end for
+
+    # Sign conversion to aling the y axis with the accelerometer (to
+    # follow the convention of axis that is explained in the AN3192 file)
+    G['cal']['sign'] = numpy.array ([1.0, -1.0, 1.0])
+
     # Get the data rate
     (status,drbw) = gyro.get_drbw (G)
     if not status:
@@ -690,14 +885,50 @@ def init_gyro (imu):
 
     return (True, None)
 
-def init_acc (imu):
-    ''' Function to initialize the accelerometer device '''
+def init_gyro_temp (imu, period):
+    '''
+    Function to prepare the compensation of the gyro bias with the
+    temperature. The biases of the calibration file are taken as the
+    ones of the temperature on the initialization, and the table of
+    temp_bias.npz gives their drift from it
+    period: number of iterations between the reads of the temperature
+    '''
+    G = imu['gyro']
+
+    cal_file = get_file ("temp_bias.npz")
+    try:
+        table = temp_bias.load (cal_file)
+    except (IOError, OSError) as e:
+        return (False, "Unable to load the bias of the gyro depending on the temperature from %s. The error was %s" % (cal_file, e))
+    # end try
+
+    try:
+        temp = gyro.get_temp_fast (G)
+    except common_i2c.I2CError as e:
+        return (False, "Unable to get the temperature of the gyro device. The error was %s" % e)
+    # end try
+
+    G['temp_comp'] = {'table': table, 'period': period, 'count': 0,
+                      'reference': table.lookup (temp),
+                      'pos_bias': G['cal']['pos_bias'].copy (),
+                      'neg_bias': G['cal']['neg_bias'].copy ()}
+    G['t'] = temp
+    imu['tg'] = temp
+
+    return (True, None)
+
+def init_acc (imu, kind = 'boxcar', length = 20):
+    '''
+    Function to initialize the accelerometer device
+    kind:   low-pass filter of the samples (one of lowpass.FILTERS)
+    length: number of samples of the window of the filter
+    '''
 
     # Reset the registers of the device
     accel.reset ()
 
     # Create the accelerometer context
-    A = accel.Init (dr = 100, scale = '4G')
+    A = accel.Init (dr = 100, scale = '4G', shadow = 'cache')
     if A['error'][0]:
         return (False, "Unable to initialize the IMU device. The accelerometer context could not be created. The error was %s" % A['error'][1])
     # end if
@@ -741,15 +972,20 @@ def init_acc (imu):
 
     imu['accel'] = A
 
-    # Storages for calibrate the accelerometer data
-    imu['accel']['mean_data'] = {}
-    imu['accel']['mdata_length'] = 20
+    # Filter to smooth the accelerometer data, filled with the first
+    # value on the initialization of the IMU
+    imu['accel']['mdata_length'] = length
+    try:
+        imu['accel']['filter'] = lowpass.create (kind, length, freq, (0, 0, 0))
+    except ValueError as e:
+        return (False, "Unable to create the filter of the accelerometer data. The error was %s" % e)
+    # end try
 
     return (True, None)
 
 def init_mag (imu):
     ''' Function to initialize the magnetometer device '''
-    M = mag.Init ()
+    M = mag.Init (shadow = 'cache')
     if M['error'][0]:
         return (False, "Unable to initialize the IMU device. The magnetometer context could not be created. The error was %s" % M['error'][1])
     # end if
@@ -775,7 +1011,7 @@ def init_mag (imu):
 
 def init_alt (imu):
     ''' Funtion to initialize the altimeter device '''
-    P = alt.Init ()
+    P = alt.Init (shadow = 'cache')
     if P['error'][0]:
         return (False, "Unable to initialize the IMU device. The altimeter context could not be created. The error was %s" % P['error'][1])
     # end if
@@ -784,6 +1020,47 @@ def init_alt (imu):
 
     return (True, None)
 
+def init_snapshot (imu):
+    ''' Function to prepare the snapshots of the IMU devices '''
+    G = imu['gyro']
+    A = imu['accel']
+    M = imu['mag']
+    P = imu['alt']
+
+    (status, fd) = common_i2c.snapshot_open ()
+    if not status:
+        return (False, fd)
+    # end if
+
+    # FIFO levels, magnetometer and altimeter data
+    (status, levels) = common_i2c.snapshot_plan (fd, [gyro.fifolevel_request (G),
+                                                      accel.fifolevel_request (A),
+                                                      mag.block_xyz_request (M),
+                                                      alt.alt_ai_request (P)])
+    if not status:
+        return (False, levels)
+    # end if
+
+    # Samples of the FIFOs (32 levels) depending on which ones have data
+    samples = {}
+    for key in [(True, True), (True, False), (False, True)]:
+        requests = []
+        if key[0]:
+            requests.append (gyro.block_xyz_request (G, 32))
+        # end if
+        if key[1]:
+            requests.append (accel.block_xyz_request (A, 32))
+        # end if
+        (status, samples[key]) = common_i2c.snapshot_plan (fd, requests)
+        if not status:
+            return (False, samples[key])
+        # end if
+    # end for
+
+    imu['snapshot'] = {'fd': fd, 'levels': levels, 'samples': samples}
+
+    return (True, None)
+
 def initialize (params):
     
     if type (params) != dict:
@@ -799,7 +1076,21 @@ def initialize (params):
     if not status:
         return (False, "Unable to initialize the gyro device. The error was %s" % message)
     # end if
-    (status, message) = init_acc (imu)
+    if params.has_key ('gyro_temp_period') and params['gyro_temp_period'] != None:
+        (status, message) = init_gyro_temp (imu, params['gyro_temp_period'])
+        if not status:
+            return (False, "Unable to initialize the temperature compensation of the gyro device. The error was %s" % message)
+        # end if
+    # end if
+    kind = 'boxcar'
+    if params.has_key ('acc_filter') and params['acc_filter'] != None:
+        kind = params['acc_filter']
+    # end if
+    length = 20
+    if params.has_key ('acc_window') and params['acc_window'] != None:
+        length = params['acc_window']
+    # end if
+    (status, message) = init_acc (imu, kind, length)
     if not status:
         return (False, "Unable to initialize the accelerometer device. The error was %s" % message)
     # end if
@@ -807,11 +1098,53 @@ def initialize (params):
     if not status:
         return (False, "Unable to initialize the magnetometer device. The error was %s" % message)
     # end if
+
+    # Set the FIFO thresholds to the samples of a period of the loop, so
+    # the watermark status tells if the drains get a whole period
+    if params.has_key ('fifo_watermark') and params['fifo_watermark'] and params.has_key ('dt'):
+        for (module, key) in [(gyro, 'gyro'), (accel, 'accel')]:
+            (status, message) = module.set_watermark (imu[key], params['dt'])
+            if not status:
+                return (False, "Unable to set the FIFO watermark of the %s device. The error was %s" % (key, message))
+            # end if
+        # end for
+    # end if
+
+    # Counters of the drains of the FIFOs
+    imu['fifo'] = {}
+    for key in ['gyro', 'accel']:
+        imu['fifo'][key] = {'drains': 0, 'samples': 0, 'watermark': 0, 'overrun': 0}
+    # end for
     (status, message) = init_alt (imu)
     if not status:
         return (False, "Unable to initialize the altimeter device. The error was %s" % message)
     # end if
 
+    # Retry the failed operations on the bus and serve the last values
+    # of the devices while they are failing. The devices get their
+    # configuration back from the shadow registers when they recover
+    imu['recovery'] = None
+    if params.has_key ('i2c_recovery') and params['i2c_recovery'] != None:
+        imu['recovery'] = common_i2c.recovery (params['i2c_recovery'])
+        for key in ['gyro', 'accel', 'mag', 'alt']:
+            common_i2c.set_reinit (imu['recovery'], key, common_i2c.reinit_device_fast, imu[key])
+        # end for
+    # end if
+
+    # Buffer for the reads of the samples out of the snapshots
+    imu['buffer'] = bytearray (6)
+
+    # Prepare the snapshots to read all the devices at once
+    imu['snapshot'] = None
+    imu['raw'] = None
+    imu['prefetch'] = None
+    if params.has_key ('snapshot') and params['snapshot']:
+        (status, message) = init_snapshot (imu)
+        if not status:
+            return (False, "Unable to prepare the snapshots of the IMU device. The error was %s" % message)
+        # end if
+    # end if
+
 
     # Initialize pitch, roll and heading values
     ## PITCH AND ROLL
@@ -835,11 +1168,8 @@ def initialize (params):
         z = z/norm
     # end if
         
-    # Initialize mean data vectors for the accelerometer with the
-    # first value
-    imu['accel']['mean_data']['x'] = [x]*imu['accel']['mdata_length']
-    imu['accel']['mean_data']['y'] = [y]*imu['accel']['mdata_length']
-    imu['accel']['mean_data']['z'] = [z]*imu['accel']['mdata_length']
+    # Initialize the filter of the accelerometer with the first value
+    imu['accel']['filter'].reset ((x, y, z))
     
     (status, vals) = accel.get_pitch_roll (A, normalize = False, values = (x,y,z,norm))
     if not status:
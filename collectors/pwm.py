@@ -4,6 +4,7 @@
 import sys
 sys.path.append ("../")
 import lib.pwm as lpwm
+import lib.common_i2c as common_i2c
 import lib.common as common
 
 def initialize (params):
@@ -18,7 +19,7 @@ def initialize (params):
     lpwm.reset ()
 
     # Create pwm context
-    params['pwm'] = lpwm.Init ()
+    params['pwm'] = lpwm.Init (shadow = 'cache')
     if params['pwm']['error'][0]:
         return (False, "Unable to initialize the PWM device. The pwm context could not be created. The error was %s" % params['pwm']['error'][1])
     
@@ -36,4 +37,11 @@ def initialize (params):
     if not status:
         return (False, "Unable to initialize the PWM device. The error was %s" % message)
 
+    # Retry the failed writes of the motors within the budget. The
+    # writes never back off nor get stale results, the error is raised
+    params['pwm_recovery'] = None
+    if params.has_key ('i2c_recovery') and params['i2c_recovery'] != None:
+        params['pwm_recovery'] = common_i2c.recovery (params['i2c_recovery'])
+    # end if
+
     return (True, None)
@@ -0,0 +1,93 @@
+# Program to fit the bias of the gyro depending on the temperature. The
+# device has to be at rest while its temperature changes (for example
+# while it warms up after being powered on). The angular rates and the
+# temperatures are logged in temp_log.npz and the table fitted from
+# them is saved in temp_bias.npz, to be copied with the rest of the
+# calibration files
+#
+# Usage:
+#   python temp_bias.py [seconds]   log the device and fit the table
+#   python temp_bias.py temp_log.npz  fit the table of a previous log
+
+import time
+import sys
+import signal
+import numpy
+
+sys.path.append ("../../../lib")
+import gyro
+import temp_bias
+
+LOG_FILE = "temp_log.npz"
+TABLE_FILE = "temp_bias.npz"
+DURATION = 1800             # Default seconds of the log
+PERIOD = 1.0                # Seconds between the logged values
+
+ctrl = {}
+ctrl['STOP'] = False
+def control_c_handler(signal, frame):
+    print
+    print 'Stopping the log'
+    ctrl['STOP'] = True
+
+if len (sys.argv) > 1 and sys.argv[1].endswith (".npz"):
+    # Fit a previous log
+    log = numpy.load (sys.argv[1])
+    temps = log['temps']
+    rates = log['rates']
+else:
+    duration = DURATION
+    if len (sys.argv) > 1:
+        duration = float (sys.argv[1])
+
+    signal.signal(signal.SIGINT, control_c_handler)
+
+    # Initializing with the scale of the collector
+    gyro.reset ()
+    G = gyro.Init (scale = '500dps')
+    if G['error'][0]:
+        print 'Failed while initializing gyro'
+        sys.exit(0)
+
+    (status, message) = gyro.enable_fifo (G, True)
+    if not status:
+        print message
+        sys.exit (0)
+
+    (status, message) = gyro.set_fifomode (G, 'stream')
+    if not status:
+        print message
+        sys.exit (0)
+
+    # Mean of the angular rates of each period with its temperature
+    temps = []
+    rates = []
+    start = time.time ()
+    gyro.read_fifo (G)
+    while not ctrl['STOP'] and time.time () - start < duration:
+        time.sleep (PERIOD)
+        (status, samples) = gyro.read_fifo (G)
+        if not status:
+            print samples
+            continue
+        if len (samples) == 0:
+            continue
+
+        temps.append (gyro.get_temp_fast (G))
+        rates.append (samples.mean (axis = 0))
+        print "temp: {:4d}, x: {:7.3f}, y: {:7.3f}, z: {:7.3f}".format (temps[-1], rates[-1][0], rates[-1][1], rates[-1][2])
+
+    temps = numpy.array (temps)
+    rates = numpy.array (rates)
+    numpy.savez (LOG_FILE, temps = temps, rates = rates)
+    print "Log saved in the file %s" % LOG_FILE
+
+if len (temps) == 0:
+    print "There is no data to fit"
+    sys.exit (0)
+
+table = temp_bias.fit (temps, rates)
+temp_bias.save (TABLE_FILE, table)
+print "Table saved in the file %s" % TABLE_FILE
+for (temp, bias) in zip (table.temps (), table.bias):
+    print "temp: {:6.1f}, x: {:7.3f}, y: {:7.3f}, z: {:7.3f}".format (temp, bias[0], bias[1], bias[2])
@@ -3,9 +3,10 @@
 # Library for the Raspberry Pi that interfaces with LSM303DLHC
 # accelerometer on Polulu boards
 
-from smbus import SMBus
 from common_i2c import *
 import bitOps
+import npz_cache
+import regmap
 import numpy
 import time
 import os
@@ -13,6 +14,8 @@ import os
 DEV_SLAVE_ADDR = 0x19         # Default device slave address
 DEV_BUS_ID     = 1            # Default device bus id
 CALIBRATION_ITERATIONS = 20   # Default number for calibration operations
+FIFO_DEPTH     = 32           # Number of samples of the FIFO
+FIFO_CHUNK     = 30           # Bytes of each block read of the FIFO (5 samples)
 
 # Sign definition fot the accelerometer in the AltIMU-10
 # Invert the X axis to make the sensing values correspond to the device body axes.   
@@ -22,7 +25,8 @@ def Init (bus = None,
           slaveAddr = DEV_SLAVE_ADDR, 
           cal_iter = CALIBRATION_ITERATIONS,
           scale = None, dr = 10, mode = 'normal',
-          sign_def = SIGN_DEFINITION):
+          sign_def = SIGN_DEFINITION,
+          shadow = None):
     '''
     bus:       indicates the bus associated to the i2c device /dev/i2cX
     slaveAddr: indicates the address of the slave device
@@ -31,12 +35,15 @@ def Init (bus = None,
     dr:        indicates the data rate
     mode:      indicates the mode to power the device
     sign_def:  indicates the sign definition to orientate the device correctly
+    shadow:    indicates the mode of the shadow registers ('cache' or 'check').
+               None disables the shadow
     '''
     A = {}
     A['bus'] = bus
     if bus == None:
         try:
-            A['bus'] = SMBus(DEV_BUS_ID)
+            A['bus'] = open_bus(DEV_BUS_ID)
+            A['bus_id'] = DEV_BUS_ID
         except IOError as e:
             A['error'] = (True, "Unable to create the accelerometer. The error was: I/O error (%s): %s" %(e.errno, e.strerror))
             return A
@@ -45,6 +52,16 @@ def Init (bus = None,
     A['sign_def'] = sign_def
     A['error'] = (False, None)
 
+    # Buffer to drain the FIFO without creating lists
+    A['fifo_buffer'] = bytearray (6*FIFO_DEPTH)
+
+    # Shadow the registers to save the reads of the masked writes
+    if shadow != None:
+        (status, message) = enable_shadow (A, shadow)
+        if not status:
+            A['error'] = (True, message)
+            return A
+
     # Set the gain for the out values
     if scale == None:
         (status, scale) = get_scale(A)
@@ -102,7 +119,7 @@ __INT2_DURATION   = Register ('INT2_DURATION', 0x37, mode = 'rw')
 
 # Click recognition not used (Only here for completeness)
 __CLICK_CFG       = Register ('CLICK_CFG', 0x38, mode = 'rw')
-__CLICK_SRC       = Register ('CLICK_SRC', 0x39, mode = 'rw')
+__CLICK_SRC       = Register ('CLICK_SRC', 0x39, mode = 'rw', volatile = True)
 __CLICK_THS       = Register ('CLICK_THS', 0x3a, mode = 'rw')
 __TIME_LIMIT      = Register ('TIME_LIMIT', 0x3b, mode = 'rw')
 __TIME_LATENCY    = Register ('TIME_LATENCY', 0x3c, mode = 'rw')
@@ -211,6 +228,95 @@ __FIFOMode = {
 # Watermark status
 __WTM = {'lower': 0x0, 'equal_greater': 0x1}
 
+##########
+# FIELDS #
+##########
+
+__Map = regmap.RegisterMap ('accelerometer')
+
+def __decode_powermode (ctrl1):
+    ''' Get the power mode (power-down data rate or the low-power bit) '''
+    if __FIELD_DR.decode (ctrl1) == 'power_down':
+        return 'power_down'
+    return __FIELD_LPen.decode (ctrl1)
+
+__FIELD_Xen       = __Map.field ('x axis enable', __CTRL_REG1, __MASK_Xen, __Enable)
+__FIELD_Yen       = __Map.field ('y axis enable', __CTRL_REG1, __MASK_Yen, __Enable)
+__FIELD_Zen       = __Map.field ('z axis enable', __CTRL_REG1, __MASK_Zen, __Enable)
+__FIELD_LPen      = __Map.field ('power mode', __CTRL_REG1, __MASK_LPen, __PowerMode)
+__FIELD_DR        = __Map.field ('data rate', __CTRL_REG1, __MASK_DR, __DR)
+__FIELD_PowerMode = __Map.derived ('power mode', __decode_powermode, __CTRL_REG1)
+__FIELD_FDS       = __Map.field ('filtered data selection', __CTRL_REG2, __MASK_FDS, __FDS)
+__FIELD_HPCF      = __Map.field ('high pass filter cutoff frequency', __CTRL_REG2, __MASK_HPCF, __HPCF)
+__FIELD_HPM       = __Map.field ('high pass filter mode', __CTRL_REG2, __MASK_HPM, __HPM)
+__FIELD_HR        = __Map.field ('high resolution output mode', __CTRL_REG4, __MASK_HR, __Enable)
+__FIELD_FS        = __Map.field ('scale', __CTRL_REG4, __MASK_FS, __Scales)
+__FIELD_BLE       = __Map.field ('endianness', __CTRL_REG4, __MASK_BLE, __Endianness)
+__FIELD_BDU       = __Map.field ('block data update', __CTRL_REG4, __MASK_BDU, __BlockDataUpdate)
+__FIELD_FIFO_EN   = __Map.field ('FIFO enable', __CTRL_REG5, __MASK_FIFO_EN, __Enable)
+__FIELD_BOOT      = __Map.field ('boot mode', __CTRL_REG5, __MASK_BOOT, __BootMode)
+__FIELD_Reference = __Map.field ('reference value', __REFERENCE)
+__FIELD_THR       = __Map.field ('FIFO threshold value', __FIFO_CTRL_REG, __MASK_THR)
+__FIELD_FM        = __Map.field ('FIFO mode', __FIFO_CTRL_REG, __MASK_FM, __FIFOMode)
+__FIELD_FSS       = __Map.field ('FIFO stored data level', __FIFO_SRC_REG, __MASK_FSS)
+__FIELD_EMPTY     = __Map.field ('FIFO empty status', __FIFO_SRC_REG, __MASK_EMPTY, __Enable)
+__FIELD_OVRN      = __Map.field ('FIFO overrun status', __FIFO_SRC_REG, __MASK_OVRN, __Enable)
+__FIELD_WTM       = __Map.field ('watermark status', __FIFO_SRC_REG, __MASK_WTM, __WTM)
+
+#######################
+# GENERATED ACCESSORS #
+#######################
+
+enable_x             = __Map.setter (__FIELD_Xen, 'Enable x Axis')
+isenabled_x          = __Map.getter (__FIELD_Xen, 'Check if x axis is enabled')
+enable_y             = __Map.setter (__FIELD_Yen, 'Enable y Axis')
+isenabled_y          = __Map.getter (__FIELD_Yen, 'Check if y axis is enabled')
+enable_z             = __Map.setter (__FIELD_Zen, 'Enable z Axis')
+isenabled_z          = __Map.getter (__FIELD_Zen, 'Check if z axis is enabled')
+set_powermode        = __Map.setter (__FIELD_LPen, 'Set power mode')
+get_powermode        = __Map.getter (__FIELD_PowerMode, 'Get power mode')
+set_dr               = __Map.setter (__FIELD_DR, 'Set data rate')
+get_dr               = __Map.getter (__FIELD_DR, 'Get data rate')
+set_hpfm             = __Map.setter (__FIELD_HPM, 'Set the high-pass filter mode')
+get_hpfm             = __Map.getter (__FIELD_HPM, 'Get the high-pass filter mode')
+set_hpcf             = __Map.setter (__FIELD_HPCF, 'Set the high-pass filter cutoff frequency')
+get_hpcf             = __Map.getter (__FIELD_HPCF, 'Get the high-pass filter cutoff frequency')
+set_fds              = __Map.setter (__FIELD_FDS, 'Set filtered data selection')
+get_fds              = __Map.getter (__FIELD_FDS, 'Get filtered data selection')
+enable_hr            = __Map.setter (__FIELD_HR, 'Enable high resolution')
+isenabled_hr         = __Map.getter (__FIELD_HR, 'Check if high resolution is enabled')
+get_scale            = __Map.getter (__FIELD_FS, 'Get full scale')
+set_endianness       = __Map.setter (__FIELD_BLE, 'Set endianness')
+get_endianness       = __Map.getter (__FIELD_BLE, 'Get endianness')
+set_bdu              = __Map.setter (__FIELD_BDU, 'Set the block data update')
+get_bdu              = __Map.getter (__FIELD_BDU, 'Get the block data update')
+get_bootmode         = __Map.getter (__FIELD_BOOT, 'Get the boot mode')
+enable_fifo          = __Map.setter (__FIELD_FIFO_EN, 'Enable FIFO')
+isenabled_fifo       = __Map.getter (__FIELD_FIFO_EN, 'Check if FIFO is enabled')
+set_reference        = __Map.setter (__FIELD_Reference, 'Set the reference value')
+get_reference        = __Map.getter (__FIELD_Reference, 'Get the reference value')
+set_fifoth           = __Map.setter (__FIELD_THR, 'Set the FIFO threshold value')
+get_fifoth           = __Map.getter (__FIELD_THR, 'Get the FIFO threshold value')
+set_fifomode         = __Map.setter (__FIELD_FM, 'Set FIFO mode')
+get_fifomode         = __Map.getter (__FIELD_FM, 'Get FIFO mode')
+get_fifolevel        = __Map.getter (__FIELD_FSS, 'Get FIFO stored data level')
+isfifo_empty         = __Map.getter (__FIELD_EMPTY, 'FIFO empty')
+isfifo_full          = __Map.getter (__FIELD_OVRN, 'FIFO full')
+get_watermark_status = __Map.getter (__FIELD_WTM, 'Get the watermark status (FIFO filling is greater or equal than watermark level)')
+
+# Configuration of the device, reading the control registers and the
+# reference with one block read. FIFO_CTRL_REG is read on its own as
+# the block would pop a sample from the FIFO through the out registers
+get_conf = __Map.conf ([
+    ('ctrl1', [('xen', __FIELD_Xen), ('yen', __FIELD_Yen), ('zen', __FIELD_Zen),
+               ('lpen', __FIELD_PowerMode), ('dr', __FIELD_DR)]),
+    ('ctrl2', [('fds', __FIELD_FDS), ('hpcf', __FIELD_HPCF), ('hpfm', __FIELD_HPM)]),
+    ('ctrl4', [('hr', __FIELD_HR), ('fs', __FIELD_FS), ('ble', __FIELD_BLE), ('bdu', __FIELD_BDU)]),
+    ('ctrl5', [('fifo_en', __FIELD_FIFO_EN), ('boot', __FIELD_BOOT)]),
+    ('referene', __FIELD_Reference),
+    ('fifo_ctrl', [('fifo_th', __FIELD_THR), ('fifo_mode', __FIELD_FM)])
+    ], [(__CTRL_REG1, __REFERENCE)])
+
 #############
 # FUNCTIONS #
 #############
@@ -277,48 +383,6 @@ def print_configuration(A):
     return
 
 
-def enable_x(A, enabled):
-    ''' Enable x Axis '''
-    (status, message) = write(A, __CTRL_REG1, __MASK_Xen, __Enable[enabled])
-    if not status:
-        return (False, 'Unable to enable or disable x axis for the accelerometer device. The error was %s' % message)
-    return (True, None)
-    
-def isenabled_x(A):
-    ''' Check if x axis is enabled '''
-    (status, enabled) = read_match(A, __CTRL_REG1, __MASK_Xen, __Enable)
-    if not status:
-        return (False, 'Unable to check if x axis is enabled for the accelerometer device. The error was %s' % enabled)
-    return (True, enabled)
-
-def enable_y(A, enabled):
-    ''' Enable y Axis '''
-    (status, message) = write(A, __CTRL_REG1, __MASK_Yen, __Enable[enabled])
-    if not status:
-        return (False, 'Unable to enable or disable y axis for the accelerometer device. The error was %s' % message)
-    return (True, None)
-
-def isenabled_y(A):
-    ''' Check if y axis is enabled '''
-    (status, enabled) = read_match(A, __CTRL_REG1, __MASK_Yen, __Enable)
-    if not status:
-        return (False, 'Unable to check if y axis is enabled for the accelerometer device. The error was %s' % enabled)
-    return (True, enabled)
-
-def enable_z(A, enabled):
-    ''' Enable z Axis '''
-    (status, message) = write(A, __CTRL_REG1, __MASK_Zen, __Enable[enabled])
-    if not status:
-        return (False, 'Unable to enable or disable z axis for the accelerometer device. The error was %s' % message)
-    return (True, None)
-
-def isenabled_z(A):
-    ''' Check if z axis is enabled '''
-    (status, enabled) = read_match(A, __CTRL_REG1, __MASK_Zen, __Enable)
-    if not status:
-        return (False, 'Unable to check if z axis is enabled for the accelerometer device. The error was %s' % enabled)
-    return (True, enabled)
-
 def set_powerdownmode(A):
     ''' Set power-down mode '''
     (status, message) = write(A, __CTRL_REG1, __MASK_DR, __DR['power_down'])
@@ -327,17 +391,6 @@ def set_powerdownmode(A):
 
     return (True, None)
 
-def set_powermode (A, mode):
-    ''' Set power mode '''
-    if mode not in __PowerMode.keys():
-        return (False, 'Mode %s not in range of allowed power mode values for the accelerometer device' % mode)
-    
-    (status, message) = write (A, __CTRL_REG1, __MASK_LPen, __PowerMode[mode])
-    if not status:
-        return (False, 'Unable to set the power mode on the accelerometer device. The error was %s' % message)
-
-    return (True, None)
-
 def poweron(A, dr, mode):
     ''' Power on the device '''
     (status, message) = set_dr (A, dr)
@@ -346,131 +399,6 @@ def poweron(A, dr, mode):
 
     return set_powermode (A, mode)
 
-def get_powermode(A):
-    ''' Get power mode '''
-    # Check power-down mode
-    (status, powermode) = read_match(A, __CTRL_REG1, __MASK_DR, __DR)
-
-    # Check power-down or normal mode
-    if powermode != 'power_down':
-        (status, powermode) = read_match(A, __CTRL_REG1, __MASK_LPen, __PowerMode)            
-        
-    if not status:
-        return (False, 'Unable to get the power mode on the accelerometer device. The error was %s' % powermode)
-
-    return (True, powermode)
-
-def set_dr(A, datarate):
-    ''' Set data rate '''
-    if datarate not in __DR.keys():
-        return (False, 'Data rate %s not in range of data rate values for the accelerometer device.' % datarate)
-
-    bits = __DR[datarate]
-    (status, message) = write(A, __CTRL_REG1, __MASK_DR, bits)
-    if not status:
-        return (False, 'Unable to set the data rate on the accelerometer device. The error was %s' % message)        
-    return (True, None)
-
-def get_dr(A):
-    ''' Get data rate '''
-    (status, current) = read(A, __CTRL_REG1, __MASK_DR)
-    if not status:
-        return (False, "Unable to get the configurated data rate for the accelerometer device. The error was: %s." % current)
-    
-    # Convert to the proper value in Hz or 'power_down' value
-    for dr in __DR.keys():
-        if __DR[dr] == current:
-            return (True, dr)
-
-    # never reached
-    return (False, "Unable to get the configurated data rate for the accelerometer device")
-
-def set_hpfm(A, mode):
-    ''' Set the high-pass filter mode '''
-    if mode not in __HPM.keys():
-        return (False, 'High pass filter mode %s is not in range of high pass frequency modes for the accelerometer device.' % mode)
-
-    # Obtain the value and write it
-    bits = __HPM[mode]
-    (status, message) = write(A, __CTRL_REG2, __MASK_HPM, bits)
-    if not status:
-        return (False, 'Unable to set the high pass filter mode on the accelerometer device. The error was %s' % message)        
-    return (True, None)
-
-def get_hpfm(A):
-    ''' Get the high-pass filter mode '''
-    (status, current) = read(A, __CTRL_REG2, __MASK_HPM)
-    if not status:
-        return (False, "Unable to get the configurated high pass filter mode on the accelerometer device. The error was: %s." % current)
-
-    for mode in __HPM.keys():
-        if __HPM[mode] == current:
-            return (True, mode)
-
-    # never reached    
-    return (False, "Unable to get the configurated high pass filter mode on the accelerometer device")
-
-def set_hpcf(A, freq):
-    ''' Set the high-pass filter cutoff frequency '''
-    # Check frequency value
-    if freq not in __HPCF.keys():
-        return (False, "Frequency: %s is not in range of high pass frequency cut off values for the accelerometer device." % freq)
-
-    # Obtain the value and write it
-    bits = __HPCF[freq]
-    (status, message) = write(A, __CTRL_REG2, __MASK_HPCF, bits)
-    if not status:
-        return (status, "Unable to set high-pass filter cutoff frequency on the accelerometer device. The error was %s" % message)
-
-    return (True, None)
-
-def get_hpcf(A):
-    ''' Get the high-pass filter cutoff frequency '''
-    (status, current) = read(A, __CTRL_REG2, __MASK_HPCF)
-    if not status:
-        return (False, "Unable to get the high pass filter cutoff frequency on the accelerometer device. The error was: %s" % current)
-    
-    # Convert to the proper value in Hz
-    for freq in __HPCF.keys():
-        if __HPCF[freq] == current:
-            return (True, freq)
-
-    # never reached    
-    return (False, "Unable to get the high pass filter cutoff frequency on the accelerometer device")
-
-def set_fds (A, selection):
-    ''' Set filtered data selection '''
-    if selection not in __FDS.keys():
-        return (False, 'Filtered data selection %s not in range of filtered data selection values for the accelerometer device.' % selection)
-    bits = __FDS[selection]
-    (status, message) = write(A, __CTRL_REG2, __MASK_FDS, bits)
-    if not status:
-        return (False, 'Unable to set the filtered data selection on the accelerometer device. The error was %s' % message)        
-    return (True, None)
-
-def get_fds (A):
-    ''' Get filtered data selection '''
-    (status, fds) = read_match(A, __CTRL_REG2, __MASK_FDS, __FDS)
-    if not status:
-        return (False, 'Unable to get the filtered data selection on the accelerometer device. The error was %s' % fds)        
-
-    return (True, fds)
-
-def enable_hr (A, enabled):
-    ''' Enable high resolution '''
-    (status, message) = write(A, __CTRL_REG4, __MASK_HR, __Enable[enabled])
-    if not status:
-        return (False, 'Unable to enable or disable high resolution for the accelerometer device. The error was %s' % message)
-    return (True, None)
-        
-def isenabled_hr (A):
-    ''' Check if high resolution is enabled '''
-    (status, enabled) = read_match(A, __CTRL_REG4, __MASK_HR, __Enable)
-    if not status:
-        return (False, 'Unable to check if high resolution is enabled on the accelerometer device. The error was %s' % enabled)
-
-    return (True, enabled)
-
 def set_scale(A, scale):
     ''' Set full scale '''
     if not scale in __Scales.keys():
@@ -486,96 +414,18 @@ def set_scale(A, scale):
     
     return (True, None)
 
-def get_scale(A):
-    ''' Get full scale '''
-    (status, scale) = read_match(A, __CTRL_REG4, __MASK_FS, __Scales)
-    if not status:
-        return (False, "Unable to get the scale of the accelerometer device. The error was %s." % scale)
-
-    return (True, scale)
-    
-def set_endianness(A, value):
-    ''' Set endianness '''
-    (status, message) = write(A, __CTRL_REG4, __MASK_BLE, __Endianness[value]) 
-    if not status:
-        return (False, "Unable to set the endianness of the accelerometer device. The error was %s." % message)
-
-    return (True, None)
-    
-def get_endianness(A):
-    ''' Get endianness '''
-    (status, endianness) = read_match(A, __CTRL_REG4, __MASK_BLE, __Endianness)
-    if not status:
-        return (False, "Unable to get the endianness of the accelerometer device. The error was %s." % endianness)
-    
-    return (True, endianness)
-
-def set_bdu(A, value):
-    ''' Set the block data update '''
-    (status, message) = write(A, __CTRL_REG4, __MASK_BDU, __BlockDataUpdate[value]) 
-    if not status:
-        return (False, "Unable to set the block data update of the accelerometer device. The error was %s." % message)
-
-    return (True, None)
-        
-def get_bdu(A):
-    ''' Get the block data update '''
-    (status, bdu) = read_match(A, __CTRL_REG4, __MASK_BDU, __BlockDataUpdate)
-
-    if not status:
-        return (False, "Unable to get the block data update of the accelerometer device. The error was %s." % bdu)
-    
-    return (True, bdu)
-
 def set_bootmode(A, value):
     ''' Set the boot mode '''
     (status, message) = write(A, __CTRL_REG5, __MASK_BOOT, __BootMode[value]) 
     if not status:
         return (False, "Unable to set the boot mode of the accelerometer device. The error was %s." % message)
 
-    return (True, None)
-        
-
-def get_bootmode(A):
-    ''' Get the boot mode '''
-    (status, bootmode) = read_match(A, __CTRL_REG5, __MASK_BOOT, __BootMode)
-    if not status:
-        return (False, "Unable to get the bootmode of the accelerometer device. The error was %s." % bootmode)
-    
-    return (True, bootmode)
-
-def enable_fifo(A, enabled):
-    ''' Enable FIFO '''
-    (status, message) = write(A, __CTRL_REG5, __MASK_FIFO_EN, __Enable[enabled]) 
-    if not status:
-        return (False, "Unable to enable or disable the FIFO on the accelerometer device. The error was %s." % message)
-
-    return (True, None)
-
-def isenabled_fifo(A):
-    ''' Check if FIFO is enabled '''
-    (status, enabled) = read_match(A, __CTRL_REG5, __MASK_FIFO_EN, __Enable)
-    if not status:
-        return (False, "Unable to check if the FIFO is enabled on the accelerometer device. The error was %s." % enabled)
-    
-    return (True, enabled)
-
-def set_reference(A, value):
-    ''' Set the reference value '''
-    (status, message) = write(A, __REFERENCE, 0xff, value) 
-    if not status:
-        return (False, "Unable to set the reference on the accelerometer device. The error was %s." % message)
+    # The reboot reloads the registers from the internal memory
+    invalidate_shadow (A)
 
     return (True, None)
-    
-def get_reference(A):
-    ''' Get the reference value '''
-    (status, reference) = read(A, __REFERENCE, 0xff)
-    if not status:
-        return (False, "Unable to get the reference value on the accelerometer device. The error was: %s" % reference)
+        
 
-    return (True, reference)
-    
 def isdata_overrun(A):
     ''' Check if there was data overrun on each axis '''
     zor = False
@@ -674,26 +524,53 @@ def get_xyz(A):
 def get_block_xyz(A):
     ''' Get the three axis acceleration data '''
     # Get the six values for x, y and z low and high parts
-    (status, values) = read_block (A, __OUT_X_L.get_addr()+0x80, 6)
+    (status, values) = read_block (A, __OUT_X_L.addr+0x80, 6)
     if not status:
         return (False, "Unable to get the axis acceleration data")
 
+    return (True, decode_block_xyz (A, values))
+
+def decode_block_xyz_array (A, values):
+    '''
+    Convert a block of samples into a (N,3) array of accelerations,
+    with the same results as to_g
+    values: block of data with the low and high parts of x, y and z
+    '''
+    data = bitOps.BytesToArray (values)
+    data = bitOps.BytesToArray (data[:len (data) - len (data) % 6], '<u2').reshape (-1, 3)
+
+    # Left-justified 12 bits values
+    data = bitOps.TwosComplementToCustomArray (data >> 4, 11)
+    sign = numpy.array ([A['sign_def']['x'], A['sign_def']['y'], A['sign_def']['z']])
+
+    return data * A['gain'] * sign
+
+def block_xyz_request (A, nsamples = 1):
+    ''' Snapshot request to read the three axis acceleration data '''
+    return (A, __OUT_X_L.addr+0x80, 6*nsamples)
+
+def decode_block_xyz (A, values, offset = 0):
+    '''
+    Convert the six bytes of a sample into the three axis acceleration data
+    values: block of data with the low and high parts of x, y and z
+    offset: position of the sample in the block
+    '''
     # X
-    l = values[0]
-    h = values[1]
+    l = values[offset]
+    h = values[offset + 1]
     x = to_g (A['gain'], h, l, A['sign_def']['x'])
 
     # Y
-    l = values[2]
-    h = values[3]
+    l = values[offset + 2]
+    h = values[offset + 3]
     y = to_g (A['gain'], h, l, A['sign_def']['y'])
 
     # Z
-    l = values[4]
-    h = values[5]
+    l = values[offset + 4]
+    h = values[offset + 5]
     z = to_g (A['gain'], h, l, A['sign_def']['z'])
 
-    return (True, (x,y,z))
+    return (x,y,z)
 
 def calibrate (A, save = False):
     ''' Calibrate the accelerometer '''
@@ -830,12 +707,13 @@ def get_normalized_values (A, x_matrix, calibrate = False):
 
     (x,y,z) = xyz
 
-    if calibrate and not(os.path.isfile(x_matrix)):
-        return (False, "Unable to get the normalize values of each axis. The file with the calibration parameter matrix does not exist")
-        
-    # Calibrate values to provide more accurate
+    # Calibrate values to provide more accurate (the matrix is only
+    # loaded from the file the first time or when the file changes)
     if calibrate:
-        cal_matrix = numpy.load (x_matrix)['data']
+        try:
+            cal_matrix = npz_cache.load (x_matrix)['data']
+        except (IOError, OSError):
+            return (False, "Unable to get the normalize values of each axis. The file with the calibration parameter matrix does not exist")
         (x, y, z) = numpy.dot (numpy.array ([x,y,z,1]), cal_matrix)
 
     # Normalize the acceleration values
@@ -877,181 +755,72 @@ def get_pitch_roll (A, x_matrix = None, calibrate = False, normalize = True, val
     r = rad_to_degrees (r_rad)
     return (True, (float (p), float (r), float (A_abs)))
 
-def set_fifoth(A, value):
-    ''' Set the FIFO threshold value '''
-    (status, message) = write(A, __FIFO_CTRL_REG, __MASK_THR, value) 
-    if not status:
-        return (False, "Unable to set the FIFO threshold value on the accelerometer device. The error was: %s." % message)
-
-    return (True, None)
-    
-def get_fifoth(A):
-    ''' Get the FIFO threshold value '''
-    (status, fifoth) = read(A, __FIFO_CTRL_REG, __MASK_THR)
-    if not status:
-        return (False, "Unable to get the FIFO threshold value on the accelerometer device. The error was %s." % fifoth)
-    return (True, fifoth)
-    
-def set_fifomode(A, value):
-    ''' Set FIFO mode '''
-    (status, message) = write(A, __FIFO_CTRL_REG, __MASK_FM, __FIFOMode[value])         
-    if not status:
-        return (False, "Unable to set the FIFO mode on the accelerometer device. The error was %s." % message)
-
-    return (True, None)
-
-def get_fifomode(A):
-    ''' Get FIFO mode '''
-    (status, fifomode) = read_match(A, __FIFO_CTRL_REG, __MASK_FM, __FIFOMode)
-    if not status:
-        return (False, "Unable to get the fifo mode on the accelerometer device. The error was %s." % fifomode)
-
-    return (True, fifomode)
-
-def get_fifolevel(A):
-    ''' Get FIFO stored data level '''
-    (status, fifolevel) = read(A, __FIFO_SRC_REG, __MASK_FSS)
-    if not status:
-        return (False, "Unable to get the FIFO stored data level on the accelerometer device. The error was %s." % fifolevel)
-    return (True, fifolevel)
-    
-def isfifo_empty(A):
-    ''' FIFO empty '''
-    (status, fifoempty) = read_match(A, __FIFO_SRC_REG, __MASK_EMPTY, __Enable)
-    if not status:
-        return (False, "Unable to check if FIFO is empty on the accelerometer device. The error was %s." % fifoempty)
-    
-    return (True, fifoempty)
-    
-def isfifo_full(A):
-    ''' FIFO full '''
-    (status, fifofull) = read_match(A, __FIFO_SRC_REG, __MASK_OVRN, __Enable)
-    if not status:
-        return (False, "Unable to check if FIFO is full on the accelerometer device. The error was %s." % fifofull)
-    
-    return (True, fifofull)
-    
-def get_watermark_status(A):
-    ''' Get the watermark status (FIFO filling is greater or equal than watermark level) '''
-    (status, wtm) = read_match(A, __FIFO_SRC_REG, __MASK_WTM, __WTM)
-    if not status:
-        return (False, "Unable to get the watermark status on the accelerometer device. The error was %s." % wtm)
-    
-    return (True, wtm)
-
-def get_conf (A):
-
-    A['conf'] = {}
-
-    # CTRL_REG1
-    A['conf']['ctrl1'] = {}
-    ctrl1 = A['conf']['ctrl1']
-
-    (status, value) = isenabled_x(A)
-    if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    ctrl1['xen'] = value
-
-    (status, value) = isenabled_y(A)
-    if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    ctrl1['yen'] = value
-
-    (status, value) = isenabled_z(A)
-    if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    ctrl1['zen'] = value
-
-    (status, value) = get_powermode(A)
-    if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    ctrl1['lpen'] = value
-
-    (status, value) = get_dr(A)
-    if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    ctrl1['dr'] = value
-
-    # CTRL_REG2
-    A['conf']['ctrl2'] = {}
-    ctrl2 = A['conf']['ctrl2']
-
-    (status, value) = get_fds(A)
-    if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    ctrl2['fds'] = value
-
-    (status, value) = get_hpcf(A)
-    if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    ctrl2['hpcf'] = value
-
-    (status, value) = get_hpfm(A)
-    if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    ctrl2['hpfm'] = value
-
-    # CTRL_REG4
-    A['conf']['ctrl4'] = {}
-    ctrl4 = A['conf']['ctrl4']
-
-    (status, value) = isenabled_hr(A)
-    if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    ctrl4['hr'] = value
-
-    (status, value) = get_scale(A)
-    if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    ctrl4['fs'] = value
-
-    (status, value) = get_endianness(A)
-    if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    ctrl4['ble'] = value
-
-    (status, value) = get_bdu(A)
-    if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    ctrl4['bdu'] = value
-
-    # CTRL_REG5
-    A['conf']['ctrl5'] = {}
-    ctrl5 = A['conf']['ctrl5']
+def fifolevel_request (A):
+    ''' Snapshot request to read the FIFO stored data level '''
+    return (A, __FIFO_SRC_REG.addr, 1)
 
-    (status, value) = isenabled_fifo(A)
-    if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    ctrl5['fifo_en'] = value
-
-    (status, value) = get_bootmode(A)
-    if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    ctrl5['boot'] = value
+def decode_fifolevel (A, values):
+    ''' Get the FIFO stored data level from the FIFO_SRC_REG value '''
+    return bitOps.GetValueUnderMask(values[0], __MASK_FSS)
 
-    # REFERENCE
-    (status, value) = get_reference(A)
-    if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    A['conf']['referene'] = value
-
-    # FIFO_CTRL
-    A['conf']['fifo_ctrl'] = {}
-    fifo_ctrl = A['conf']['fifo_ctrl']
+def decode_fifo_status (A, values):
+    '''
+    Get the (level, watermark, overrun) status of the FIFO from the
+    FIFO_SRC_REG value. The level saturates at 31, the overrun bit
+    tells the FIFO is full (FIFO_DEPTH samples)
+    '''
+    src = values[0]
+    level = bitOps.GetValueUnderMask (src, __MASK_FSS)
+    if src & __MASK_OVRN:
+        level = FIFO_DEPTH
+    return (level, (src & __MASK_WTM) != 0, (src & __MASK_OVRN) != 0)
 
-    (status, value) = get_fifoth(A)
+def set_watermark (A, period):
+    '''
+    Set the FIFO threshold to the number of samples taken in a period of
+    the loop at the data rate of the device, so the watermark status
+    tells if the FIFO holds the samples of a whole period
+    period: period of the loop in seconds
+    '''
+    (status, rate) = get_dr (A)
     if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    fifo_ctrl['fifo_th'] = value
-
-    (status, value) = get_fifomode(A)
+        return (False, rate)
+    if rate == 'power_down':
+        return (False, "Unable to set the watermark of the accelerometer device. The device is powered down")
+    threshold = min (max (int (numpy.ceil (rate * period)), 1), FIFO_DEPTH - 1)
+    (status, message) = set_fifoth (A, threshold)
     if not status:
-        return (False, "Unable to get the accelerometer configuration. The error was %s" % value)
-    fifo_ctrl['fifo_mode'] = value
-
-    return (True, False)
+        return (False, message)
+    return (True, threshold)
 
+def read_fifo (A, max_samples = FIFO_DEPTH):
+    '''
+    Drain the samples stored in the FIFO and get them as a (N,3) array
+    of accelerations
+    max_samples: maximum number of samples to read
+    '''
+    try:
+        return (True, read_fifo_fast (A, max_samples))
+    except I2CError as e:
+        return (False, "Unable to read the FIFO of the accelerometer device. The error was: %s" % e)
 
+def read_fifo_fast (A, max_samples = FIFO_DEPTH):
+    '''
+    Drain the samples stored in the FIFO raising I2CError on failure.
+    The samples are read with blocks of FIFO_CHUNK bytes, or with one
+    transfer on the buses reading into buffers, so a full FIFO takes
+    the read of the level plus 7 blocks instead of 33 reads. The (level,
+    watermark, overrun) status of the FIFO is stored in A['fifo_status']
+    '''
+    # Status of the FIFO of the last drain
+    A['fifo_status'] = decode_fifo_status (A, [read_fast (A, __FIFO_SRC_REG, 0xff)])
+    nsamples = min (A['fifo_status'][0], max_samples)
+    if nsamples <= 0:
+        return numpy.zeros ((0, 3))
+
+    nbytes = read_fifo_into_fast (A, __OUT_X_L.addr+0x80, A['fifo_buffer'], 6*nsamples, FIFO_CHUNK)
+    return decode_block_xyz_array (A, bitOps.BytesToArray (A['fifo_buffer'])[:nbytes])
+    
 def reset (A = None):
     '''
     Reset the values of the registers
@@ -1065,45 +834,27 @@ def reset (A = None):
         if A['error'][0]:
             return (False, "Error while creating the accelerometer. Error message was: " + A['error'][1])
 
-    # Write the default value of the CTRL_REG1 register
-    (status, message) = write (A, __CTRL_REG1, 0xff, 0x7)
-    if not status:
-        return (False, "Error while writing the default value of the CTRL_REG1 register of the accelerometer device. Error message was: " + message)
-
-    # Write the default value of the CTRL_REG2 register
-    (status, message) = write (A, __CTRL_REG2, 0xff, 0x0)
-    if not status:
-        return (False, "Error while writing the default value of the CTRL_REG2 register of the accelerometer device. Error message was: " + message)
-
-    # Write the default value of the CTRL_REG3 register
-    (status, message) = write (A, __CTRL_REG3, 0xff, 0x0)
-    if not status:
-        return (False, "Error while writing the default value of the CTRL_REG3 register of the accelerometer device. Error message was: " + message)
-
-    # Write the default value of the CTRL_REG4 register
-    (status, message) = write (A, __CTRL_REG4, 0xff, 0x0)
-    if not status:
-        return (False, "Error while writing the default value of the CTRL_REG4 register of the accelerometer device. Error message was: " + message)
-    
-    # Write the default value of the CTRL_REG5 register
-    (status, message) = write (A, __CTRL_REG5, 0xff, 0x0)
-    if not status:
-        return (False, "Error while writing the default value of the CTRL_REG5 register of the accelerometer device. Error message was: " + message)
-
-    # Write the default value of the CTRL_REG6 register
-    (status, message) = write (A, __CTRL_REG6, 0xff, 0x0)
-    if not status:
-        return (False, "Error while writing the default value of the CTRL_REG6 register of the accelerometer device. Error message was: " + message)
-
-    # Write the default value of the REFERENCE register
-    (status, message) = write (A, __REFERENCE, 0xff, 0x0)
-    if not status:
-        return (False, "Error while writing the default value of the REFERENCE register of the accelerometer device. Error message was: " + message)
+    # Forget the shadowed values as all the registers are going to be rewritten
+    invalidate_shadow (A)
+
+    # Write the default values of the registers in one transaction
+    defaults = [(__CTRL_REG1, 0x7),
+                (__CTRL_REG2, 0x0),
+                (__CTRL_REG3, 0x0),
+                (__CTRL_REG4, 0x0),
+                (__CTRL_REG5, 0x0),
+                (__CTRL_REG6, 0x0),
+                (__REFERENCE, 0x0),
+                (__FIFO_CTRL_REG, 0x0)]
+    T = transaction (A)
+    for (register, value) in defaults:
+        (status, message) = stage (T, register, 0xff, value)
+        if not status:
+            return (False, "Error while writing the default value of the %s register of the accelerometer device. Error message was: %s" % (register.get_name (), message))
 
-    # Write the default value of the FIFO_CTRL_REG register
-    (status, message) = write (A, __FIFO_CTRL_REG, 0xff, 0x0)
+    (status, message) = commit (T)
     if not status:
-        return (False, "Error while writing the default value of the FIFO_CTRL_REG register of the accelerometer device. Error message was: " + message)
+        return (False, "Error while writing the default values of the registers of the accelerometer device. Error message was: " + message)
 
     # Finished test
     if delete_accel:
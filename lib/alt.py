@@ -3,9 +3,9 @@
 # Library for the Raspberry Pi that interfaces with LPS331AP
 # pressure sensor on Polulu boards
 
-from smbus import SMBus
 from common_i2c import *
 import bitOps
+import regmap
 import numpy
 import time
 import os
@@ -18,18 +18,22 @@ GRAVITY = 9.8                   # Gravitational acceleration
 
 def Init (bus = None, 
           slaveAddr = DEV_SLAVE_ADDR, 
-          pdr = 12.5, tdr = 12.5):
+          pdr = 12.5, tdr = 12.5,
+          shadow = None):
     '''
     bus:       indicates the bus associated to the i2c device /dev/i2cX
     slaveAddr: indicates the address of the slave device
     pdr:       indicates the data rate for the pressure sensor
     tdr:       indicates the data rate for the temperature sensor
+    shadow:    indicates the mode of the shadow registers ('cache' or 'check').
+               None disables the shadow
     '''
     P = {}
     P['bus'] = bus
     if bus == None:
         try:
-            P['bus'] = SMBus(DEV_BUS_ID)
+            P['bus'] = open_bus(DEV_BUS_ID)
+            P['bus_id'] = DEV_BUS_ID
         except IOError as e:
             P['error'] = (True, "Unable to power on the pressure sensor. The error was: I/O error (%s): %s" %(e.errno, e.strerror))
             return P            
@@ -37,6 +41,13 @@ def Init (bus = None,
     P['addr'] = DEV_SLAVE_ADDR
     P['error'] = (False, None)
 
+    # Shadow the registers to save the reads of the masked writes
+    if shadow != None:
+        (status, message) = enable_shadow (P, shadow)
+        if not status:
+            P['error'] = (True, message)
+            return P
+
     # Power on the device
     (status, error) = set_dr (P, pdr, tdr)
     if not status:
@@ -55,13 +66,14 @@ def Init (bus = None,
 # REGISTERS #
 #############
 
-__REF_P_XL        = Register ('REF_P_XL', 0x08, mode = 'rw')
-__REF_P_L         = Register ('REF_P_L', 0x09, mode = 'rw')
-__REF_P_H         = Register ('REF_P_H', 0x0A, mode = 'rw')
+# The reference pressure is rewritten by the device when AUTO_ZERO is set
+__REF_P_XL        = Register ('REF_P_XL', 0x08, mode = 'rw', volatile = True)
+__REF_P_L         = Register ('REF_P_L', 0x09, mode = 'rw', volatile = True)
+__REF_P_H         = Register ('REF_P_H', 0x0A, mode = 'rw', volatile = True)
 __WHO_AM_I        = Register ('WHO_AM_I', 0x0F, mode = 'r')
 __RES_CONF        = Register ('RES_CONF', 0x10, mode = 'rw')
 __CTRL_REG1       = Register ('CTRL_REG1', 0x20, mode = 'rw')
-__CTRL_REG2       = Register ('CTRL_REG2', 0x21, mode = 'rw')
+__CTRL_REG2       = Register ('CTRL_REG2', 0x21, mode = 'rw', volatile = True)
 __CTRL_REG3       = Register ('CTRL_REG3', 0x22, mode = 'rw')
 
 # Is not posible to manage the device through interrupts (Only here for completeness)
@@ -153,6 +165,61 @@ __BlockDataUpdate = {'continous_update': 0x00, 'not_updated_until_reading': 0x01
 # Reboot memory content mode
 __BootMode = {'normal': 0x00, 'reboot_memory_content': 0x01}
 
+##########
+# FIELDS #
+##########
+
+__Map = regmap.RegisterMap ('pressure sensor')
+
+def __decode_pres (res_conf):
+    ''' Get the pressure resolution in mbar '''
+    if res_conf == 0x6A:
+        # ODR = 25Hz/25Hz and RES_CONF = 0x6A
+        return 0.02
+    for pres_res in __PRES.keys():
+        if __PRES[pres_res] == res_conf:
+            return pres_res
+    return None
+
+def __decode_ref (xl, l, h):
+    ''' Get the reference pressure from its high, medium and low parts '''
+    data_u2 = (h << 16) + (l << 8) + xl
+    return bitOps.TwosComplementToCustom(data_u2, 23) / 4096.0
+
+__FIELD_Pres      = __Map.derived ('pressure resolution', __decode_pres, __RES_CONF)
+__FIELD_DeviceId  = __Map.field ('device id', __WHO_AM_I)
+__FIELD_PD        = __Map.field ('power mode', __CTRL_REG1, __MASK_PD, __PowerMode)
+__FIELD_DR        = __Map.field ('data rates', __CTRL_REG1, __MASK_DR, regmap.flatten (__DR))
+__FIELD_BDU       = __Map.field ('block data update', __CTRL_REG1, __MASK_BDU, __BlockDataUpdate)
+__FIELD_DELTA_EN  = __Map.field ('delta pressure enable', __CTRL_REG1, __MASK_DELTA_EN, __Enable)
+__FIELD_BOOT      = __Map.field ('boot mode', __CTRL_REG2, __MASK_BOOT, __BootMode)
+__FIELD_Ref       = __Map.derived ('reference pressure', __decode_ref, __REF_P_XL, __REF_P_L, __REF_P_H)
+
+#######################
+# GENERATED ACCESSORS #
+#######################
+
+get_pres             = __Map.getter (__FIELD_Pres, 'Get pressure resolution')
+get_deviceid         = __Map.getter (__FIELD_DeviceId, 'Get WHO_AM_I value')
+get_powermode        = __Map.getter (__FIELD_PD, 'Get power mode')
+get_dr               = __Map.getter (__FIELD_DR, 'Get data rates')
+set_bdu              = __Map.setter (__FIELD_BDU, 'Set the block data update')
+get_bdu              = __Map.getter (__FIELD_BDU, 'Get the block data update')
+enable_delta         = __Map.setter (__FIELD_DELTA_EN, 'Enable or disable delta pressure')
+isenabled_delta      = __Map.getter (__FIELD_DELTA_EN, 'Check if delta pressure is enabled')
+get_bootmode         = __Map.getter (__FIELD_BOOT, 'Get the boot mode')
+get_ref              = __Map.getter (__FIELD_Ref, 'Get the reference pressure')
+
+# Configuration of the device, reading the reference pressure and the
+# control registers with one block read each (RES_CONF is alone between
+# reserved registers)
+get_conf = __Map.conf ([
+    ('res', [('dr', __FIELD_Pres)]),
+    ('ctrl1', [('pd', __FIELD_PD), ('dr', __FIELD_DR), ('bdu', __FIELD_BDU), ('delta_en', __FIELD_DELTA_EN)]),
+    ('ctrl2', [('boot', __FIELD_BOOT)]),
+    ('referene', __FIELD_Ref)
+    ], [(__REF_P_XL, __REF_P_H), (__CTRL_REG1, __CTRL_REG2)])
+
 #############
 # FUNCTIONS #
 #############
@@ -225,32 +292,6 @@ def set_pres(P, resolution):
 
     return (True, None)
 
-def get_pres(P):
-    ''' Get pressure resolution '''
-    (status, current) = read(P, __RES_CONF, 0xFF)
-    if not status:
-        return (False, "Unable to set the pressure resolution. The error was: %s." % current)
-
-    if current == 0x6A:
-        # ODR = 25Hz/25Hz and RES_CONF = 0x6A
-        return (True, 0.02)
-
-    # Convert to the proper value in mbar
-    for pres_res in __PRES.keys():
-        if __PRES[pres_res] == current:
-            return (True, (pres_res))
-
-    # never reached
-    return (False, "Unable to set the pressure resolution.")
-
-def get_deviceid(P):
-    ''' Get WHO_AM_I value '''
-    (status, devid) = read(P, __WHO_AM_I, 0xff)
-    if not status:
-        return (False, "Unable to get the device id. The error was: %s" % devid)
-
-    return (True, devid)
-
 def powerdown(P):
     ''' Set power-down mode '''
     (status, message) = write(P, __CTRL_REG1, __MASK_PD, __PowerMode['power_down'])
@@ -267,15 +308,6 @@ def poweron(P):
 
     return (True, None)
 
-def get_powermode(P):
-    ''' Get power mode '''
-
-    (status, powermode) = read_match(P, __CTRL_REG1, __MASK_PD, __PowerMode)         
-    if not status:
-        return (False, 'Unable to get the power mode on the pressure sensor. The error was %s' % powermode)
-
-    return (True, powermode)
-
 def set_dr(P, p_dr, t_dr):
     ''' Set data rate '''
 
@@ -291,70 +323,16 @@ def set_dr(P, p_dr, t_dr):
         return (False, 'Unable to set the data rate on the pressure sensor. The error was %s' % message)        
     return (True, None)
 
-def get_dr(P):
-    ''' Get data rates '''
-    (status, current) = read(P, __CTRL_REG1, __MASK_DR)
-    if not status:
-        return (False, "Unable to get the configurated data rates for the pressure sensor. The error was: %s." % current)
-    
-    # Convert to the proper value in Hz or 'one_shot' value
-    for p_dr in __DR.keys():
-        for t_dr in __DR[p_dr].keys():
-            if __DR[p_dr][t_dr] == current:
-                return (True, (p_dr, t_dr))
-
-    # never reached
-    return (False, "Unable to get the configurated data rates for the pressure sensor")
-
-def set_bdu(P, value):
-    ''' Set the block data update '''
-    if value not in __BlockDataUpdate.keys():
-        return (False, "Unable to set the block data update of the pressure sensor. The value %s is not in the allowed range" % value)
-
-    (status, message) = write(P, __CTRL_REG1, __MASK_BDU, __BlockDataUpdate[value]) 
-    if not status:
-        return (False, "Unable to set the block data update of the pressure sensor. The error was %s." % message)
-
-    return (True, None)
-        
-def get_bdu(P):
-    ''' Get the block data update '''
-    (status, bdu) = read_match(P, __CTRL_REG1, __MASK_BDU, __BlockDataUpdate)
-
-    if not status:
-        return (False, "Unable to get the block data update of the pressure sensor. The error was %s." % bdu)
-    
-    return (True, bdu)
-
-def enable_delta(P, enabled):
-    ''' Enable or disable delta pressure '''
-    (status, message) = write(P, __CTRL_REG1, __MASK_DELTA_EN, __Enable[enabled])
-    if not status:
-        return (False, 'Unable to enable or disable delta pressure for pressure sensor. The error was %s' % message)
-    return (True, None)
-   
-def isenabled_delta(P):
-    ''' Check if delta pressure is enabled '''
-    (status, enabled) = read_match(P, __CTRL_REG1, __MASK_DELTA_EN, __Enable)
-    if not status:
-        return (False, 'Unable to check if delta pressure is enabled for the pressure sensor. The error was %s' % enabled)
-    return (True, enabled)
-
 def set_bootmode(P, value):
     ''' Set the boot mode '''
     (status, message) = write(P, __CTRL_REG2, __MASK_BOOT, __BootMode[value]) 
     if not status:
         return (False, "Unable to set the boot mode of the pressure sensor. The error was %s." % message)
 
-    return (True, None)
+    # The reboot reloads the registers from the internal memory
+    invalidate_shadow (P)
 
-def get_bootmode(P):
-    ''' Get the boot mode '''
-    (status, bootmode) = read_match(P, __CTRL_REG2, __MASK_BOOT, __BootMode)
-    if not status:
-        return (False, "Unable to get the bootmode of the pressure sensor. The error was %s." % bootmode)
-    
-    return (True, bootmode)
+    return (True, None)
 
 def sw_reset (P):
     ''' Reset the device '''
@@ -384,40 +362,19 @@ def set_ref (P, active = True):
         return (False, "Unable to set the reference pressure. The error was %s" % message)
 
     if not active:
-        (status, message) = write(P, __REF_P_XL, 0xFF, 0x0)
-        if not status:
-            return (False, "Unable to set the reference pressure. The error was: %s." % message)
-
-        (status, message) = write(P, __REF_P_L, 0xFF, 0x0)
+        # Clear the three reference registers in one transaction
+        T = transaction (P)
+        for register in [__REF_P_XL, __REF_P_L, __REF_P_H]:
+            (status, message) = stage (T, register, 0xFF, 0x0)
+            if not status:
+                return (False, "Unable to set the reference pressure. The error was: %s." % message)
+
+        (status, message) = commit (T)
         if not status:
             return (False, "Unable to set the reference pressure. The error was: %s." % message)
 
-        (status, message) = write(P, __REF_P_H, 0xFF, 0x0)
-        if not status:
-            return (False, "Unable to set the reference pressure. The error was: %s." % message)
-        
-
     return (True, None)
 
-def get_ref(P):        
-    ''' Get the pressure data '''
-    # Get the high, the medium and the low parts
-    (status, xl) = read(P, __REF_P_XL, 0xff)
-    if not status:
-        return (False, "Unable to get the reference pressure on the pressure sensor. The error was: %s" % xl)
-    (status, l) = read(P, __REF_P_L, 0xff)
-    if not status:
-        return (False, "Unable to get the reference pressure on the pressure sensor. The error was: %s" % l)
-
-    (status, h) = read(P, __REF_P_H, 0xff)
-    if not status:
-        return (False, "Unable to get the reference pressure on the pressure sensor. The error was: %s" % h)
-
-    data_u2 = (h << 16) + (l << 8) + xl
-    data = bitOps.TwosComplementToCustom(data_u2, 23)
-
-    return (True, data / 4096.0)
-    
 def start_conversion (P):
     ''' 
     Start new conversion using ONE_SHOT bit.
@@ -543,10 +500,21 @@ def get_alt_ai (P):
     ''' Get altitude refered to the current pressure and temperature
     with auto-increment operations '''
     # Get pressure and temperature values
-    (status, values) = read_block (P, __PRESS_OUT_XL.get_addr()+0x80, 5)
+    (status, values) = read_block (P, __PRESS_OUT_XL.addr+0x80, 5)
     if not status:
         return (False, "Unable to get the pressure and temperature data from altimeter device. The error was %s" % values)
 
+    return decode_alt_ai (P, values)
+
+def alt_ai_request (P):
+    ''' Snapshot request to read the pressure and temperature data '''
+    return (P, __PRESS_OUT_XL.addr+0x80, 5)
+
+def decode_alt_ai (P, values):
+    '''
+    Get altitude, temperature and pressure from the five bytes of the
+    pressure and temperature output registers
+    '''
     # Pressure
     xl = values[0]
     l = values[1]
@@ -568,60 +536,6 @@ def get_alt_ai (P):
     
     return (True, (float (altitude), float (temperature), float (pressure)))
 
-def get_conf (P):
-
-    P['conf'] = {}
-
-    # RES_CONF
-    P['conf']['res'] = {}
-    res = P['conf']['res']
-
-    (status, value) = get_pres(P)
-    if not status:
-        return (False, "Unable to get the altimeter configuration. The error was %s" % value)
-    res['dr'] = value
-
-    # CTRL_REG1
-    P['conf']['ctrl1'] = {}
-    ctrl1 = P['conf']['ctrl1']
-
-    (status, value) = get_powermode(P)
-    if not status:
-        return (False, "Unable to get the altimeter configuration. The error was %s" % value)
-    ctrl1['pd'] = value
-
-    (status, value) = get_dr(P)
-    if not status:
-        return (False, "Unable to get the altimeter configuration. The error was %s" % value)
-    ctrl1['dr'] = value
-
-    (status, value) = get_bdu(P)
-    if not status:
-        return (False, "Unable to get the altimeter configuration. The error was %s" % value)
-    ctrl1['bdu'] = value
-
-    (status, value) = isenabled_delta(P)
-    if not status:
-        return (False, "Unable to get the altimeter configuration. The error was %s" % value)
-    ctrl1['delta_en'] = value
-
-    # CTRL_REG2
-    P['conf']['ctrl2'] = {}
-    ctrl2 = P['conf']['ctrl2']
-
-    (status, value) = get_bootmode(P)
-    if not status:
-        return (False, "Unable to get the altimeter configuration. The error was %s" % value)
-    ctrl2['boot'] = value
-
-    # REFERENCE
-    (status, value) = get_ref(P)
-    if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    P['conf']['referene'] = value
-
-    return (True, False)
-
 def reset (P = None):
     '''
     Reset the values of the registers
@@ -635,6 +549,9 @@ def reset (P = None):
         if P['error'][0]:
             return (False, "Error while creating the pressure sensor. Error message was: " + P['error'][1])
 
+    # Forget the shadowed values as all the registers are going to be rewritten
+    invalidate_shadow (P)
+
     # Reset
     (status, message) = sw_reset (P)
     if not status:
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+# Cooperative front-end of the I2C drivers. The tasks are generators
+# that yield what they wait for: the future of a request to the i2c
+# worker, a sleep or another task. The blocking operations are
+# performed by the worker, so several devices can be polled from one
+# loop without spinning on sleeps
+#
+# Example:
+#   def task (G):
+#       (status, values) = yield G.data_available ()
+#       (status, block) = yield G.read_block (0xa8, 6)
+#       raise async_i2c.Return ((status, block))
+
+import collections
+import common_i2c
+import heapq
+import io_worker
+import threading
+import time
+import types
+
+class Return (Exception):
+    '''
+    Exception raised by a task to finish with a result
+    '''
+
+    def __init__ (self, value = None):
+        Exception.__init__ (self)
+        self.value = value
+
+class Sleep (object):
+    '''
+    Wait of a task until the given time
+    '''
+
+    def __init__ (self, delay):
+        self.until = time.time () + delay
+
+def sleep (delay):
+    ''' Yielded by a task to wait delay seconds '''
+    return Sleep (delay)
+
+class Task (io_worker.Future):
+    '''
+    Task running a generator. The result is the value of the Return
+    raised by the generator
+    '''
+
+    def __init__ (self, generator):
+        io_worker.Future.__init__ (self)
+        self.generator = generator
+
+class Loop (object):
+    '''
+    Loop running the tasks
+    '''
+
+    def __init__ (self, worker = None):
+        '''
+        worker: i2c worker performing the requests. A new one is
+                started if it is not given
+        '''
+        if worker == None:
+            worker = io_worker.start ()
+        self.worker = worker
+        self.ready = collections.deque ()   # (task, value) to resume
+        self.timers = []                    # heap of (time, order, task)
+        self.order = 0
+        self.pending = 0
+        self.event = threading.Event ()
+
+    def spawn (self, generator):
+        ''' Create a task to run the generator '''
+        task = Task (generator)
+        self.pending += 1
+        self.ready.append ((task, None))
+        return task
+
+    def __wake (self, task, value):
+        ''' Resume the task with the value (may be called by the worker) '''
+        self.ready.append ((task, value))
+        self.event.set ()
+
+    def __step (self, task, value):
+        ''' Run the task until it yields '''
+        try:
+            waited = task.generator.send (value)
+        except Return as r:
+            self.__finish (task, r.value)
+            return
+        except StopIteration:
+            self.__finish (task, None)
+            return
+        except Exception as e:
+            self.__finish (task, (False, "The task failed. The error was: %s" % e))
+            return
+
+        if isinstance (waited, Sleep):
+            heapq.heappush (self.timers, (waited.until, self.order, task))
+            self.order += 1
+        elif isinstance (waited, types.GeneratorType):
+            waited = self.spawn (waited)
+            waited.add_done_callback (lambda future: self.__wake (task, future.value))
+        elif isinstance (waited, io_worker.Future):
+            waited.add_done_callback (lambda future: self.__wake (task, future.value))
+        else:
+            task.generator.close ()
+            self.__finish (task, (False, "The task yielded %s, which can not be waited" % type (waited)))
+
+    def __finish (self, task, value):
+        self.pending -= 1
+        task.set_result (value)
+
+    def run (self):
+        ''' Run the tasks until all of them finish '''
+        while self.pending > 0:
+            self.event.clear ()
+
+            # Wake up the tasks whose sleeps are over
+            now = time.time ()
+            while len (self.timers) > 0 and self.timers[0][0] <= now:
+                (until, order, task) = heapq.heappop (self.timers)
+                self.ready.append ((task, None))
+
+            if len (self.ready) == 0:
+                # Wait for the worker or the next sleep to be over
+                if len (self.timers) == 0:
+                    self.event.wait ()
+                else:
+                    self.event.wait (self.timers[0][0] - now)
+                continue
+
+            while len (self.ready) > 0:
+                (task, value) = self.ready.popleft ()
+                self.__step (task, value)
+
+    def run_until_complete (self, generator):
+        ''' Run a task (and the rest of tasks) and get its result '''
+        task = self.spawn (generator)
+        self.run ()
+        return task.value
+
+    def close (self):
+        ''' Stop the worker '''
+        return self.worker.stop ()
+
+class Device (object):
+    '''
+    Front-end of a device of the drivers (gyro, accel, mag, alt or pwm)
+    whose operations return futures to be yielded by the tasks
+    '''
+
+    def __init__ (self, DEV, driver, loop):
+        '''
+        DEV:    context of the device
+        driver: module of the driver of the device
+        loop:   loop running the tasks
+        '''
+        self.DEV = DEV
+        self.driver = driver
+        self.loop = loop
+
+    def call (self, function, *args):
+        ''' Request the worker to call function (DEV, *args) '''
+        return self.loop.worker.submit (function, self.DEV, *args)
+
+    def read (self, register, mask):
+        return self.call (common_i2c.read, register, mask)
+
+    def write (self, register, mask, value):
+        return self.call (common_i2c.write, register, mask, value)
+
+    def read_block (self, start_address, nbytes):
+        return self.call (common_i2c.read_block, start_address, nbytes)
+
+    def write_block (self, start_address, values):
+        return self.call (common_i2c.write_block, start_address, values)
+
+    def wait_for (self, check, condition = None, period = 0.001, timeout = None):
+        '''
+        Task to wait until the check of the device meets the condition,
+        sleeping between checks
+        check:     function of the driver returning a (status, value) tuple
+        condition: function receiving the value and returning True when
+                   the wait is over. By default the value (or all the
+                   values if it is a tuple) has to be True
+        period:    time between checks in seconds
+        timeout:   maximum time to wait in seconds (None waits forever)
+        '''
+        if condition == None:
+            condition = lambda value: all (value) if type (value) == tuple else bool (value)
+
+        start = time.time ()
+        while True:
+            (status, value) = yield self.call (check)
+            if not status:
+                raise Return ((False, value))
+            if condition (value):
+                raise Return ((True, value))
+            if timeout != None and time.time () - start > timeout:
+                raise Return ((False, "The condition was not met in %s seconds" % timeout))
+            yield sleep (period)
+
+    def data_available (self, period = 0.001, timeout = None):
+        ''' Task to wait for new data on all the axes (isdata_available) '''
+        return self.wait_for (self.driver.isdata_available, None, period, timeout)
+
+    def data_ready (self, period = 0.001, timeout = None):
+        ''' Task to wait for new data (isdata_ready) '''
+        return self.wait_for (self.driver.isdata_ready, None, period, timeout)
+
+    def watermark (self, period = 0.001, timeout = None):
+        ''' Task to wait for the FIFO level to reach the watermark '''
+        return self.wait_for (self.driver.get_watermark_status, lambda value: value == 'equal_greater', period, timeout)
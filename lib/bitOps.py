@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import numpy
+
 def CheckBit(value, position):
     mask = 1 << position
     return value & mask == mask
@@ -25,29 +27,92 @@ def ClearBits(value, mask):
 def FlipBits(value, mask):
     return value ^ mask
 
-def SetValueUnderMask(valueToSetUnderMask, currentValue, mask):
-    currentValueCleared = ClearBits(currentValue, mask) # clear bits under mask
+# Position of the lowest bit set of each byte value (0 for 0x00)
+__LowestBit = [0] * 256
+for __value in xrange (1, 256):
+    while not CheckBit (__value, __LowestBit[__value]):
+        __LowestBit[__value] += 1
+
+def MaskShift(mask):
+    if mask >= 0x00 and mask <= 0xff:
+        return __LowestBit[mask]
     i = 0
     while (mask % 2 == 0 and mask != 0x00):
         mask = mask >> 1
         i += 1
-    return SetBits(valueToSetUnderMask << i, currentValueCleared)
+    return i
+
+def SetValueUnderMask(valueToSetUnderMask, currentValue, mask):
+    currentValueCleared = ClearBits(currentValue, mask) # clear bits under mask
+    return SetBits(valueToSetUnderMask << MaskShift(mask), currentValueCleared)
 
 def GetValueUnderMask(currentValue, mask):
     currentValueCleared = ClearBits(currentValue, ~mask) # clear bits not under mask
-    i = 0
-    while (mask % 2 == 0 and mask != 0x00):
-        mask = mask >> 1
-        i += 1
-    return currentValueCleared >> i
+    return currentValueCleared >> MaskShift(mask)
+
+class Field (object):
+    '''
+    Field of a register compiled from its mask and its value/name
+    mapping, to encode and decode it with a shift and an index
+    '''
+
+    def __init__ (self, mask, dictionary = None):
+        '''
+        mask:       mask of the field in the register
+        dictionary: name/value mapping of the field
+        '''
+        self.mask = mask
+        self.shift = MaskShift(mask)
+        self.dictionary = dictionary
+        self.reverse = {}
+        self.names = None
+        if dictionary == None:
+            return
+
+        # Reverse table indexed by the value of the field. The first
+        # name of the dictionary that maps a value wins, like in a
+        # linear search
+        for key in dictionary.keys():
+            if not dictionary[key] in self.reverse:
+                self.reverse[dictionary[key]] = key
+
+        # Names indexed by the whole value of the register
+        if mask >= 0x00 and mask <= 0xff:
+            self.names = [self.reverse.get((value & mask) >> self.shift) for value in xrange (256)]
+
+    def get (self, currentValue):
+        ''' Get the value of the field '''
+        return (currentValue & self.mask) >> self.shift
+
+    def set (self, valueToSetUnderMask, currentValue):
+        ''' Set the value of the field in the value of the register '''
+        return (currentValue & ~self.mask) | (valueToSetUnderMask << self.shift)
+
+    def encode (self, name, currentValue = 0x00):
+        ''' Set the value mapped by name in the value of the register '''
+        return self.set (self.dictionary[name], currentValue)
+
+    def match (self, currentValue):
+        ''' Get the name that maps the value of the field or None '''
+        if self.names != None and currentValue >= 0x00 and currentValue <= 0xff:
+            return self.names[currentValue]
+        return self.reverse.get (self.get (currentValue))
+
+# Fields compiled for each mask and dictionary
+__Fields = {}
+
+def GetField(mask, dictionary = None):
+    key = (mask, id (dictionary))
+    field = __Fields.get (key)
+    # Check the dictionary (its id could be reused by other dictionary)
+    if field == None or field.dictionary is not dictionary:
+        field = Field (mask, dictionary)
+        __Fields[key] = field
+    return field
 
 def GetValueUnderMaskDictMatch(currentValue, mask, dictionary):
-    value = GetValueUnderMask (currentValue, mask)
     # Return name that maps the current value
-    for key in dictionary.keys():
-        if dictionary[key] == value:
-            return key            
-    return None
+    return GetField(mask, dictionary).match(currentValue)
 
 def TwosComplementToByte(value):
     if value >= 0 and value <= 127:
@@ -60,3 +125,15 @@ def TwosComplementToCustom(value, signBitPosition):
         return value
     else:
         return value - (2 << signBitPosition)
+
+def BytesToArray(values, dtype = numpy.uint8):
+    # Raw buffers are viewed without copies, lists of bytes are converted
+    if isinstance (values, (bytearray, str, buffer)):
+        return numpy.frombuffer(values, dtype = numpy.uint8).view(dtype)
+    if isinstance (values, numpy.ndarray) and values.dtype == numpy.uint8:
+        return values.view(dtype)
+    return numpy.array(values, dtype = numpy.uint8).view(dtype)
+
+def TwosComplementToCustomArray(values, signBitPosition):
+    values = numpy.asarray(values, dtype = numpy.int64)
+    return numpy.where(values <= (1<<signBitPosition)-1, values, values - (2 << signBitPosition))
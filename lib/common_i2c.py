@@ -3,45 +3,624 @@
 # Common code to interface with the I2C bus for the Raspberry Pi
 
 import bitOps
+import ctypes
+import ctypes.util
+import errno
+import heapq
+import os
+import threading
+import time
+
+try:
+    from smbus import SMBus
+except ImportError:
+    # The buses can still be created through a bus factory
+    SMBus = None
+
+AUTO_INCREMENT   = 0x80       # Register address flag to auto-increment the address
+MAX_BLOCK_LENGTH = 32         # Maximum number of bytes of a SMBus block transfer
 
 class Register (object):
     '''
     Class for a register of the device that storages its address,
-    a mirror of its value, its operating mode and its name.
+    a mirror of its value, its operating mode and its name. The
+    attributes are slots, so they are read without a dictionary lookup
     '''
-    __addr = 0x0
-    __mode = 'r'
-    __name = None
-    
-    def __init__ (self, name, addr, mode = 'r'):
+    __slots__ = ('name', 'addr', 'mode', 'volatile', 'writable', 'shadowable')
+
+    def __init__ (self, name, addr, mode = 'r', volatile = False):
         '''
         name:         name of the register
         addr:         register address 
         mode:         readable/write mode
+        volatile:     indicates that the device modifies the register
+                      by itself, so its value can not be shadowed
         '''
-        self.__name = name
-        self.__addr = addr
-        self.__mode = mode
+        self.name = name
+        self.addr = addr
+        self.mode = mode
+        self.volatile = volatile
+        # Checks of the mode computed once instead of on every access
+        self.writable = 'w' in mode
+        self.shadowable = self.writable and not volatile
         
     def get_addr (self):
         '''
         Function to get the address of the register
         '''
-        return self.__addr
+        return self.addr
     
     def get_mode (self):
         '''
         Function to get the mode of the register
         '''
-        return self.__mode
+        return self.mode
     
     def get_name (self):
         '''
         Function to get the name of the register
         '''
-        return self.__name
+        return self.name
+
+    def is_volatile (self):
+        '''
+        Function to check if the register is modified by the device
+        '''
+        return self.volatile
+
+def register_table (registers, template, count):
+    '''
+    Compile the registers named template % index (for index in 0 to
+    count - 1) into a list, so they are looked up by plain indexing
+    registers: namespace with the registers (the globals of the driver)
+    template:  format of the names of the registers
+    count:     number of registers
+    '''
+    return [registers[template % index] for index in xrange (count)]
+
+class I2CError (IOError):
+    '''
+    Error of an operation on the bus with the device, the register and
+    the errno. The message is only formatted when it is read
+    '''
+
+    def __init__ (self, operation, slaveAddr, register, error_number, message, values = ()):
+        '''
+        operation:    operation failed (read, write, read_block,
+                      write_block, commit or snapshot)
+        slaveAddr:    address of the slave device or None
+        register:     instance of the class Register, register address
+                      or None
+        error_number: errno of the error
+        message:      format of the message
+        values:       values of the message
+        '''
+        strerror = None
+        if error_number != None:
+            strerror = os.strerror (error_number)
+        IOError.__init__ (self, error_number, strerror)
+        self.operation = operation
+        self.addr = slaveAddr
+        self.register = register
+        self.message = message
+        self.values = values
+
+    def __str__ (self):
+        return self.message % self.values
+
+#########
+# BUSES #
+#########
+
+__bus_factory = None
+
+def set_bus_factory (factory):
+    '''
+    Set the function used by open_bus to create the buses (for example
+    to record or replay the traffic). None restores smbus.SMBus
+    factory: function receiving the bus id and returning the bus
+    '''
+    global __bus_factory
+    __bus_factory = factory
+
+def open_bus (bus_id):
+    '''
+    Create the bus associated to the i2c device /dev/i2cX
+    bus_id: indicates the bus id
+    '''
+    if __bus_factory != None:
+        return __bus_factory (bus_id)
+
+    if SMBus == None:
+        raise IOError (errno.ENOENT, "The smbus module is not available")
+
+    return SMBus (bus_id)
+
+##############
+# STATISTICS #
+##############
+
+# Statistics of the operations on the bus or None when disabled. They
+# are kept by (slave address, register, operation)
+__stats = None
+
+# Sub-buckets per power of two of the latency histograms (the error of
+# the reported latencies is lower than 1/2**(HIST_BITS - 1))
+HIST_BITS = 5
+
+def enable_stats (enabled = True):
+    '''
+    Enable or disable the statistics of the operations on the bus. The
+    collected statistics are discarded when they are enabled again
+    enabled: indicates if the statistics have to be collected
+    '''
+    global __stats
+    if enabled:
+        __stats = {}
+    else:
+        __stats = None
+
+def get_stats ():
+    '''
+    Get the statistics of the operations as a dictionary indexed by
+    (slave address, register, operation) with the number of operations,
+    bytes, errors, total and maximum latency (us) and the histogram of
+    the latencies
+    '''
+    if __stats is None:
+        return (False, "Unable to get the statistics of the i2c. The statistics are not enabled")
+
+    return (True, __stats)
+
+def __bucket (latency):
+    '''
+    Bucket of the histogram of the latency (us). The buckets are linear
+    up to 2**HIST_BITS and then there are 2**(HIST_BITS - 1) buckets
+    per power of two
+    '''
+    if latency < (1 << HIST_BITS):
+        return latency
+    e = latency.bit_length () - HIST_BITS
+    return (e << (HIST_BITS - 1)) + (latency >> e)
+
+def __bucket_limit (bucket):
+    '''
+    Highest latency (us) of a bucket of the histogram
+    '''
+    if bucket < (1 << HIST_BITS):
+        return bucket
+    e = (bucket >> (HIST_BITS - 1)) - 1
+    return ((bucket - (e << (HIST_BITS - 1)) + 1) << e) - 1
+
+def stats_percentile (entry, percentile):
+    '''
+    Get the latency (us) below which the percentile of the operations
+    of an entry of the statistics are
+    entry:      entry of the statistics
+    percentile: percentile between 0 and 100
+    '''
+    target = entry['count'] * percentile / 100.0
+    accumulated = 0
+    for bucket in sorted (entry['histogram'].keys ()):
+        accumulated += entry['histogram'][bucket]
+        if accumulated >= target:
+            return min (__bucket_limit (bucket), entry['max'])
+
+    return entry['max']
+
+def __account (slaveAddr, reg, op, nbytes, start, error = False):
+    '''
+    Add an operation to the statistics
+    '''
+    latency = int ((time.time () - start) * 1000000)
+    key = (slaveAddr, reg, op)
+    entry = __stats.get (key)
+    if entry is None:
+        entry = {'count': 0, 'bytes': 0, 'errors': 0, 'time': 0, 'max': 0, 'histogram': {}}
+        __stats[key] = entry
+
+    entry['count'] += 1
+    entry['time'] += latency
+    if error:
+        entry['errors'] += 1
+    else:
+        entry['bytes'] += nbytes
+    if latency > entry['max']:
+        entry['max'] = latency
+    bucket = __bucket (latency)
+    entry['histogram'][bucket] = entry['histogram'].get (bucket, 0) + 1
+
+def __accounted (slaveAddr, reg, op, nbytes, start, error = False):
+    '''
+    Add an operation to the statistics and the budget, if enabled
+    '''
+    if __stats is not None:
+        __account (slaveAddr, reg, op, nbytes, start, error)
+    if __budget is not None:
+        __budget.spend (time.time () - start)
+
+def __io (op, method, slaveAddr, reg, *args):
+    '''
+    Perform an operation on the bus keeping its statistics if enabled
+    op:        name of the operation (read_byte, write_byte, read_block
+               or write_block)
+    method:    method of the bus performing the operation
+    slaveAddr: address of the slave device
+    reg:       register (or start address) of the operation
+    args:      rest of arguments of the method
+    '''
+    if __stats is None and __budget is None:
+        return method (slaveAddr, reg, *args)
+
+    if op == 'read_block':
+        nbytes = args[-1]
+    elif op == 'write_block':
+        nbytes = len (args[0])
+    else:
+        nbytes = 1
+
+    start = time.time ()
+    try:
+        result = method (slaveAddr, reg, *args)
+    except IOError:
+        __accounted (slaveAddr, reg, op, nbytes, start, True)
+        raise
+    __accounted (slaveAddr, reg, op, nbytes, start)
+
+    return result
+
+def format_stats ():
+    '''
+    Get the statistics as text lines, sorted by the total time spent
+    on the bus
+    '''
+    if __stats is None:
+        return (False, "Unable to format the statistics of the i2c. The statistics are not enabled")
+
+    lines = ["%-6s %-6s %-11s %8s %8s %6s %10s %8s %8s %8s %8s" %
+             ('addr', 'reg', 'op', 'count', 'bytes', 'errors', 'total(us)', 'p50', 'p99', 'p99.9', 'max')]
+    for (key, entry) in sorted (__stats.items (), key = lambda item: -item[1]['time']):
+        (slaveAddr, reg, op) = key
+        lines.append ("%-6s %-6s %-11s %8d %8d %6d %10d %8d %8d %8d %8d" %
+                      (hex (slaveAddr) if slaveAddr != None else '-', hex (reg) if reg != None else '-', op,
+                       entry['count'], entry['bytes'], entry['errors'], entry['time'],
+                       stats_percentile (entry, 50), stats_percentile (entry, 99),
+                       stats_percentile (entry, 99.9), entry['max']))
+
+    return (True, lines)
+
+###################
+# BUS ARBITRATION #
+###################
+
+# Priorities of the operations (the lowest value goes first)
+PRIORITY_HIGH   = 0           # Actuators
+PRIORITY_NORMAL = 1           # Sensors of the control loop
+PRIORITY_LOW    = 2           # Telemetry
+
+class BusArbiter (object):
+    '''
+    Class to serialize the operations of several threads on the bus.
+    When the bus is released it is granted to the waiting operation
+    with the highest priority, and in order of arrival for the same
+    priority. The time waited for the bus is kept by priority
+    '''
+
+    def __init__ (self):
+        self.condition = threading.Condition ()
+        self.owner = None     # Thread owning the bus
+        self.depth = 0        # Nested acquisitions of the owner
+        self.waiting = []     # Heap of (priority, arrival) of the waiting operations
+        self.arrivals = 0
+        self.stats = {}
+        for priority in [PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW]:
+            self.stats[priority] = {'count': 0, 'contended': 0, 'wait': 0.0, 'max_wait': 0.0}
+
+    def acquire (self, priority = PRIORITY_NORMAL):
+        '''
+        Wait until the bus is granted to the calling thread
+        priority: priority of the operation
+        '''
+        thread = threading.current_thread ()
+        self.condition.acquire ()
+        try:
+            if self.owner is thread:
+                self.depth += 1
+                return
+
+            stats = self.stats[priority]
+            stats['count'] += 1
+            if self.owner is None and len (self.waiting) == 0:
+                self.owner = thread
+                self.depth = 1
+                return
+
+            # Wait for the turn
+            start = time.time ()
+            turn = (priority, self.arrivals)
+            self.arrivals += 1
+            heapq.heappush (self.waiting, turn)
+            while self.owner is not None or self.waiting[0] != turn:
+                self.condition.wait ()
+            heapq.heappop (self.waiting)
+            self.owner = thread
+            self.depth = 1
+
+            wait = time.time () - start
+            stats['contended'] += 1
+            stats['wait'] += wait
+            if wait > stats['max_wait']:
+                stats['max_wait'] = wait
+        finally:
+            self.condition.release ()
+
+    def release (self):
+        '''
+        Release the bus acquired by the calling thread
+        '''
+        self.condition.acquire ()
+        try:
+            self.depth -= 1
+            if self.depth == 0:
+                self.owner = None
+                self.condition.notify_all ()
+        finally:
+            self.condition.release ()
+
+__arbiter = None
+__thread_priority = threading.local ()
+
+def set_arbiter (arbiter):
+    '''
+    Set the arbiter of the operations on the bus. It has to be shared
+    by all the threads using the bus. None disables the arbitration
+    arbiter: instance of the class BusArbiter or None
+    '''
+    global __arbiter
+    __arbiter = arbiter
+
+def get_arbiter ():
+    '''
+    Get the arbiter of the operations on the bus
+    '''
+    return __arbiter
+
+def set_priority (priority):
+    '''
+    Set the priority of the operations of the calling thread over the
+    priority of the devices (for example to lower the priority of a
+    telemetry thread). None restores the priority of the devices
+    priority: PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW or None
+    '''
+    __thread_priority.value = priority
+
+def with_priority (priority, function, *args):
+    '''
+    Call the function with the priority for the operations of the
+    calling thread, restoring the previous one when it returns (for
+    example to run the telemetry reads at PRIORITY_LOW)
+    priority: PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW
+    function: function performing the operations on the bus
+    '''
+    previous = getattr (__thread_priority, 'value', None)
+    __thread_priority.value = priority
+    try:
+        return function (*args)
+    finally:
+        __thread_priority.value = previous
+
+def __arbitrated (DEV, function, *args):
+    '''
+    Call the function with the bus granted by the arbiter, if any
+    DEV:      context of the device (its 'priority' is used if the
+              thread has not a priority) or None
+    function: function performing the operations on the bus
+    '''
+    if __arbiter is None:
+        return function (*args)
+
+    priority = getattr (__thread_priority, 'value', None)
+    if priority is None:
+        priority = PRIORITY_NORMAL
+        if DEV is not None:
+            priority = DEV.get ('priority', PRIORITY_NORMAL)
+
+    __arbiter.acquire (priority)
+    try:
+        return function (*args)
+    finally:
+        __arbiter.release ()
+
+##############
+# BUS BUDGET #
+##############
+
+class BusBudget (object):
+    '''
+    Class to keep the bus time used in each iteration of the control
+    loop. The operations are accounted when they finish, and the low
+    priority work checks the time left before using the bus, so it is
+    deferred to a later iteration instead of delaying the writes of
+    the motors. It has to be shared by all the threads using the bus
+    '''
+
+    def __init__ (self, limit):
+        '''
+        limit: bus time in seconds of each iteration
+        '''
+        self.limit = limit
+        self.lock = threading.Lock ()
+        self.used = 0.0
+        self.iterations = 0
+        self.overruns = 0
+        self.max_used = 0.0
+        self.skipped = {}     # Work skipped by name
+
+    def start (self):
+        '''
+        Start a new iteration and return the bus time used by the
+        previous one
+        '''
+        self.lock.acquire ()
+        used = self.used
+        if self.iterations > 0:
+            if used > self.limit:
+                self.overruns += 1
+            if used > self.max_used:
+                self.max_used = used
+        self.used = 0.0
+        self.iterations += 1
+        self.lock.release ()
+
+        return used
+
+    def spend (self, dt):
+        ''' Account bus time to the iteration '''
+        self.lock.acquire ()
+        self.used += dt
+        self.lock.release ()
+
+    def left (self):
+        ''' Get the bus time left in the iteration '''
+        return self.limit - self.used
+
+    def allow (self, name, needed = 0.0):
+        '''
+        Check if there is bus time left in the iteration for the work,
+        counting it as skipped if there is not
+        name:   name of the work
+        needed: estimation of the bus time of the work in seconds
+        '''
+        if self.used + needed <= self.limit:
+            return True
+
+        self.skipped[name] = self.skipped.get (name, 0) + 1
+        return False
+
+__budget = None
+
+def set_budget (budget):
+    '''
+    Set the budget of bus time of the iterations. None disables it
+    budget: instance of the class BusBudget or None
+    '''
+    global __budget
+    __budget = budget
+
+def get_budget ():
+    '''
+    Get the budget of bus time of the iterations
+    '''
+    return __budget
+
+def budget_allows (name, needed = 0.0):
+    '''
+    Check if the low priority work can use the bus in the iteration.
+    Always True if the budget is disabled
+    name:   name of the work
+    needed: estimation of the bus time of the work in seconds
+    '''
+    if __budget is None:
+        return True
+
+    return __budget.allow (name, needed)
+
+####################
+# SHADOW REGISTERS #
+####################
+
+# Modes of the shadow registers
+#  cache: the shadowed values are used instead of reading the device
+#  check: the device is always read and compared with the shadowed values
+__ShadowModes = ['cache', 'check']
+
+def enable_shadow (DEV, mode = 'cache'):
+    '''
+    Enable the shadow of the writable registers of the device. The
+    shadow is filled on the first read of each register and kept
+    current on every write, so masked writes do not need to read the
+    current value through the bus
+    DEV:  context of the device
+    mode: 'cache' or 'check'
+    '''
+    if mode not in __ShadowModes:
+        return (False, "Unable to enable the shadow registers. The mode %s is not in the range %s" % (mode, __ShadowModes))
+
+    DEV['shadow'] = {'mode': mode, 'values': {}, 'mismatches': []}
+
+    return (True, None)
+
+def disable_shadow (DEV):
+    '''
+    Disable the shadow of the registers of the device
+    '''
+    DEV['shadow'] = None
+
+    return (True, None)
+
+def invalidate_shadow (DEV, register = None):
+    '''
+    Forget the shadowed values, so they are read again from the device
+    DEV:      context of the device
+    register: instance of the class Register to invalidate. If None
+              the whole shadow is invalidated
+    '''
+    shadow = DEV.get ('shadow')
+    if shadow is None:
+        return (True, None)
+
+    if register is None:
+        shadow['values'].clear ()
+    else:
+        shadow['values'].pop (register.addr, None)
+
+    return (True, None)
+
+def get_shadow_mismatches (DEV):
+    '''
+    Get the list of (register name, shadowed value, device value)
+    detected while the shadow was in 'check' mode
+    '''
+    shadow = DEV.get ('shadow')
+    if shadow is None:
+        return (False, "Unable to get the mismatches of the shadow registers. The shadow is not enabled")
+
+    return (True, shadow['mismatches'])
+
+def __shadowable (shadow, register):
+    '''
+    Check if the value of the register can be kept in the shadow
+    '''
+    return shadow is not None and register.shadowable
+
+def __get_current (i2c, slaveAddr, register, shadow):
+    '''
+    Function to get the current value of a register, using the shadow
+    when possible
+    i2c: SMBus object connected to the I2C device interface
+    slaveAddr: address of the slave device
+    register: instance of the class Register
+    shadow: shadow of the registers of the device or None
+    '''
+    addr = register.addr
+    if not __shadowable (shadow, register):
+        return __io ('read_byte', i2c.read_byte_data, slaveAddr, addr)
+
+    values = shadow['values']
+    if addr in values and shadow['mode'] == 'cache':
+        return values[addr]
+
+    current = __io ('read_byte', i2c.read_byte_data, slaveAddr, addr)
+
+    # Check the shadowed value against the device
+    if addr in values and values[addr] != current:
+        shadow['mismatches'].append ((register.name, values[addr], current))
+
+    values[addr] = current
+
+    return current
 
-def __write(i2c, slaveAddr, register, mask, value, get_current_value = True):
+def __write(i2c, slaveAddr, register, mask, value, get_current_value = True, shadow = None):
     '''
     Function to write a value in a register given a mask
     i2c: SMBus object connected to the I2C device interface
@@ -49,15 +628,17 @@ def __write(i2c, slaveAddr, register, mask, value, get_current_value = True):
     register: instance of the class Register
     mask:     mask to set the value
     value:    value to set in the register
+    shadow:   shadow of the registers of the device or None
     '''
-    if not 'w' in register.get_mode ():
-        return (False, 'Access to the register %s not valid. The register is only readable.' % register.get_name())
+    if not register.writable:
+        raise I2CError ('write', slaveAddr, register, errno.EACCES, 'Access to the register %s not valid. The register is only readable.', (register.name,))
     
     try:
-        # Check if the current value has to be obtained
-        if get_current_value:
+        # Check if the current value has to be obtained (not needed
+        # when the whole register is written)
+        if get_current_value and mask != 0xff:
             # Get the current value
-            current = i2c.read_byte_data(slaveAddr, register.get_addr())  # Get current value
+            current = __get_current(i2c, slaveAddr, register, shadow)
     
             # Get the new value
             new = bitOps.SetValueUnderMask(value, current, mask)
@@ -65,29 +646,34 @@ def __write(i2c, slaveAddr, register, mask, value, get_current_value = True):
             new = value
 
         # Write the value through the i2C bus
-        i2c.write_byte_data(slaveAddr, register.get_addr(), new)
+        __io ('write_byte', i2c.write_byte_data, slaveAddr, register.addr, new)
     except IOError as e:
-        return (False, "Unable to write data trhough the i2c. The error was: I/O error (%s): %s" %(e.errno, e.strerror))
-    
-    return (True, None)
+        if shadow is not None:
+            # The value of the register is unknown
+            shadow['values'].pop (register.addr, None)
+        raise I2CError ('write', slaveAddr, register, e.errno, "Unable to write data trhough the i2c. The error was: I/O error (%s): %s", (e.errno, e.strerror))
+
+    if __shadowable (shadow, register):
+        shadow['values'][register.addr] = new
         
-def __read(i2c, slaveAddr, register, mask):
+def __read(i2c, slaveAddr, register, mask, shadow = None):
     '''
     Function to read a value from a register given a mask
     i2c: SMBus object connected to the I2C device interface
     slaveAddr: address of the slave device
     register: instance of the class Register
     mask:     mask to get the value
+    shadow:   shadow of the registers of the device or None
     '''
     # Get current value
     try:
-        current = i2c.read_byte_data(slaveAddr, register.get_addr())   
+        current = __get_current(i2c, slaveAddr, register, shadow)
     except IOError as e:
-        return (False, "Unable to read data trhough the i2c. The error was: I/O error (%s): %s" %(e.errno, e.strerror))
+        raise I2CError ('read', slaveAddr, register, e.errno, "Unable to read data trhough the i2c. The error was: I/O error (%s): %s", (e.errno, e.strerror))
 
-    return (True, bitOps.GetValueUnderMask(current, mask))
+    return bitOps.GetValueUnderMask(current, mask)
 
-def __read_match(i2c, slaveAddr, register, mask, dictionary):
+def __read_match(i2c, slaveAddr, register, mask, dictionary, shadow = None):
     '''
     Function to read a value from a register given a mask
     returning the name in the dictionary
@@ -96,18 +682,20 @@ def __read_match(i2c, slaveAddr, register, mask, dictionary):
     register: instance of the class Register
     mask:     mask to get the value
     dictionary: value/name mapping
+    shadow:   shadow of the registers of the device or None
     '''
     # Get current value
-    (status, current) = __read(i2c, slaveAddr, register, mask)
-    if not status:
-        return (False, current)
+    try:
+        current = __get_current(i2c, slaveAddr, register, shadow)
+    except IOError as e:
+        raise I2CError ('read', slaveAddr, register, e.errno, "Unable to read data trhough the i2c. The error was: I/O error (%s): %s", (e.errno, e.strerror))
 
     # Return name that maps the current value
-    for key in dictionary.keys():
-        if dictionary[key] == current:
-            return (True, key)
+    key = bitOps.GetField(mask, dictionary).match(current)
+    if key == None:
+        raise I2CError ('read', slaveAddr, register, errno.EINVAL, "The value does not match with any value in the dictionary %s", (dictionary,))
 
-    return (False, "The value does not match with any value in the dictionary %s" % dictionary)
+    return key
 
         
 def __read_block(i2c, slaveAddr, start_address, nbytes):
@@ -123,13 +711,37 @@ def __read_block(i2c, slaveAddr, start_address, nbytes):
     if nbytes < 1:
         nbytes = 1
     try:
-        block = i2c.read_i2c_block_data(slaveAddr, start_address, nbytes)   
+        block = __io ('read_block', i2c.read_i2c_block_data, slaveAddr, start_address, nbytes)
     except IOError as e:
-        return (False, "Unable to read the block of data trhough the i2c. The error was: I/O error (%s): %s" %(e.errno, e.strerror))
+        raise I2CError ('read_block', slaveAddr, start_address, e.errno, "Unable to read the block of data trhough the i2c. The error was: I/O error (%s): %s", (e.errno, e.strerror))
 
-    return (True, block)
+    return block
 
-def __write_block(i2c, slaveAddr, start_address, values):
+def __read_block_into(i2c, slaveAddr, start_address, buf, nbytes):
+    '''
+    Function to read a block of data from a device into a buffer
+    i2c: SMBus object connected to the I2C device interface
+    slaveAddr: address of the slave device
+    start_address: first register of the block of data
+    buf: writable buffer (bytearray) with room for the block
+    nbytes: number of bytes of the block
+    '''
+    if nbytes < 1:
+        nbytes = 1
+    if nbytes > len (buf):
+        raise I2CError ('read_block', slaveAddr, start_address, errno.EINVAL, "Unable to read the block of data trhough the i2c. The block of %s bytes does not fit in the buffer of %s bytes", (nbytes, len (buf)))
+    try:
+        if hasattr (i2c, 'read_i2c_block_into'):
+            __io ('read_block', i2c.read_i2c_block_into, slaveAddr, start_address, buf, nbytes)
+        else:
+            # The bus only returns lists, so the block is copied
+            buf[:nbytes] = bytearray (__io ('read_block', i2c.read_i2c_block_data, slaveAddr, start_address, nbytes))
+    except IOError as e:
+        raise I2CError ('read_block', slaveAddr, start_address, e.errno, "Unable to read the block of data trhough the i2c. The error was: I/O error (%s): %s", (e.errno, e.strerror))
+
+    return nbytes
+
+def __write_block(i2c, slaveAddr, start_address, values, shadow = None, ai_flag = AUTO_INCREMENT):
     '''
     Function to read a block of data from a device 
     i2c: SMBus object connected to the I2C device interface
@@ -137,31 +749,635 @@ def __write_block(i2c, slaveAddr, start_address, values):
     register: instance of the class Register. It is first register of
     the block of data
     values: values of the block to write
+    shadow: shadow of the registers of the device or None
+    ai_flag: flag to auto-increment the address or None if the device
+             does not support it
     '''
+    # Address of the first register, without the auto-increment flag
+    first = start_address
+    if ai_flag != None:
+        first &= ~ai_flag
+
     # Write the block of data
     try:
-        i2c.write_i2c_block_data(slaveAddr, start_address, values)   
+        __io ('write_block', i2c.write_i2c_block_data, slaveAddr, start_address, values)
+    except IOError as e:
+        if shadow is not None:
+            # The values of the registers are unknown
+            for i in xrange (len (values)):
+                shadow['values'].pop (first + i, None)
+        raise I2CError ('write_block', slaveAddr, start_address, e.errno, "Unable to read the block of data trhough the i2c. The error was: I/O error (%s): %s", (e.errno, e.strerror))
+
+    # Keep the shadow current. The block has no instances of the class
+    # Register, so only the registers already in the shadow (which were
+    # checked to be shadowable) are updated
+    if shadow is not None:
+        for i in xrange (len (values)):
+            if first + i in shadow['values']:
+                shadow['values'][first + i] = values[i]
+
+################
+# TRANSACTIONS #
+################
+
+def transaction (DEV):
+    '''
+    Create a transaction to collect masked writes on the registers of
+    the device. The writes on the same register are merged and the
+    runs of adjacent registers are written with one block write when
+    the transaction is committed
+    DEV: context of the device
+    '''
+    return {'dev': DEV, 'registers': {}, 'masks': {}, 'values': {}}
+
+def stage (T, register, mask, value):
+    '''
+    Add a masked write to the transaction
+    T:        transaction
+    register: instance of the class Register
+    mask:     mask to set the value
+    value:    value to set in the register
+    '''
+    if not register.writable:
+        return (False, 'Access to the register %s not valid. The register is only readable.' % register.name)
+
+    addr = register.addr
+    bits = bitOps.SetValueUnderMask(value, 0x0, mask) & mask
+
+    # Merge with the previous writes on the register
+    if addr in T['masks']:
+        bits = (T['values'][addr] & ~mask & 0xff) | bits
+        mask = T['masks'][addr] | mask
+
+    T['registers'][addr] = register
+    T['masks'][addr] = mask
+    T['values'][addr] = bits
+
+    return (True, None)
+
+def __runs (addresses, ai_flag):
+    '''
+    Group the sorted addresses into (start address, length) runs of
+    adjacent registers that fit in a block transfer
+    addresses: sorted list of register addresses
+    ai_flag:   flag to auto-increment the address or None if the device
+               does not support it
+    '''
+    runs = []
+    for addr in addresses:
+        if ai_flag != None and len (runs) > 0:
+            (start, length) = runs[-1]
+            if start + length == addr and length < MAX_BLOCK_LENGTH:
+                runs[-1] = (start, length + 1)
+                continue
+        runs.append ((addr, 1))
+
+    return runs
+
+def commit (T):
+    '''
+    Write the staged values of the transaction on the device. The
+    current values of the partially written registers are taken from
+    the shadow or read in blocks
+    T: transaction
+    '''
+    return __status (commit_fast, T)
+
+def commit_fast (T):
+    '''
+    Function to write the staged values of the transaction raising
+    I2CError on failure
+    T: transaction
+    '''
+    __arbitrated (T['dev'], __commit, T)
+
+def __commit (T):
+    '''
+    Function to write the staged values of the transaction
+    T: transaction
+    '''
+    DEV = T['dev']
+    i2c = DEV['bus']
+    slaveAddr = DEV['addr']
+    shadow = DEV.get ('shadow')
+    ai_flag = DEV.get ('ai_flag', AUTO_INCREMENT)
+    addresses = sorted (T['registers'].keys ())
+
+    try:
+        # Get the current values of the partially written registers
+        current = {}
+        pending = []
+        for addr in addresses:
+            register = T['registers'][addr]
+            if T['masks'][addr] == 0xff:
+                continue
+            if __shadowable (shadow, register) and shadow['mode'] == 'cache' and addr in shadow['values']:
+                current[addr] = shadow['values'][addr]
+            else:
+                pending.append (addr)
+
+        for (start, length) in __runs (pending, ai_flag):
+            if length == 1:
+                block = [__io ('read_byte', i2c.read_byte_data, slaveAddr, start)]
+            else:
+                block = __io ('read_block', i2c.read_i2c_block_data, slaveAddr, start | ai_flag, length)
+            for i in xrange (length):
+                current[start + i] = block[i]
+
+        # Get the new values
+        new = {}
+        for addr in addresses:
+            mask = T['masks'][addr]
+            if mask == 0xff:
+                new[addr] = T['values'][addr]
+            else:
+                new[addr] = (current[addr] & ~mask & 0xff) | T['values'][addr]
+
+        # Write the runs of adjacent registers
+        for (start, length) in __runs (addresses, ai_flag):
+            if length == 1:
+                __io ('write_byte', i2c.write_byte_data, slaveAddr, start, new[start])
+            else:
+                __io ('write_block', i2c.write_i2c_block_data, slaveAddr, start | ai_flag, [new[start + i] for i in xrange (length)])
     except IOError as e:
-        return (False, "Unable to read the block of data trhough the i2c. The error was: I/O error (%s): %s" %(e.errno, e.strerror))
+        if shadow is not None:
+            # The values of the registers are unknown
+            for addr in addresses:
+                shadow['values'].pop (addr, None)
+        raise I2CError ('commit', slaveAddr, None, e.errno, "Unable to commit the transaction through the i2c. The error was: I/O error (%s): %s", (e.errno, e.strerror))
+
+    # Keep the shadow current
+    for addr in addresses:
+        register = T['registers'][addr]
+        if __shadowable (shadow, register):
+            if shadow['mode'] == 'check' and addr in current and addr in shadow['values'] and shadow['values'][addr] != current[addr]:
+                shadow['mismatches'].append ((register.name, shadow['values'][addr], current[addr]))
+            shadow['values'][addr] = new[addr]
+
+    # Empty the transaction so it can be reused
+    T['registers'].clear ()
+    T['masks'].clear ()
+    T['values'].clear ()
+
+#############
+# SNAPSHOTS #
+#############
+
+I2C_RDWR          = 0x0707    # ioctl to perform combined read/write transfers
+I2C_M_RD          = 0x0001    # Flag of the messages to read from the slave
+I2C_RDWR_MAX_MSGS = 42        # Maximum number of messages of one I2C_RDWR transfer
+
+class I2CMsg (ctypes.Structure):
+    '''
+    Message of a combined transfer (struct i2c_msg)
+    '''
+    _fields_ = [('addr', ctypes.c_uint16),
+                ('flags', ctypes.c_uint16),
+                ('len', ctypes.c_uint16),
+                ('buf', ctypes.POINTER (ctypes.c_uint8))]
+
+class I2CRdwrData (ctypes.Structure):
+    '''
+    Argument of the I2C_RDWR ioctl (struct i2c_rdwr_ioctl_data)
+    '''
+    _fields_ = [('msgs', ctypes.POINTER (I2CMsg)),
+                ('nmsgs', ctypes.c_uint32)]
+
+__libc = None
+
+def __ioctl (fd, request, arg):
+    '''
+    Call to the ioctl of the C library with a pointer argument
+    '''
+    global __libc
+    if __libc == None:
+        __libc = ctypes.CDLL (ctypes.util.find_library ('c'), use_errno = True)
+
+    if __libc.ioctl (fd, request, arg) < 0:
+        err = ctypes.get_errno ()
+        raise IOError (err, os.strerror (err))
+
+def snapshot_open (bus_id = 1):
+    '''
+    Open the I2C device interface /dev/i2cX to take snapshots
+    bus_id: indicates the bus associated to the i2c device
+    '''
+    try:
+        fd = os.open ("/dev/i2c-%s" % bus_id, os.O_RDWR)
+    except OSError as e:
+        return (False, "Unable to open the i2c device interface. The error was: OS error (%s): %s" %(e.errno, e.strerror))
+
+    return (True, fd)
+
+def snapshot_close (S):
+    '''
+    Close the I2C device interface of the snapshot
+    '''
+    try:
+        os.close (S['fd'])
+    except OSError as e:
+        return (False, "Unable to close the i2c device interface. The error was: OS error (%s): %s" %(e.errno, e.strerror))
 
     return (True, None)
 
+def snapshot_plan (fd, requests):
+    '''
+    Prepare the messages to read several blocks of data, possibly from
+    different devices, with only one I2C_RDWR transfer. Each block is
+    requested with a write of the start address followed by a read
+    with repeated start
+    fd:       file descriptor of the I2C device interface
+    requests: list of (DEV, start address, nbytes). The start address
+              has to include the auto-increment flag if needed
+    '''
+    if len (requests) * 2 > I2C_RDWR_MAX_MSGS:
+        return (False, "Unable to prepare the snapshot. The number of blocks %s exceeds the maximum %s" % (len (requests), I2C_RDWR_MAX_MSGS / 2))
+
+    msgs = (I2CMsg * (len (requests) * 2)) ()
+    addresses = []
+    buffers = []
+    i = 0
+    for (DEV, start_address, nbytes) in requests:
+        address = (ctypes.c_uint8 * 1) (start_address)
+        buf = (ctypes.c_uint8 * nbytes) ()
+
+        msgs[i].addr = DEV['addr']
+        msgs[i].flags = 0
+        msgs[i].len = 1
+        msgs[i].buf = address
+
+        msgs[i + 1].addr = DEV['addr']
+        msgs[i + 1].flags = I2C_M_RD
+        msgs[i + 1].len = nbytes
+        msgs[i + 1].buf = buf
+
+        # Keep the references to the buffers of the messages
+        addresses.append (address)
+        buffers.append (buf)
+        i += 2
+
+    data = I2CRdwrData (msgs, len (requests) * 2)
+
+    return (True, {'fd': fd, 'requests': requests, 'msgs': msgs, 'data': data,
+                   'addresses': addresses, 'buffers': buffers})
+
+def snapshot (S, lengths = None):
+    '''
+    Read all the blocks of the snapshot with one I2C_RDWR transfer
+    S:       snapshot prepared by snapshot_plan
+    lengths: number of bytes to read of each block. They can not be
+             greater than the planned ones. None reads the planned ones
+    '''
+    return __status (snapshot_fast, S, lengths)
+
+def snapshot_fast (S, lengths = None):
+    '''
+    Function to read the blocks of the snapshot returning the list of
+    blocks and raising I2CError on failure
+    S:       snapshot prepared by snapshot_plan
+    lengths: number of bytes to read of each block or None
+    '''
+    return __arbitrated (None, __snapshot, S, lengths)
+
+def __snapshot (S, lengths):
+    '''
+    Function to read the blocks of the snapshot
+    S:       snapshot prepared by snapshot_plan
+    lengths: number of bytes to read of each block or None
+    '''
+    msgs = S['msgs']
+    if lengths != None:
+        for i in xrange (len (lengths)):
+            msgs[2*i + 1].len = min (lengths[i], S['requests'][i][2])
+
+    start = time.time ()
+    try:
+        __ioctl (S['fd'], I2C_RDWR, ctypes.byref (S['data']))
+    except IOError as e:
+        __accounted (None, None, 'snapshot', 0, start, True)
+        raise I2CError ('snapshot', None, None, e.errno, "Unable to take the snapshot trhough the i2c. The error was: I/O error (%s): %s", (e.errno, e.strerror))
+
+    blocks = []
+    for i in xrange (len (S['buffers'])):
+        blocks.append (bytearray (S['buffers'][i])[:msgs[2*i + 1].len])
+
+    # The blocks of the snapshot are accounted as one operation
+    if __stats is not None or __budget is not None:
+        __accounted (None, None, 'snapshot', sum ([len (block) for block in blocks]), start)
+
+    return blocks
+
+def __status (function, *args):
+    '''
+    Call a function of the fast path returning the (status, value)
+    tuple of the rest of the API
+    '''
+    try:
+        return (True, function (*args))
+    except I2CError as e:
+        return (False, str (e))
+
 def write(DEV, register, mask, value, get_current_value = True):
     ''' wrapper to the write function '''
-    return __write (DEV['bus'], DEV['addr'], register, mask, value, get_current_value)
+    return __status (write_fast, DEV, register, mask, value, get_current_value)
     
 def read(DEV, register, mask):
     ''' wrapper to the corresponding common_i2c function '''
-    return __read (DEV['bus'], DEV['addr'], register, mask)
+    return __status (read_fast, DEV, register, mask)
 
 def read_match(DEV, register, mask, dictionary):
     ''' wrapper to the corresponding common_i2c function '''
-    return __read_match (DEV['bus'], DEV['addr'], register, mask, dictionary)
+    return __status (read_match_fast, DEV, register, mask, dictionary)
 
 def read_block (DEV, start_address, nbytes):
     ''' wrapper to the corresponding common_i2c function '''
-    return __read_block (DEV['bus'], DEV['addr'], start_address, nbytes)
+    return __status (read_block_fast, DEV, start_address, nbytes)
+
+def read_block_into (DEV, start_address, buf, nbytes):
+    ''' wrapper to the corresponding common_i2c function '''
+    return __status (read_block_into_fast, DEV, start_address, buf, nbytes)
+
+def read_fifo_into (DEV, start_address, buf, nbytes, chunk = MAX_BLOCK_LENGTH):
+    ''' wrapper to the corresponding common_i2c function '''
+    return __status (read_fifo_into_fast, DEV, start_address, buf, nbytes, chunk)
 
 def write_block (DEV, start_address, values):
     ''' wrapper to the corresponding common_i2c function '''
-    return __write_block (DEV['bus'], DEV['addr'], start_address, values)
+    return __status (write_block_fast, DEV, start_address, values)
+
+#############
+# FAST PATH #
+#############
+
+# The functions of the fast path return the values directly and raise
+# I2CError on failure
+
+def write_fast (DEV, register, mask, value, get_current_value = True):
+    ''' Write a value in a register given a mask '''
+    __arbitrated (DEV, __write, DEV['bus'], DEV['addr'], register, mask, value, get_current_value, DEV.get ('shadow'))
+
+def read_fast (DEV, register, mask):
+    ''' Read the value of a register given a mask '''
+    return __arbitrated (DEV, __read, DEV['bus'], DEV['addr'], register, mask, DEV.get ('shadow'))
+
+def read_match_fast (DEV, register, mask, dictionary):
+    ''' Read the value of a register given a mask as its name in the dictionary '''
+    return __arbitrated (DEV, __read_match, DEV['bus'], DEV['addr'], register, mask, dictionary, DEV.get ('shadow'))
+
+def read_block_fast (DEV, start_address, nbytes):
+    ''' Read a block of data '''
+    return __arbitrated (DEV, __read_block, DEV['bus'], DEV['addr'], start_address, nbytes)
+
+def read_block_into_fast (DEV, start_address, buf, nbytes):
+    '''
+    Read a block of data into the first bytes of a buffer kept by the
+    caller and return the number of bytes read. The buses with
+    read_i2c_block_into (raw_i2c.RawBus) fill the buffer without
+    creating a list
+    '''
+    return __arbitrated (DEV, __read_block_into, DEV['bus'], DEV['addr'], start_address, buf, nbytes)
+
+def read_fifo_into_fast (DEV, start_address, buf, nbytes, chunk = MAX_BLOCK_LENGTH):
+    '''
+    Read nbytes of the output of a FIFO, whose address rolls back at
+    the end of each sample, into a buffer kept by the caller and return
+    the number of bytes read. The buses with read_i2c_block_into
+    (raw_i2c.RawBus) read them with one transfer, the rest with blocks
+    of chunk bytes
+    chunk: bytes of each block, up to MAX_BLOCK_LENGTH. A multiple of
+           the size of the samples keeps every block on a whole sample
+    '''
+    if hasattr (DEV['bus'], 'read_i2c_block_into'):
+        return read_block_into_fast (DEV, start_address, buf, nbytes)
+
+    if nbytes > len (buf):
+        raise I2CError ('read_block', DEV['addr'], start_address, errno.EINVAL, "Unable to read the block of data trhough the i2c. The block of %s bytes does not fit in the buffer of %s bytes", (nbytes, len (buf)))
+    offset = 0
+    while offset < nbytes:
+        length = min (chunk, nbytes - offset)
+        buf[offset:offset + length] = bytearray (read_block_fast (DEV, start_address, length))
+        offset += length
+    return nbytes
+
+def write_block_fast (DEV, start_address, values):
+    ''' Write a block of data '''
+    __arbitrated (DEV, __write_block, DEV['bus'], DEV['addr'], start_address, values, DEV.get ('shadow'), DEV.get ('ai_flag', AUTO_INCREMENT))
+
+############
+# RECOVERY #
+############
+
+# The recovery keeps the loop running through the transient errors of
+# the bus. A failed operation is retried within a budget of time and,
+# if it keeps failing, the last good result of the operation is served
+# (stale but valid) while the operation is skipped for a backoff that
+# doubles on every failure. When the backoff is over the device is
+# re-initialized before the operation is tried again. The writes are
+# only retried (retried_fast): a skipped write would leave the device
+# with old values, so their errors are raised once the budget is spent
+
+def recovery (budget = 500, backoff = 0.02, max_backoff = 1.0, max_age = None, clock = None):
+    '''
+    Create the state of the recovery of a group of operations
+    budget:      time in microseconds to retry a failed operation in
+                 the same call
+    backoff:     time in seconds to skip the operation after the first
+                 failure. It doubles on every failure up to max_backoff
+    max_backoff: maximum time in seconds to skip the operation
+    max_age:     maximum age in seconds of the stale results (None to
+                 serve them while the device is failing)
+    clock:       object with the method time () giving the time in
+                 seconds (None for the wall time)
+    '''
+    if clock == None:
+        clock = time
+    return {'budget': budget * 1e-6, 'backoff': backoff, 'max_backoff': max_backoff,
+            'max_age': max_age, 'clock': clock, 'entries': {}, 'retries': 0, 'failures': 0,
+            'stale': 0, 'reinits': 0, 'recoveries': 0, 'time': 0.0}
+
+def __entry (R, key):
+    ''' Get the state of the operation, creating it if needed '''
+    entry = R['entries'].get (key)
+    if entry is None:
+        entry = {'value': None, 'valid': False, 'time': 0.0, 'failed': False,
+                 'delay': 0.0, 'next_try': 0.0, 'error': None, 'reinit': None}
+        R['entries'][key] = entry
+
+    return entry
+
+def set_reinit (R, key, function, *args):
+    '''
+    Set the hook to re-initialize the device of the operation when its
+    backoff is over
+    R:        state of the recovery
+    key:      name of the operation
+    function: function of the fast path called with the arguments
+    '''
+    __entry (R, key)['reinit'] = (function, args)
+
+def isstale (R, key):
+    ''' Check if the operation is serving stale results '''
+    return R is not None and key in R['entries'] and R['entries'][key]['failed']
+
+def __stale (R, entry, now):
+    '''
+    Get the last good result of the operation or raise the last error
+    if there is none or it is too old
+    '''
+    if not entry['valid'] or (R['max_age'] != None and now - entry['time'] > R['max_age']):
+        raise entry['error']
+
+    R['stale'] += 1
+    return entry['value']
+
+def recovered_fast (R, key, function, *args):
+    '''
+    Call a function of the fast path with recovery. Returns the result
+    of the function or the last good result of the operation while the
+    bus is failing. Raises I2CError when there is no result to serve
+    R:        state of the recovery or None to call the function directly
+    key:      name of the operation. The results and the backoff are
+              kept by operation
+    function: function of the fast path
+    '''
+    if R is None:
+        return function (*args)
+
+    entry = __entry (R, key)
+    start = R['clock'].time ()
+
+    # Skip the device while it is backing off
+    if entry['failed'] and start < entry['next_try']:
+        return __stale (R, entry, start)
+
+    reinit = entry['failed'] and entry['reinit'] != None
+    retries = 0
+    while True:
+        try:
+            if reinit:
+                (function_reinit, args_reinit) = entry['reinit']
+                function_reinit (*args_reinit)
+                R['reinits'] += 1
+                reinit = False
+
+            value = function (*args)
+            break
+        except I2CError as e:
+            entry['error'] = e
+            now = R['clock'].time ()
+            if now - start >= R['budget']:
+                # Give up for this call and back off
+                entry['delay'] = min (max (2 * entry['delay'], R['backoff']), R['max_backoff'])
+                entry['next_try'] = now + entry['delay']
+                entry['failed'] = True
+                R['failures'] += 1
+                R['time'] += now - start
+                return __stale (R, entry, now)
+
+            retries += 1
+            R['retries'] += 1
+
+    if entry['failed'] or retries > 0:
+        if entry['failed']:
+            R['recoveries'] += 1
+        entry['failed'] = False
+        entry['delay'] = 0.0
+        R['time'] += R['clock'].time () - start
+
+    entry['value'] = value
+    entry['valid'] = True
+    entry['time'] = start
+
+    return value
+
+def recovered (R, key, function, *args):
+    ''' Call a function of the fast path with recovery '''
+    return __status (recovered_fast, R, key, function, *args)
+
+def retried_fast (R, key, function, *args):
+    '''
+    Call a function of the fast path that writes to the devices with
+    retries. The failed calls are retried within the budget and then
+    the error is raised: the writes never get stale results nor back
+    off, as the devices would be left with old values
+    R:        state of the recovery or None to call the function directly
+    key:      name of the operation
+    function: function of the fast path
+    '''
+    if R is None:
+        return function (*args)
+
+    entry = __entry (R, key)
+    start = R['clock'].time ()
+    retries = 0
+    while True:
+        try:
+            value = function (*args)
+            break
+        except I2CError as e:
+            entry['error'] = e
+            now = R['clock'].time ()
+            if now - start >= R['budget']:
+                entry['failed'] = True
+                R['failures'] += 1
+                R['time'] += now - start
+                raise
+
+            retries += 1
+            R['retries'] += 1
+
+    if entry['failed'] or retries > 0:
+        if entry['failed']:
+            R['recoveries'] += 1
+        entry['failed'] = False
+        R['time'] += R['clock'].time () - start
+
+    return value
+
+def retried (R, key, function, *args):
+    ''' Call a function of the fast path that writes with retries '''
+    return __status (retried_fast, R, key, function, *args)
+
+def reinit_device_fast (DEV):
+    '''
+    Re-initialize a device after a failure: reopen the bus opened by its
+    Init (not the buses given to Init nor the ones created by a bus
+    factory, which may be shared) and write back the shadowed
+    configuration, lost if the device was reset
+    DEV: context of the device
+    '''
+    if __bus_factory == None and DEV.get ('bus_id') != None:
+        # The bus is replaced once the new one is open, so the context
+        # keeps a bus when the reopen fails
+        try:
+            bus = open_bus (DEV['bus_id'])
+        except IOError as e:
+            raise I2CError ('reinit', DEV['addr'], None, e.errno, "Unable to reopen the bus of the device. The error was: I/O error (%s): %s", (e.errno, e.strerror))
+
+        old = DEV['bus']
+        DEV['bus'] = bus
+        try:
+            old.close ()
+        except IOError:
+            # The failed bus is discarded anyway
+            pass
+
+    shadow = DEV.get ('shadow')
+    if shadow is None:
+        return
+
+    for (addr, value) in sorted (shadow['values'].items ()):
+        try:
+            __arbitrated (DEV, __io, 'write_byte', DEV['bus'].write_byte_data, DEV['addr'], addr, value)
+        except IOError as e:
+            raise I2CError ('reinit', DEV['addr'], addr, e.errno, "Unable to restore the shadowed registers of the device. The error was: I/O error (%s): %s", (e.errno, e.strerror))
+
+def format_recovery (R):
+    '''
+    Format the counters of the recovery as lines of text
+    '''
+    lines = ["%-10s %8s %8s %8s %8s %10s %12s" % ('retries', 'failures', 'stale', 'reinits', 'recovered', 'time(s)', 'failing')]
+    failing = [str (key) for (key, entry) in sorted (R['entries'].items ()) if entry['failed']]
+    lines.append ("%-10d %8d %8d %8d %8d %10.6f %12s" % (R['retries'], R['failures'], R['stale'], R['reinits'], R['recoveries'], R['time'], ",".join (failing)))
+
+    return (True, lines)
@@ -3,31 +3,37 @@
 # Library for the Raspberry Pi that interfaces with L3GD20 gyros on
 # Polulu boards
 
-from smbus import SMBus
 from common_i2c import *
 import bitOps
+import regmap
 import numpy
 import time
 
 DEV_SLAVE_ADDR = 0x6b         # Default device slave address
 DEV_BUS_ID     = 1            # Default device bus id
 CALIBRATION_ITERATIONS = 20   # Default number for calibration operations
+FIFO_DEPTH     = 32           # Number of samples of the FIFO
+FIFO_CHUNK     = 30           # Bytes of each block read of the FIFO (5 samples)
 
 def Init (bus = None, 
           slaveAddr = DEV_SLAVE_ADDR, 
           cal_iter = CALIBRATION_ITERATIONS,
-          scale = None):
+          scale = None,
+          shadow = None):
     '''
     bus:       indicates the bus associated to the i2c device /dev/i2cX
     slaveAddr: indicates the address of the slave device
     cal_iter:  indicates the number of iterations to calibrate each axis
     scale:     indicates the measurement range
+    shadow:    indicates the mode of the shadow registers ('cache' or 'check').
+               None disables the shadow
     '''
     G = {}
     G['bus'] = bus
     if bus == None:
         try:
-            G['bus'] = SMBus(DEV_BUS_ID)
+            G['bus'] = open_bus(DEV_BUS_ID)
+            G['bus_id'] = DEV_BUS_ID
         except IOError as e:
             G['error'] = (True, "Unable to create the gyroscope. The error was: I/O error (%s): %s" %(e.errno, e.strerror))
             return G
@@ -35,6 +41,16 @@ def Init (bus = None,
     G['cal_iter'] = cal_iter
     G['error'] = (False, None)
 
+    # Buffer to drain the FIFO without creating lists
+    G['fifo_buffer'] = bytearray (6*FIFO_DEPTH)
+
+    # Shadow the registers to save the reads of the masked writes
+    if shadow != None:
+        (status, message) = enable_shadow (G, shadow)
+        if not status:
+            G['error'] = (True, message)
+            return G
+
     # Set the gain for the out values
     if scale == None:
         (status, scale) = get_scale(G)
@@ -238,65 +254,172 @@ __FIFOMode = {
 # Watermark status
 __WTM = {'lower': 0x0, 'equal_greater': 0x1}
 
-#############
-# FUNCTIONS #
-#############
-    
-def calibrateX(G):
-    ''' Calibrate X axis '''
-    buff = []
-    for t in range(G['cal_iter']):
-        (status, data_available) = isdata_available(G)
-        while not data_available[0]:
-            time.sleep(0.0001)
-            (status, data_available) = isdata_available(G)
-
-        buff.append(get_x(G)[1])
-    G['meanX'] = numpy.mean(buff) 
-    G['maxX'] = max(buff)
-    G['minX'] = min(buff)
-    
-    return
+##########
+# FIELDS #
+##########
 
-def calibrateY(G):
-    ''' Calibrate Y axis '''
-    buff = []
-    for t in range(G['cal_iter']):
-        (status, data_available) = isdata_available(G)
-        while not data_available[1]:
-            time.sleep(0.0001)
-            (status, data_available) = isdata_available(G)
-
-        buff.append(get_y(G)[1])
-    G['meanY'] = numpy.mean(buff) 
-    G['maxY'] = max(buff)
-    G['minY'] = min(buff)
-    
-    return
+__Map = regmap.RegisterMap ('gyroscope')
 
-def calibrateZ(G):
-    ''' Calibrate Y axis '''
-    buff = []
-    for t in range(G['cal_iter']):
-        (status, data_available) = isdata_available(G)
-        while not data_available[2]:
-            time.sleep(0.0001)
-            (status, data_available) = isdata_available(G)
+def __decode_powermode (ctrl1):
+    ''' Get the power mode (sleep mode or the power-down bit) '''
+    powermode = bitOps.GetValueUnderMaskDictMatch (ctrl1, __MASK_SLEEP, __PowerMode)
+    if powermode == None:
+        powermode = bitOps.GetValueUnderMaskDictMatch (ctrl1, __MASK_PD, __PowerMode)
+    return powermode
 
-        buff.append(get_z(G)[1])
-    G['meanZ'] = numpy.mean(buff) 
-    G['maxZ'] = max(buff)
-    G['minZ'] = min(buff)
+def __decode_hpcf (ctrl1, ctrl2):
+    ''' Get the high-pass filter cutoff frequency, which depends on the data rate '''
+    (datarate, bandwidth) = __FIELD_DRBW.decode (ctrl1)
+    current = bitOps.GetField (__MASK_HPCF).get (ctrl2)
+    for freq in __HPCF.keys():
+        if __HPCF[freq].get (datarate) == current:
+            return freq
+    return None
+
+__FIELD_DeviceId  = __Map.field ('device id', __WHO_AM_I)
+__FIELD_Xen       = __Map.field ('x axis enable', __CTRL_REG1, __MASK_Xen, __Enable)
+__FIELD_Yen       = __Map.field ('y axis enable', __CTRL_REG1, __MASK_Yen, __Enable)
+__FIELD_Zen       = __Map.field ('z axis enable', __CTRL_REG1, __MASK_Zen, __Enable)
+__FIELD_PowerMode = __Map.derived ('power mode', __decode_powermode, __CTRL_REG1)
+__FIELD_DRBW      = __Map.field ('data rate and bandwidth', __CTRL_REG1, __MASK_DRBW, regmap.flatten (__DRBW))
+__FIELD_HPM       = __Map.field ('high pass filter mode', __CTRL_REG2, __MASK_HPM, __HPM)
+__FIELD_HPCF      = __Map.derived ('high pass filter cutoff frequency', __decode_hpcf, __CTRL_REG1, __CTRL_REG2)
+__FIELD_FS        = __Map.field ('scale', __CTRL_REG4, __MASK_FS, __Scales)
+__FIELD_BLE       = __Map.field ('endianness', __CTRL_REG4, __MASK_BLE, __Endianness)
+__FIELD_BDU       = __Map.field ('block data update', __CTRL_REG4, __MASK_BDU, __BlockDataUpdate)
+__FIELD_OUT_SEL   = __Map.field ('out selection configuration', __CTRL_REG5, __MASK_OUT_SEL, __OutSel)
+__FIELD_HPEN      = __Map.field ('high-pass filter enable', __CTRL_REG5, __MASK_HPEN, __Enable)
+__FIELD_FIFO_EN   = __Map.field ('FIFO enable', __CTRL_REG5, __MASK_FIFO_EN, __Enable)
+__FIELD_BOOT      = __Map.field ('boot mode', __CTRL_REG5, __MASK_BOOT, __BootMode)
+__FIELD_Reference = __Map.field ('reference value', __REFERENCE)
+__FIELD_Temp      = __Map.field ('temperature', __OUT_TEMP)
+__FIELD_THR       = __Map.field ('FIFO threshold value', __FIFO_CTRL_REG, __MASK_THR)
+__FIELD_FM        = __Map.field ('FIFO mode', __FIFO_CTRL_REG, __MASK_FM, __FIFOMode)
+__FIELD_FSS       = __Map.field ('FIFO stored data level', __FIFO_SRC_REG, __MASK_FSS)
+__FIELD_EMPTY     = __Map.field ('FIFO empty status', __FIFO_SRC_REG, __MASK_EMPTY, __Enable)
+__FIELD_OVRN      = __Map.field ('FIFO overrun status', __FIFO_SRC_REG, __MASK_OVRN, __Enable)
+__FIELD_WTM       = __Map.field ('watermark status', __FIFO_SRC_REG, __MASK_WTM, __WTM)
+
+#######################
+# GENERATED ACCESSORS #
+#######################
+
+get_deviceid         = __Map.getter (__FIELD_DeviceId, 'Get WHO_AM_I value')
+enable_x             = __Map.setter (__FIELD_Xen, 'Enable x Axis')
+isenabled_x          = __Map.getter (__FIELD_Xen, 'Check if x axis is enabled')
+enable_y             = __Map.setter (__FIELD_Yen, 'Enable y Axis')
+isenabled_y          = __Map.getter (__FIELD_Yen, 'Check if y axis is enabled')
+enable_z             = __Map.setter (__FIELD_Zen, 'Enable z Axis')
+isenabled_z          = __Map.getter (__FIELD_Zen, 'Check if z axis is enabled')
+get_powermode        = __Map.getter (__FIELD_PowerMode, 'Get power mode')
+get_drbw             = __Map.getter (__FIELD_DRBW, 'Get data rate and bandwidth')
+set_hpfm             = __Map.setter (__FIELD_HPM, 'Set the high-pass filter mode')
+get_hpfm             = __Map.getter (__FIELD_HPM, 'Get the high-pass filter mode')
+get_hpcf             = __Map.getter (__FIELD_HPCF, 'Get the high-pass filter cutoff frequency')
+get_scale            = __Map.getter (__FIELD_FS, 'Get full scale')
+set_endianness       = __Map.setter (__FIELD_BLE, 'Set endianness')
+get_endianness       = __Map.getter (__FIELD_BLE, 'Get endianness')
+set_bdu              = __Map.setter (__FIELD_BDU, 'Set the block data update')
+get_bdu              = __Map.getter (__FIELD_BDU, 'Get the block data update')
+get_bootmode         = __Map.getter (__FIELD_BOOT, 'Get the boot mode')
+enable_fifo          = __Map.setter (__FIELD_FIFO_EN, 'Enable FIFO')
+isenabled_fifo       = __Map.getter (__FIELD_FIFO_EN, 'Check if FIFO is enabled')
+enable_hp            = __Map.setter (__FIELD_HPEN, 'Enable high-pass filter')
+isenabled_hp         = __Map.getter (__FIELD_HPEN, 'Check if the high-pass filter is enabled')
+set_outsel           = __Map.setter (__FIELD_OUT_SEL, 'Set the out selection configuration')
+get_outsel           = __Map.getter (__FIELD_OUT_SEL, 'Get the out selection configuration')
+set_reference        = __Map.setter (__FIELD_Reference, 'Set the reference value')
+get_reference        = __Map.getter (__FIELD_Reference, 'Get the reference value')
+get_temp             = __Map.getter (__FIELD_Temp, 'Get Temperature', PRIORITY_LOW)
+set_fifoth           = __Map.setter (__FIELD_THR, 'Set the FIFO threshold value')
+get_fifoth           = __Map.getter (__FIELD_THR, 'Get the FIFO threshold value')
+set_fifomode         = __Map.setter (__FIELD_FM, 'Set FIFO mode')
+get_fifomode         = __Map.getter (__FIELD_FM, 'Get FIFO mode')
+get_fifolevel        = __Map.getter (__FIELD_FSS, 'Get FIFO stored data level')
+isfifo_empty         = __Map.getter (__FIELD_EMPTY, 'FIFO empty')
+isfifo_full          = __Map.getter (__FIELD_OVRN, 'FIFO full')
+get_watermark_status = __Map.getter (__FIELD_WTM, 'Get the watermark status (FIFO filling is greater or equal than watermark level)')
+
+# Configuration of the device, reading the control registers and the
+# reference with one block read
+get_conf = __Map.conf ([
+    ('ctrl1', [('xen', __FIELD_Xen), ('yen', __FIELD_Yen), ('zen', __FIELD_Zen),
+               ('pd', __FIELD_PowerMode), ('drbw', __FIELD_DRBW)]),
+    ('ctrl2', [('hpcf', __FIELD_HPCF), ('hpfm', __FIELD_HPM)]),
+    ('ctrl4', [('fs', __FIELD_FS), ('ble', __FIELD_BLE), ('bdu', __FIELD_BDU)]),
+    ('ctrl5', [('outsel', __FIELD_OUT_SEL), ('hpen', __FIELD_HPEN),
+               ('fifo_en', __FIELD_FIFO_EN), ('boot', __FIELD_BOOT)]),
+    ('referene', __FIELD_Reference)
+    ], [(__CTRL_REG1, __REFERENCE)])
 
-    return
+#############
+# FUNCTIONS #
+#############
     
-def calibrate(G):
-    ''' Calibrate the three axis '''
-    calibrateX(G)
-    calibrateY(G)
-    calibrateZ(G)
+def calibrate (G, samples = None, max_std = None):
+    '''
+    Calibrate the three axis in one pass, getting the mean, the minimum,
+    the maximum and the variance of each axis from the same samples
+    samples: number of samples to take (G['cal_iter'] if None)
+    max_std: maximum standard deviation in dps of each axis, to reject
+             the calibration when the device moves (None accepts any)
+    '''
+    if samples == None:
+        samples = G['cal_iter']
+
+    try:
+        data = read_samples_fast (G, samples)
+    except I2CError as e:
+        return (False, "Unable to calibrate the gyroscope device. The error was: %s" % e)
+
+    std = data.std (axis = 0)
+    if max_std != None and (std > max_std).any ():
+        return (False, "Unable to calibrate the gyroscope device. The device moved during the calibration (standard deviation %s dps)" % std)
+
+    mean = data.mean (axis = 0)
+    minimum = data.min (axis = 0)
+    maximum = data.max (axis = 0)
+    variance = data.var (axis = 0)
+    for (i, axis) in enumerate (['X', 'Y', 'Z']):
+        G['mean' + axis] = float (mean[i])
+        G['min' + axis] = float (minimum[i])
+        G['max' + axis] = float (maximum[i])
+        G['var' + axis] = float (variance[i])
 
-    return
+    return (True, None)
+
+def read_samples_fast (G, nsamples):
+    '''
+    Get the next nsamples samples as a (N,3) array of angular rates
+    raising I2CError on failure. The samples are drained from the FIFO
+    when it is enabled, otherwise each one is read with a block read
+    once the status tells it is available
+    '''
+    (datarate, bandwidth) = __Map.get_fast (G, __FIELD_DRBW)
+    fifo = __Map.get_fast (G, __FIELD_FIFO_EN) and __Map.get_fast (G, __FIELD_FM) != 'bypass'
+
+    blocks = []
+    count = 0
+    while True:
+        if fifo:
+            block = read_fifo_fast (G, nsamples - count)
+        elif read_fast (G, __STATUS_REG, 0xff) & __MASK_ZYXDA:
+            block = decode_block_xyz_array (G, read_block_fast (G, __OUT_X_L.addr+0x80, 6))
+        else:
+            block = []
+
+        if len (block) > 0:
+            blocks.append (block)
+            count += len (block)
+        if count >= nsamples:
+            return numpy.vstack (blocks)
+
+        # Wait for the rest of the samples (up to half of the FIFO) or
+        # poll the status for the next one
+        if fifo:
+            time.sleep (min (nsamples - count, FIFO_DEPTH / 2) / float (datarate))
+        else:
+            time.sleep (0.25 / datarate)
 
 ###################
 # Print functions #
@@ -360,56 +483,6 @@ def print_configuration(G):
     
     return
     
-def get_deviceid(G):
-    ''' Get WHO_AM_I value '''
-    (status, devid) = read(G, __WHO_AM_I, 0xff)
-    if not status:
-        return (False, "Unable to get the device id. The error was: %s" % devid)
-
-    return (True, devid)
-
-def enable_x(G, enabled):
-    ''' Enable x Axis '''
-    (status, message) = write(G, __CTRL_REG1, __MASK_Xen, __Enable[enabled])
-    if not status:
-        return (False, 'Unable to enable or disable x axis for the gyroscope device. The error was %s' % message)
-    return (True, None)
-    
-def isenabled_x(G):
-    ''' Check if x axis is enabled '''
-    (status, enabled) = read_match(G, __CTRL_REG1, __MASK_Xen, __Enable)
-    if not status:
-        return (False, 'Unable to check if x axis is enabled for the gyroscope device. The error was %s' % enabled)
-    return (True, enabled)
-
-def enable_y(G, enabled):
-    ''' Enable y Axis '''
-    (status, message) = write(G, __CTRL_REG1, __MASK_Yen, __Enable[enabled])
-    if not status:
-        return (False, 'Unable to enable or disable y axis for the gyroscope device. The error was %s' % message)
-    return (True, None)
-
-def isenabled_y(G):
-    ''' Check if y axis is enabled '''
-    (status, enabled) = read_match(G, __CTRL_REG1, __MASK_Yen, __Enable)
-    if not status:
-        return (False, 'Unable to check if y axis is enabled for the gyroscope device. The error was %s' % enabled)
-    return (True, enabled)
-
-def enable_z(G, enabled):
-    ''' Enable z Axis '''
-    (status, message) = write(G, __CTRL_REG1, __MASK_Zen, __Enable[enabled])
-    if not status:
-        return (False, 'Unable to enable or disable z axis for the gyroscope device. The error was %s' % message)
-    return (True, None)
-
-def isenabled_z(G):
-    ''' Check if z axis is enabled '''
-    (status, enabled) = read_match(G, __CTRL_REG1, __MASK_Zen, __Enable)
-    if not status:
-        return (False, 'Unable to check if z axis is enabled for the gyroscope device. The error was %s' % enabled)
-    return (True, enabled)
-
 def set_powerdownmode(G):
     ''' Set power-down mode '''
     (status, message) = write(G, __CTRL_REG1, __MASK_PD, __PowerMode['power_down'])
@@ -434,19 +507,6 @@ def poweron(G):
 
     return (True, None)
 
-def get_powermode(G):
-    ''' Get power mode '''
-    # Check sleep mode
-    (status, powermode) = read_match(G, __CTRL_REG1, __MASK_SLEEP, __PowerMode)
-    # Check power-down or normal mode
-    if not status:
-        (status, powermode) = read_match(G, __CTRL_REG1, __MASK_PD, __PowerMode)            
-        
-    if not status:
-        return (False, 'Unable to get the power mode on the gyroscope device. The error was %s' % powermode)
-
-    return (True, powermode)
-
 def set_drbw(G, datarate, bandwidth):
     ''' Set data rate and bandwidth '''
     if datarate not in __DRBW.keys():
@@ -461,45 +521,6 @@ def set_drbw(G, datarate, bandwidth):
 
     return (True, None)
 
-def get_drbw(G):
-    ''' Get data rate and bandwidth '''
-    (status, current) = read(G, __CTRL_REG1, __MASK_DRBW)
-    if not status:
-        return (False, "Unable to get the configurated data rate and the bandwidth for the gyroscope device. The error was: %s." % current)
-    # Convert to the proper value in Hz
-    for dr in __DRBW.keys():
-        for bw in __DRBW[dr].keys():
-            if __DRBW[dr][bw] == current:
-                return (True, (dr, bw))
-
-    # never reached
-    return (False, "Unable to get the configurated data rate for the gyroscope device")
-
-def set_hpfm(G, mode):
-    ''' Set the high-pass filter mode '''
-    if mode not in __HPM.keys():
-        return (False, 'High pass filter mode %s is not in range of high pass frequency modes for the gyroscope device.' % mode)
-
-    # Obtain the value and write it
-    bits = __HPM[mode]
-    (status, message) = write(G, __CTRL_REG2, __MASK_HPM, bits)
-    if not status:
-        return (False, 'Unable to set the high pass filter mode on the gyroscope device. The error was %s' % message)        
-    return (True, None)
-
-def get_hpfm(G):
-    ''' Get the high-pass filter mode '''
-    (status, current) = read(G, __CTRL_REG2, __MASK_HPM)
-    if not status:
-        return (False, "Unable to get the configurated high pass filter mode on the gyroscope device. The error was: %s." % current)
-
-    for mode in __HPM.keys():
-        if __HPM[mode] == current:
-            return (True, mode)
-
-    # never reached    
-    return (False, "Unable to get the configurated high pass filter mode on the gyroscope device")
-
 def set_hpcf(G, freq):
     ''' Set the high-pass filter cutoff frequency '''
     # Check frequency value
@@ -518,25 +539,6 @@ def set_hpcf(G, freq):
 
     return (True, None)
     
-def get_hpcf(G):
-    ''' Get the high-pass filter cutoff frequency '''
-    (status, current) = read(G, __CTRL_REG2, __MASK_HPCF)
-    if not status:
-        return (False, "Unable to get the high pass filter cutoff frequency on the gyroscope device. The error was: %s" % current)
-    (status, data) = get_drbw(G)
-    if not status:
-        return (status, "Unable to get the high pass filter cutoff frequency on the gyroscope device. The error was %s" % data)
-    datarate = data[0]
-    # Convert to the proper value in Hz
-    for freq in __HPCF.keys():
-        for dr in __HPCF[freq]:
-            if dr == datarate:
-                if __HPCF[freq][datarate] == current:
-                    return (True, freq)
-
-    # never reached    
-    return (False, "Unable to get the high pass filter cutoff frequency on the gyroscope device.")
-
 def set_scale(G, scale):
     ''' Set full scale '''
     if not scale in __Scales.keys():
@@ -548,141 +550,17 @@ def set_scale(G, scale):
     
     return (status, message)
 
-def get_scale(G):
-    ''' Get full scale '''
-    (status, scale) = read_match(G, __CTRL_REG4, __MASK_FS, __Scales)
-    if not status:
-        return (False, "Unable to get the scale of the gyroscope device. The error was %s." % scale)
-
-    return (True, scale)
-
-    
-def set_endianness(G, value):
-    ''' Set endianness '''
-    (status, message) = write(G, __CTRL_REG4, __MASK_BLE, __Endianness[value]) 
-    if not status:
-        return (False, "Unable to set the endianness of the gyroscope device. The error was %s.", message)
-
-    return (True, None)
-    
-def get_endianness(G):
-    ''' Get endianness '''
-    (status, endianness) = read_match(G, __CTRL_REG4, __MASK_BLE, __Endianness)
-    if not status:
-        return (False, "Unable to get the endianness of the gyroscope device. The error was %s.", endianness)
-    
-    return (True, endianness)
-
-def set_bdu(G, value):
-    ''' Set the block data update '''
-    (status, message) = write(G, __CTRL_REG4, __MASK_BDU, __BlockDataUpdate[value]) 
-    if not status:
-        return (False, "Unable to set the block data update of the gyroscope device. The error was %s.", message)
-
-    return (True, None)
-
-def get_bdu(G):
-    ''' Get the block data update '''
-    (status, bdu) = read_match(G, __CTRL_REG4, __MASK_BDU, __BlockDataUpdate)
-
-    if not status:
-        return (False, "Unable to get the block data update of the gyroscope device. The error was %s.", bdu)
-    
-    return (True, bdu)
-
-    
 def set_bootmode(G, value):
     ''' Set the boot mode '''
     (status, message) = write(G, __CTRL_REG5, __MASK_BOOT, __BootMode[value]) 
     if not status:
         return (False, "Unable to set the boot mode of the gyroscope device. The error was %s.", message)
 
-    return (True, None)
-
-def get_bootmode(G):
-    ''' Get the boot mode '''
-    (status, bootmode) = read_match(G, __CTRL_REG5, __MASK_BOOT, __BootMode)
-    if not status:
-        return (False, "Unable to get the bootmode of the gyroscope device. The error was %s.", bootmode)
-    
-    return (True, bootmode)
-
-
-def enable_fifo(G, enabled):
-    ''' Enable FIFO '''
-    (status, message) = write(G, __CTRL_REG5, __MASK_FIFO_EN, __Enable[enabled]) 
-    if not status:
-        return (False, "Unable to enable or disable the FIFO on the gyroscope device. The error was %s.", message)
-
-    return (True, None)
-
-
-def isenabled_fifo(G):
-    ''' Check if FIFO is enabled '''
-    (status, enabled) = read_match(G, __CTRL_REG5, __MASK_FIFO_EN, __Enable)
-    if not status:
-        return (False, "Unable to check if the FIFO is enabled on the gyroscope device. The error was %s.", enabled)
-    
-    return (True, enabled)
-
-def enable_hp(G, enabled):
-    '''  Enable high-pass filter '''
-    (status, message) = write(G, __CTRL_REG5, __MASK_HPEN, __Enable[enabled]) 
-    if not status:
-        return (False, "Unable to enable or disable the high-pass filter on the gyroscope device. The error was %s.", message)
-
-    return (True, None)
-
-def isenabled_hp(G):
-    ''' Check if the high-pass filter is enabled '''
-    (status, enabled) = read_match(G, __CTRL_REG5, __MASK_HPEN, __Enable)
-    if not status:
-        return (False, "Unable to check if the high-pass filter is enabled on the gyroscope device. The error was %s.", enabled)
-    
-    return (True, enabled)
-
-def set_outsel(G, value):
-    ''' Set the out selection configuration '''
-    (status, message) = write(G, __CTRL_REG5, __MASK_OUT_SEL, __OutSel[value]) 
-    if not status:
-        return (False, "Unable to set the out selection configuration on the gyroscope device. The error was %s.", message)
+    # The reboot reloads the registers from the internal memory
+    invalidate_shadow (G)
 
     return (True, None)
 
-
-def get_outsel(G):
-    ''' Get the out selection configuration '''
-    (status, out) = read_match(G, __CTRL_REG5, __MASK_OUT_SEL, __OutSel)
-    if not status:
-        return (False, "Unable to get the out selection configuration on the gyroscope device. The error was %s.", out)
-    
-    return (True, out)
-    
-def set_reference(G, value):
-    ''' Set the reference value '''
-    (status, message) = write(G, __REFERENCE, 0xff, value) 
-    if not status:
-        return (False, "Unable to set the reference on the gyroscope device. The error was %s.", message)
-
-    return (True, None)
-
-    
-def get_reference(G):
-    ''' Get the reference value '''
-    (status, reference) = read(G, __REFERENCE, 0xff)
-    if not status:
-        return (False, "Unable to get the reference value on the gyroscope device. The error was: %s" % reference)
-    
-    return (True, reference)
-
-def get_temp(G):
-    ''' Get Temperature '''
-    (status, temp) = read(G, __OUT_TEMP, 0xff)
-    if not status:
-        return (False, "Unable to get the temperature on the gyroscope device. The error was: %s" % temp)
-
-    return (True, temp) 
-    
 def isdata_overrun(G):
     ''' Check if there was data overrun on each axis '''
     zor = False
@@ -782,26 +660,51 @@ def get_xyz(G):
 def get_block_xyz (G):
     ''' Get the three axis angular rate data '''
     # Get the six values for x, y and z low and high parts
-    (status, values) = read_block (G, __OUT_X_L.get_addr()+0x80, 6)
+    (status, values) = read_block (G, __OUT_X_L.addr+0x80, 6)
     if not status:
         return (False, "Unable to get the axis angular rate data")
 
+    return (True, decode_block_xyz (G, values))
+
+def decode_block_xyz_array (G, values):
+    '''
+    Convert a block of samples into a (N,3) array of angular rates,
+    with the same results as todegrees
+    values: block of data with the low and high parts of x, y and z
+    '''
+    data = bitOps.BytesToArray (values)
+    data = data[:len (data) - len (data) % 6].reshape (-1, 3, 2)
+    l = data[:,:,0].astype (numpy.int64)
+    h = data[:,:,1].view (numpy.int8).astype (numpy.int64)
+
+    return numpy.where (h < 0, h*256 - l, h*256 + l) * G['gain']
+
+def block_xyz_request (G, nsamples = 1):
+    ''' Snapshot request to read the three axis angular rate data '''
+    return (G, __OUT_X_L.addr+0x80, 6*nsamples)
+
+def decode_block_xyz (G, values, offset = 0):
+    '''
+    Convert the six bytes of a sample into the three axis angular rate data
+    values: block of data with the low and high parts of x, y and z
+    offset: position of the sample in the block
+    '''
     # X
-    l = values[0]
-    h = values[1]
+    l = values[offset]
+    h = values[offset + 1]
     x = todegrees (G, h, l)
 
     # Y
-    l = values[2]
-    h = values[3]
+    l = values[offset + 2]
+    h = values[offset + 3]
     y = todegrees (G, h, l)
 
     # Z
-    l = values[4]
-    h = values[5]
+    l = values[offset + 4]
+    h = values[offset + 5]
     z = todegrees (G, h, l)
 
-    return (True, (x,y,z))
+    return (x,y,z)
     
 def get_calx(G):
     ''' Get the calibrated angular rate data of the x axis '''
@@ -845,167 +748,77 @@ def get_calxyz(G):
         return (False, "Unable to get the calibrated angular rate data of each axis")
     return (True, (x,y,z))
         
-def set_fifoth(G, value):
-    ''' Set the FIFO threshold value '''
-    (status, message) = write(G, __FIFO_CTRL_REG, __MASK_THR, value) 
-    if not status:
-        return (False, "Unable to set the FIFO threshold value on the gyroscope device. The error was %s.", message)
-
-    return (True, None)
-    
-def get_fifoth(G):
-    ''' Get the FIFO threshold value '''
-    (status, fifoth) = read(G, __FIFO_CTRL_REG, __MASK_THR)
-    if not status:
-        return (False, "Unable to get the FIFO threshold value on the gyroscope device. The error was %s.", fifoth)
-    return (True, fifoth)
-    
-def set_fifomode(G, value):
-    ''' Set FIFO mode '''
-    (status, message) = write(G, __FIFO_CTRL_REG, __MASK_FM, __FIFOMode[value])         
-    if not status:
-        return (False, "Unable to set the FIFO mode on the gyroscope device. The error was %s.", message)
-
-    return (True, None)
-
-def get_fifomode(G):
-    ''' Get FIFO mode '''
-    (status, fifomode) = read_match(G, __FIFO_CTRL_REG, __MASK_FM, __FIFOMode)
-    if not status:
-        return (False, "Unable to get the fifo mode on the gyroscope device. The error was %s.", fifomode)
-    
-    return (True, fifomode)
-
-def get_fifolevel(G):
-    ''' Get FIFO stored data level '''
-    (status, fifolevel) = read(G, __FIFO_SRC_REG, __MASK_FSS)
-    if not status:
-        return (False, "Unable to get the FIFO stored data level on the gyroscope device. The error was %s.", fifolevel)
-    return (True, fifolevel)
-    
-def isfifo_empty(G):
-    ''' FIFO empty '''
-    (status, fifoempty) = read_match(G, __FIFO_SRC_REG, __MASK_EMPTY, __Enable)
-    if not status:
-        return (False, "Unable to check if FIFO is empty on the gyroscope device. The error was %s.", fifoempty)
-    
-    return (True, fifoempty)
-
-    
-def isfifo_full(G):
-    ''' FIFO full '''
-    (status, fifofull) = read_match(G, __FIFO_SRC_REG, __MASK_OVRN, __Enable)
-    if not status:
-        return (False, "Unable to check if FIFO is full on the gyroscope device. The error was %s.", fifofull)
-    
-    return (True, fifofull)
-    
-def get_watermark_status(G):
-    ''' Get the watermark status (FIFO filling is greater or equal than watermark level) '''
-    (status, wtm) = read_match(G, __FIFO_SRC_REG, __MASK_WTM, __WTM)
-    if not status:
-        return (False, "Unable to get the watermark status on the gyroscope device. The error was %s.", wtm)
-    
-    return (True, wtm)
-
-def get_conf (G):
-
-    G['conf'] = {}
-
-    # CTRL_REG1
-    G['conf']['ctrl1'] = {}
-    ctrl1 = G['conf']['ctrl1']
-
-    (status, value) = isenabled_x(G)
-    if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    ctrl1['xen'] = value
-
-    (status, value) = isenabled_y(G)
-    if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    ctrl1['yen'] = value
-
-    (status, value) = isenabled_z(G)
-    if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    ctrl1['zen'] = value
-
-    (status, value) = get_powermode(G)
-    if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    ctrl1['pd'] = value
-
-    (status, value) = get_drbw(G)
-    if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    ctrl1['drbw'] = value
-
-    # CTRL_REG2
-    G['conf']['ctrl2'] = {}
-    ctrl2 = G['conf']['ctrl2']
-
-    (status, value) = get_hpcf(G)
-    if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    ctrl2['hpcf'] = value
-
-    (status, value) = get_hpfm(G)
-    if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    ctrl2['hpfm'] = value
-
-    # CTRL_REG4
-    G['conf']['ctrl4'] = {}
-    ctrl4 = G['conf']['ctrl4']
-
-    (status, value) = get_scale(G)
-    if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    ctrl4['fs'] = value
-
-    (status, value) = get_endianness(G)
-    if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    ctrl4['ble'] = value
-
-    (status, value) = get_bdu(G)
-    if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    ctrl4['bdu'] = value
+def get_temp_fast (G):
+    '''
+    Get the signed value of the temperature register (-1 LSB/C, without
+    an absolute reference) raising I2CError on failure
+    '''
+    return bitOps.TwosComplementToByte (with_priority (PRIORITY_LOW, read_fast, G, __OUT_TEMP, 0xff))
 
-    # CTRL_REG5
-    G['conf']['ctrl5'] = {}
-    ctrl5 = G['conf']['ctrl5']
+def fifolevel_request (G):
+    ''' Snapshot request to read the FIFO stored data level '''
+    return (G, __FIFO_SRC_REG.addr, 1)
 
-    (status, value) = get_outsel(G)
-    if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    ctrl5['outsel'] = value
+def decode_fifolevel (G, values):
+    ''' Get the FIFO stored data level from the FIFO_SRC_REG value '''
+    return bitOps.GetValueUnderMask(values[0], __MASK_FSS)
 
-    (status, value) = isenabled_hp(G)
-    if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    ctrl5['hpen'] = value
+def decode_fifo_status (G, values):
+    '''
+    Get the (level, watermark, overrun) status of the FIFO from the
+    FIFO_SRC_REG value. The level saturates at 31, the overrun bit
+    tells the FIFO is full (FIFO_DEPTH samples)
+    '''
+    src = values[0]
+    level = bitOps.GetValueUnderMask (src, __MASK_FSS)
+    if src & __MASK_OVRN:
+        level = FIFO_DEPTH
+    return (level, (src & __MASK_WTM) != 0, (src & __MASK_OVRN) != 0)
 
-    (status, value) = isenabled_fifo(G)
+def set_watermark (G, period):
+    '''
+    Set the FIFO threshold to the number of samples taken in a period of
+    the loop at the data rate of the device, so the watermark status
+    tells if the FIFO holds the samples of a whole period
+    period: period of the loop in seconds
+    '''
+    (status, drbw) = get_drbw (G)
     if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    ctrl5['fifo_en'] = value
-
-    (status, value) = get_bootmode(G)
+        return (False, drbw)
+    rate = drbw[0]
+    threshold = min (max (int (numpy.ceil (rate * period)), 1), FIFO_DEPTH - 1)
+    (status, message) = set_fifoth (G, threshold)
     if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    ctrl5['boot'] = value
+        return (False, message)
+    return (True, threshold)
 
-    # REFERENCE
-    (status, value) = get_reference(G)
-    if not status:
-        return (False, "Unable to get the gyro configuration. The error was %s" % value)
-    G['conf']['referene'] = value
+def read_fifo (G, max_samples = FIFO_DEPTH):
+    '''
+    Drain the samples stored in the FIFO and get them as a (N,3) array
+    of angular rates
+    max_samples: maximum number of samples to read
+    '''
+    try:
+        return (True, read_fifo_fast (G, max_samples))
+    except I2CError as e:
+        return (False, "Unable to read the FIFO of the gyroscope device. The error was: %s" % e)
 
-    return (True, False)
+def read_fifo_fast (G, max_samples = FIFO_DEPTH):
+    '''
+    Drain the samples stored in the FIFO raising I2CError on failure.
+    The samples are read with blocks of FIFO_CHUNK bytes, or with one
+    transfer on the buses reading into buffers. The (level, watermark,
+    overrun) status of the FIFO is stored in G['fifo_status']
+    '''
+    # Status of the FIFO of the last drain
+    G['fifo_status'] = decode_fifo_status (G, [read_fast (G, __FIFO_SRC_REG, 0xff)])
+    nsamples = min (G['fifo_status'][0], max_samples)
+    if nsamples <= 0:
+        return numpy.zeros ((0, 3))
 
+    nbytes = read_fifo_into_fast (G, __OUT_X_L.addr+0x80, G['fifo_buffer'], 6*nsamples, FIFO_CHUNK)
+    return decode_block_xyz_array (G, bitOps.BytesToArray (G['fifo_buffer'])[:nbytes])
+    
 def reset (G = None):
     '''
     Reset the values of the registers
@@ -1018,40 +831,26 @@ def reset (G = None):
         if G['error'][0]:
             return (False, "Error while creating the gyro. Error message was: " + G['error'][1])
 
-    # Write the default value of the CTRL_REG1 register (normal mode set -> PD = 1)
-    (status, message) = write (G, __CTRL_REG1, 0xff, 0xF)
-    if not status:
-        return (False, "Error while writing the default value of the CTRL_REG1 register. Error message was: " + message)
-
-    # Write the default value of the CTRL_REG2 register
-    (status, message) = write (G, __CTRL_REG2, 0xff, 0x0)
-    if not status:
-        return (False, "Error while writing the default value of the CTRL_REG2 register. Error message was: " + message)
-
-    # Write the default value of the CTRL_REG3 register
-    (status, message) = write (G, __CTRL_REG3, 0xff, 0x0)
-    if not status:
-        return (False, "Error while writing the default value of the CTRL_REG3 register. Error message was: " + message)
-
-    # Write the default value of the CTRL_REG4 register
-    (status, message) = write (G, __CTRL_REG4, 0xff, 0x0)
-    if not status:
-        return (False, "Error while writing the default value of the CTRL_REG4 register. Error message was: " + message)
-    
-    # Write the default value of the CTRL_REG5 register
-    (status, message) = write (G, __CTRL_REG5, 0xff, 0x0)
-    if not status:
-        return (False, "Error while writing the default value of the CTRL_REG5 register. Error message was: " + message)
-
-    # Write the default value of the REFERENCE register
-    (status, message) = write (G, __REFERENCE, 0xff, 0x0)
-    if not status:
-        return (False, "Error while writing the default value of the REFERENCE register. Error message was: " + message)
+    # Forget the shadowed values as all the registers are going to be rewritten
+    invalidate_shadow (G)
+
+    # Write the default values of the registers in one transaction
+    defaults = [(__CTRL_REG1, 0xF),        # Normal mode set -> PD = 1
+                (__CTRL_REG2, 0x0),
+                (__CTRL_REG3, 0x0),
+                (__CTRL_REG4, 0x0),
+                (__CTRL_REG5, 0x0),
+                (__REFERENCE, 0x0),
+                (__FIFO_CTRL_REG, 0x0)]
+    T = transaction (G)
+    for (register, value) in defaults:
+        (status, message) = stage (T, register, 0xff, value)
+        if not status:
+            return (False, "Error while writing the default value of the %s register. Error message was: %s" % (register.get_name (), message))
 
-    # Write the default value of the FIFO_CTRL_REG register
-    (status, message) = write (G, __FIFO_CTRL_REG, 0xff, 0x0)
+    (status, message) = commit (T)
     if not status:
-        return (False, "Error while writing the default value of the FIFO_CTRL_REG register. Error message was: " + message)
+        return (False, "Error while writing the default values of the registers. Error message was: " + message)
 
     # Finished test
     if delete_gyro:
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# Thread to perform the I2C operations on behalf of the control loop,
+# so the loop can compute while the devices are being read
+
+import collections
+import common_i2c
+import threading
+
+class Future (object):
+    '''
+    Result of a request to the worker. The result is the (status,
+    value) tuple returned by the requested function
+    '''
+
+    def __init__ (self):
+        self.event = threading.Event ()
+        self.lock = threading.Lock ()
+        self.callbacks = []
+        self.value = None
+
+    def set_result (self, value):
+        ''' Store the result and wake up the waiting threads '''
+        self.lock.acquire ()
+        self.value = value
+        self.event.set ()
+        callbacks = self.callbacks
+        self.callbacks = []
+        self.lock.release ()
+
+        for callback in callbacks:
+            callback (self)
+
+    def add_done_callback (self, callback):
+        '''
+        Call the function with the future when the request is performed
+        (straight away if it is already performed)
+        '''
+        self.lock.acquire ()
+        done = self.event.is_set ()
+        if not done:
+            self.callbacks.append (callback)
+        self.lock.release ()
+
+        if done:
+            callback (self)
+
+    def done (self):
+        ''' Check if the request has been performed '''
+        return self.event.is_set ()
+
+    def result (self, timeout = None):
+        '''
+        Wait for the result of the request
+        timeout: maximum time to wait in seconds (None waits forever)
+        '''
+        self.event.wait (timeout)
+        if not self.event.is_set ():
+            return (False, "The request to the i2c worker did not finish in %s seconds" % timeout)
+
+        return self.value
+
+class IOWorker (threading.Thread):
+    '''
+    Thread performing the requests in order of arrival. The requests
+    are appended to a deque, whose append and popleft are atomic, and
+    a semaphore wakes up the thread when there are pending requests
+    '''
+
+    def __init__ (self):
+        threading.Thread.__init__ (self)
+        self.daemon = True
+        self.requests = collections.deque ()
+        self.pending = threading.Semaphore (0)
+        self.performed = 0
+
+    def submit (self, function, *args):
+        '''
+        Request the worker to call the function with the arguments
+        function: function returning a (status, value) tuple
+        '''
+        future = Future ()
+        self.requests.append ((function, args, future))
+        self.pending.release ()
+        return future
+
+    def read (self, DEV, register, mask):
+        ''' Request to read a register '''
+        return self.submit (common_i2c.read, DEV, register, mask)
+
+    def write (self, DEV, register, mask, value):
+        ''' Request to write a register '''
+        return self.submit (common_i2c.write, DEV, register, mask, value)
+
+    def read_block (self, DEV, start_address, nbytes):
+        ''' Request to read a block of data '''
+        return self.submit (common_i2c.read_block, DEV, start_address, nbytes)
+
+    def write_block (self, DEV, start_address, values):
+        ''' Request to write a block of data '''
+        return self.submit (common_i2c.write_block, DEV, start_address, values)
+
+    def run (self):
+        while True:
+            self.pending.acquire ()
+            (function, args, future) = self.requests.popleft ()
+            if function == None:
+                future.set_result ((True, None))
+                break
+
+            try:
+                result = function (*args)
+            except Exception as e:
+                result = (False, "The request to the i2c worker failed. The error was: %s" % e)
+            future.set_result (result)
+            self.performed += 1
+
+    def stop (self):
+        ''' Finish the thread after the pending requests '''
+        future = self.submit (None)
+        self.join ()
+        return future.result ()
+
+def start ():
+    ''' Create and start a worker '''
+    worker = IOWorker ()
+    worker.start ()
+    return worker
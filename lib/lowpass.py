@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+# Low-pass filters for the samples of the devices. The filters receive
+# all the samples read in an iteration at once (an array with one row
+# per sample and one column per axis) and return the filtered value of
+# each axis, so their cost does not depend on the length of the window
+# nor on the number of samples drained from the FIFO row by row in
+# Python
+#
+# Example:
+#   F = lowpass.create ('boxcar', length = 20, rate = 100, initial = (0, 0, 1))
+#   (x, y, z) = F.update (accel.read_fifo_fast (A))
+
+import math
+import numpy
+
+class Boxcar (object):
+    '''
+    Mean of the last samples, kept in a ring buffer with the running
+    sum of its rows
+    '''
+
+    def __init__ (self, length, initial):
+        '''
+        length:  number of samples of the window
+        initial: value of each axis the window is filled with
+        '''
+        if length < 1:
+            raise ValueError ("The length of the window must be positive, not %s" % length)
+        self.length = length
+        self.buffer = numpy.empty ((length, len (initial)))
+        self.reset (initial)
+
+    def reset (self, initial):
+        ''' Fill the window with the value '''
+        self.buffer[:] = initial
+        self.head = 0               # Row of the oldest sample
+        self.sum = self.buffer.sum (axis = 0)
+        self.value = self.sum / self.length
+
+    def update (self, samples):
+        ''' Add the samples (one row each) and get the mean of the window '''
+        n = len (samples)
+        if n == 0:
+            return self.value
+
+        if n >= self.length:
+            # The whole window is replaced
+            self.buffer[:] = samples[n - self.length:]
+            self.head = 0
+            self.sum = self.buffer.sum (axis = 0)
+        else:
+            # The new rows replace the oldest ones, wrapping at the end
+            first = min (n, self.length - self.head)
+            rows = self.buffer[self.head:self.head + first]
+            self.sum += samples[:first].sum (axis = 0) - rows.sum (axis = 0)
+            rows[:] = samples[:first]
+            if first < n:
+                rows = self.buffer[:n - first]
+                self.sum += samples[first:].sum (axis = 0) - rows.sum (axis = 0)
+                rows[:] = samples[first:]
+            # end if
+            self.head = (self.head + n) % self.length
+
+            # Sum the window again on each turn so the rounding errors of
+            # the running sum do not accumulate
+            if self.head < n:
+                self.sum = self.buffer.sum (axis = 0)
+            # end if
+        # end if
+
+        self.value = self.sum / self.length
+        return self.value
+
+class Exponential (object):
+    '''
+    Exponential moving average: value += alpha * (sample - value)
+    '''
+
+    def __init__ (self, alpha, initial):
+        '''
+        alpha:   weight of each new sample, in (0, 1]
+        initial: value of each axis
+        '''
+        if not 0 < alpha <= 1:
+            raise ValueError ("The weight of the samples must be in (0, 1], not %s" % alpha)
+        self.alpha = alpha
+        self.reset (initial)
+
+    def reset (self, initial):
+        ''' Set the value of the filter '''
+        self.value = numpy.array (initial, dtype = float)
+
+    def update (self, samples):
+        ''' Add the samples (one row each) and get the filtered value '''
+        n = len (samples)
+        if n == 0:
+            return self.value
+
+        # Weight of each sample once the newer ones are added
+        decay = 1.0 - self.alpha
+        weights = self.alpha * decay ** numpy.arange (n - 1, -1, -1)
+        self.value = decay ** n * self.value + weights.dot (samples)
+        return self.value
+
+class Biquad (object):
+    '''
+    Second order Butterworth low-pass (transposed direct form II)
+    '''
+
+    def __init__ (self, cutoff, rate, initial):
+        '''
+        cutoff:  cutoff frequency in Hz, below rate/2
+        rate:    rate of the samples in Hz
+        initial: value of each axis, as if it was the input since ever
+        '''
+        if not 0 < cutoff < rate / 2.0:
+            raise ValueError ("The cutoff frequency must be in (0, %s), not %s" % (rate / 2.0, cutoff))
+        self.cutoff = cutoff
+        self.rate = rate
+
+        # Coefficients of the bilinear transform, normalized by a0
+        w0 = 2 * math.pi * cutoff / rate
+        alpha = math.sin (w0) / math.sqrt (2)
+        a0 = 1 + alpha
+        self.b0 = (1 - math.cos (w0)) / 2 / a0
+        self.b1 = (1 - math.cos (w0)) / a0
+        self.b2 = self.b0
+        self.a1 = -2 * math.cos (w0) / a0
+        self.a2 = (1 - alpha) / a0
+        self.reset (initial)
+
+    def reset (self, initial):
+        ''' Set the steady state of the filter for a constant input '''
+        self.value = numpy.array (initial, dtype = float)
+        self.z1 = (self.b1 + self.b2 - self.a1 - self.a2) * self.value
+        self.z2 = (self.b2 - self.a2) * self.value
+
+    def update (self, samples):
+        ''' Add the samples (one row each) and get the filtered value '''
+        if len (samples) == 0:
+            return self.value
+
+        # The recursion runs over the samples, with the axes vectorized
+        for sample in samples:
+            out = self.b0 * sample + self.z1
+            self.z1 = self.b1 * sample - self.a1 * out + self.z2
+            self.z2 = self.b2 * sample - self.a2 * out
+        # end for
+
+        self.value = out
+        return self.value
+
+FILTERS = ['boxcar', 'exponential', 'biquad']
+
+def create (kind, length, rate, initial):
+    '''
+    Create a filter with a response comparable to the mean of a window
+    kind:    one of FILTERS
+    length:  number of samples of the window. The exponential filter
+             uses alpha = 2/(length + 1) and the biquad filter the
+             cutoff frequency of the window (0.443*rate/length)
+    rate:    rate of the samples in Hz
+    initial: value of each axis
+    '''
+    if kind == 'boxcar':
+        return Boxcar (length, initial)
+    elif kind == 'exponential':
+        return Exponential (2.0 / (length + 1), initial)
+    elif kind == 'biquad':
+        return Biquad (0.443 * rate / length, rate, initial)
+    # end if
+    raise ValueError ("The filter %s is not one of %s" % (kind, FILTERS))
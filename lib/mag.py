@@ -3,9 +3,10 @@
 # Library for the Raspberry Pi that interfaces with LSM303DLHC
 # magnetometer on Polulu boards
 
-from smbus import SMBus
 from common_i2c import *
 import bitOps
+import npz_cache
+import regmap
 import numpy
 import time
 import os
@@ -24,7 +25,8 @@ def Init (bus = None,
           slaveAddr = DEV_SLAVE_ADDR, 
           cal_iter = CALIBRATION_ITERATIONS,
           scale = None, dr = 30, mode = 'continuous',
-          sign_def = SIGN_DEFINITION):
+          sign_def = SIGN_DEFINITION,
+          shadow = None):
     '''
     bus:       indicates the bus associated to the i2c device /dev/i2cX
     slaveAddr: indicates the address of the slave device
@@ -33,12 +35,15 @@ def Init (bus = None,
     dr:        indicates the data rate
     mode:      indicates the mode to power the device
     sign_def:  indicates the sign definition to orientate the device correctly
+    shadow:    indicates the mode of the shadow registers ('cache' or 'check').
+               None disables the shadow
     '''
     M = {}
     M['bus'] = bus
     if bus == None:
         try:
-            M['bus'] = SMBus(DEV_BUS_ID)
+            M['bus'] = open_bus(DEV_BUS_ID)
+            M['bus_id'] = DEV_BUS_ID
         except IOError as e:
             M['error'] = (True, "Unable to create the magnetometer. The error was: I/O error (%s): %s" %(e.errno, e.strerror))
             return M
@@ -48,6 +53,13 @@ def Init (bus = None,
     M['sign_def'] = sign_def
     M['error'] = (False, None)
 
+    # Shadow the registers to save the reads of the masked writes
+    if shadow != None:
+        (status, message) = enable_shadow (M, shadow)
+        if not status:
+            M['error'] = (True, message)
+            return M
+
     # Set the gain for the out values
     if scale == None:
         (status, scale) = get_scale(M)
@@ -83,7 +95,7 @@ def Init (bus = None,
 
 __CRA        = Register ('CRA', 0x0, mode = 'rw')
 __CRB        = Register ('CRB', 0x1, mode = 'rw')
-__MR         = Register ('MR', 0x2, mode = 'rw')
+__MR         = Register ('MR', 0x2, mode = 'rw', volatile = True)
 __OUT_X_H    = Register ('OUT_X_H', 0x3, mode = 'r')
 __OUT_X_L    = Register ('OUT_X_L', 0x4, mode = 'r')
 __OUT_Y_H    = Register ('OUT_Y_H', 0x7, mode = 'r')
@@ -137,6 +149,39 @@ __PowerMode = {'continuous': 0x0, 'single': 0x1,
 # Enable/disable
 __Enable = {True: 0x1, False: 0x0}
 
+##########
+# FIELDS #
+##########
+
+__Map = regmap.RegisterMap ('magnetometer')
+
+__FIELD_TEMP_EN   = __Map.field ('temperature sensor enable', __CRA, __MASK_TEMP_EN, __Enable)
+__FIELD_DR        = __Map.field ('data rate', __CRA, __MASK_DR, __DR)
+__FIELD_GN        = __Map.field ('scale', __CRB, __MASK_GN, __Scales)
+__FIELD_MD        = __Map.field ('power mode', __MR, __MASK_MD, __PowerMode)
+__FIELD_DRDY      = __Map.field ('data ready status', __SR, __MASK_DRDY, __Enable)
+
+#######################
+# GENERATED ACCESSORS #
+#######################
+
+enable_temp          = __Map.setter (__FIELD_TEMP_EN, 'Enable temperature sensor')
+isenabled_temp       = __Map.getter (__FIELD_TEMP_EN, 'Check if temperature sensor is enabled')
+set_dr               = __Map.setter (__FIELD_DR, 'Set data rate')
+get_dr               = __Map.getter (__FIELD_DR, 'Get data rate')
+get_scale            = __Map.getter (__FIELD_GN, 'Get full scale')
+set_powermode        = __Map.setter (__FIELD_MD, 'Set power mode')
+get_powermode        = __Map.getter (__FIELD_MD, 'Get power mode')
+isdata_ready         = __Map.getter (__FIELD_DRDY, 'Check if there is data ready')
+
+# Configuration of the device, reading the configuration registers
+# with one block read
+get_conf = __Map.conf ([
+    ('cra', [('dr', __FIELD_DR), ('temp_en', __FIELD_TEMP_EN)]),
+    ('crb', [('gn', __FIELD_GN)]),
+    ('mr', [('md', __FIELD_MD)])
+    ], [(__CRA, __MR)])
+
 #############
 # FUNCTIONS #
 #############
@@ -172,45 +217,6 @@ def print_configuration(M):
     
     return
 
-def enable_temp(M, enabled):
-    ''' Enable temperature sensor '''
-    (status, message) = write(M, __CRA, __MASK_TEMP_EN, __Enable[enabled])
-    if not status:
-        return (False, 'Unable to enable or disable temperature sensor for the magnetometer device. The error was %s' % message)
-    return (True, None)
-
-def isenabled_temp(M):
-    ''' Check if temperature sensor is enabled '''
-    (status, enabled) = read_match(M, __CRA, __MASK_TEMP_EN, __Enable)
-    if not status:
-        return (False, 'Unable to check if temperature sensor is enabled for the magnetometer device. The error was %s' % enabled)
-    return (True, enabled)
-
-def set_dr(M, datarate):
-    ''' Set data rate '''
-    if datarate not in __DR.keys():
-        return (False, 'Data rate %s not in range of data rate values for the magnetometer device.' % datarate)
-
-    bits = __DR[datarate]
-    (status, message) = write(M, __CRA, __MASK_DR, bits)
-    if not status:
-        return (False, 'Unable to set the data rate on the magnetometer device. The error was %s' % message)        
-    return (True, None)
-
-def get_dr(M):
-    ''' Get data rate '''
-    (status, current) = read(M, __CRA, __MASK_DR)
-    if not status:
-        return (False, "Unable to get the configurated data rate for the magnetometer device. The error was: %s." % current)
-    
-    # Convert to the proper value in Hz
-    for dr in __DR.keys():
-        if __DR[dr] == current:
-            return (True, dr)
-
-    # never reached
-    return (False, "Unable to get the configurated data rate for the magnetometer device")
-
 def set_scale(M, scale):
     ''' Set full scale '''
     if not scale in __Scales.keys():
@@ -226,40 +232,10 @@ def set_scale(M, scale):
 
     return (True, None)
 
-def get_scale(M):
-    ''' Get full scale '''
-    (status, scale) = read_match(M, __CRB, __MASK_GN, __Scales)
-    if not status:
-        return (False, "Unable to get the scale of the magnetometer device. The error was %s." % scale)
-
-    return (True, scale)
-
-def set_powermode (M, mode):
-    ''' Set power mode '''
-    if mode not in __PowerMode.keys():
-        return (False, 'Mode %s not in range of allowed power mode values for the magnetometer device' % mode)
-    
-    (status, message) = write (M, __MR, __MASK_MD, __PowerMode[mode])
-    if not status:
-        return (False, 'Unable to set the power mode on the magnetometer device. The error was %s' % message)
-
-    return (True, None)
-
 def poweron(M, mode):
     ''' Power on the device '''
     return set_powermode (M, mode)
 
-def get_powermode(M):
-    ''' Get power mode '''
-    # Check power-down mode
-    (status, powermode) = read_match(M, __MR, __MASK_MD, __PowerMode)
-
-    if not status:
-        return (False, 'Unable to get the power mode on the magnetometer device. The error was %s' % powermode)
-
-    return (True, powermode)
-
-
 ###############################
 # This functions are not used #
 ###############################
@@ -357,10 +333,37 @@ def get_raw_xyz(M):
 def get_block_xyz(M):
     ''' Get the three axis magnetic field data '''
     # Get the six values for x, y and z low and high parts
-    (status, values) = read_block (M, __OUT_X_H.get_addr()+0x80, 6)
+    (status, values) = read_block (M, __OUT_X_H.addr+0x80, 6)
     if not status:
         return (False, "Unable to get the axis magnetic field data")
 
+    return (True, decode_block_xyz (M, values))
+
+def decode_block_xyz_array (M, values):
+    '''
+    Convert blocks of data into a (N,3) array of magnetic fields, with
+    the same results as decode_block_xyz
+    values: blocks of data with the high and low parts of x, z and y
+    '''
+    data = bitOps.BytesToArray (values)
+    data = bitOps.BytesToArray (data[:len (data) - len (data) % 6], '>u2').reshape (-1, 3)
+
+    # Reorder x, z, y
+    data = bitOps.TwosComplementToCustomArray (data[:,[0,2,1]], 15)
+    sign = numpy.array ([M['sign_def']['x'], M['sign_def']['y'], M['sign_def']['z']])
+    gain = numpy.array ([M['gainxy'], M['gainxy'], M['gainz']])
+
+    return data * sign * gain
+
+def block_xyz_request (M):
+    ''' Snapshot request to read the three axis magnetic field data '''
+    return (M, __OUT_X_H.addr+0x80, 6)
+
+def decode_block_xyz (M, values):
+    '''
+    Convert the six bytes of the block into the three axis magnetic field data
+    values: block of data with the high and low parts of x, z and y
+    '''
     # X
     h = values[0]
     l = values[1]
@@ -380,7 +383,7 @@ def get_block_xyz(M):
     data = bitOps.TwosComplementToCustom((h << 8) + l, 15)
     z = data * M['sign_def']['z'] * M['gainz']
 
-    return (True, (x,y,z))
+    return (x,y,z)
 
 def calibrate (M, fix = False, save = False, three_d = False, plot = False):
     ''' Calibrate the magnetometer '''
@@ -532,10 +535,10 @@ def get_params (data, save = False):
                 and 'x' in collected_data.keys () \
                 and 'y' in collected_data.keys () \
                 and 'z' in collected_data.keys ():
+                    magx = collected_data['x']
+                    magy = collected_data['y']
+                    magz = collected_data['z']
                     collected_data = collected_data['data']
-                    magx = numpy.load (data)['x']
-                    magy = numpy.load (data)['y']
-                    magz = numpy.load (data)['z']
                 else:
                     return (False, "Unable read data from file %s. The file does not contain the 'data' key")
             except IOError as e:
@@ -681,7 +684,7 @@ def get_min_max (data_file, save = False):
 def get_normalized_values (M, min_max, calibrate = False):
     ''' 
     Get the corresponding normalized values of each axis 
-    min_max: calibration values
+    min_max: calibration values or path to the npz file with them
     calibrate: indicates if it is needed to calibrate the values
     '''
     (status, xyz) = get_raw_xyz (M)
@@ -690,6 +693,13 @@ def get_normalized_values (M, min_max, calibrate = False):
 
     (x,y,z) = xyz
 
+    # The file is only loaded the first time or when it changes
+    if calibrate and type (min_max) == str:
+        try:
+            min_max = npz_cache.load (min_max)
+        except (IOError, OSError) as e:
+            return (False, "Unable to get the normalize values of each axis. The file with the calibration parameters can not be read. The error was: %s" % e)
+
     if calibrate and type (min_max) != dict:
         return (False, "Unable to get the normalize values of each axis. The variable that has to contain the calibration parameters is not of type dictionary")
 
@@ -764,16 +774,7 @@ def tilt_heading (pitch_roll, mag_values = None, M = None, calibrate = True, cal
 def get_heading (M, A, cal_mag, cal_acc, calibrate = False, view_notilt = False):
     ''' Get the heading angle '''
 
-    data = numpy.load (cal_mag)
-    min_max = {}
-    min_max['minx'] = data['minx']
-    min_max['maxx'] = data['maxx']
-    min_max['miny'] = data['miny']
-    min_max['maxy'] = data['maxy']
-    min_max['minz'] = data['minz']
-    min_max['maxz'] = data['maxz']
-
-    (status, xyz) = get_normalized_values (M, min_max, calibrate)
+    (status, xyz) = get_normalized_values (M, cal_mag, calibrate)
     if not status:
         return (False, "Unable to get the heading angle. The error was: %s" % xyz)
 
@@ -812,21 +813,13 @@ def get_heading (M, A, cal_mag, cal_acc, calibrate = False, view_notilt = False)
 
     return (True, (float (heading), float (M_abs)))
 
-def isdata_ready(M):
-    ''' Check if there is data available on each axis '''
-    (status, drdy) = read_match(M, __SR, __MASK_DRDY, __Enable)
-    if not status:
-        return (False, "Unable to check if there is data ready on the magnetometer device. The error was: %s" % drdy)
-
-    return (True, drdy)
-
 def get_temp(M):
     ''' Get Temperature '''
-    (status, temp_h) = read(M, __OUT_TEMP_H, 0xff)
+    (status, temp_h) = with_priority (PRIORITY_LOW, read, M, __OUT_TEMP_H, 0xff)
     if not status:
         return (False, "Unable to get the temperature on the magnetometer device. The error was: %s" % temp_h)
 
-    (status, temp_l) = read(M, __OUT_TEMP_L, 0xff)
+    (status, temp_l) = with_priority (PRIORITY_LOW, read, M, __OUT_TEMP_L, 0xff)
     if not status:
         return (False, "Unable to get the temperature on the magnetometer device. The error was: %s" % temp_l)
 
@@ -834,45 +827,6 @@ def get_temp(M):
 
     return (True, float (data/8.0)) 
 
-def get_conf (M):
-
-    M['conf'] = {}
-
-    # CRA
-    M['conf']['cra'] = {}
-    cra = M['conf']['cra']
-
-    (status, value) = get_dr(M)
-    if not status:
-        return (False, "Unable to get the magnetometer configuration. The error was %s" % value)
-    cra['dr'] = value
-
-    (status, value) = isenabled_temp(M)
-    if not status:
-        return (False, "Unable to get the magnetometer configuration. The error was %s" % value)
-    cra['temp_en'] = value
-
-    # CRB
-    M['conf']['crb'] = {}
-    crb = M['conf']['crb']
-
-    (status, value) = get_scale(M)
-    if not status:
-        return (False, "Unable to get the magnetometer configuration. The error was %s" % value)
-    crb['gn'] = value
-
-    # MR
-    M['conf']['mr'] = {}
-    mr = M['conf']['mr']
-
-    (status, value) = get_powermode(M)
-    if not status:
-        return (False, "Unable to get the magnetometer configuration. The error was %s" % value)
-    mr['md'] = value
-
-    return (True, False)
-
-
 def reset (M = None):
     '''
     Reset the values of the registers
@@ -886,20 +840,22 @@ def reset (M = None):
         if M['error'][0]:
             return (False, "Error while creating the magnetometer. Error message was: " + M['error'][1])
 
-    # Write the default value of the CRA register
-    (status, message) = write (M, __CRA, 0xff, 0x10)
-    if not status:
-        return (False, "Error while writing the default value of the CRA register of the magnetometer device. Error message was: " + message)
+    # Forget the shadowed values as all the registers are going to be rewritten
+    invalidate_shadow (M)
 
-    # Write the default value of the CRB register
-    (status, message) = write (M, __CRB, 0xff, 0x20)
-    if not status:
-        return (False, "Error while writing the default value of the CRB register of the magnetometer device. Error message was: " + message)
+    # Write the default values of the registers in one transaction
+    defaults = [(__CRA, 0x10),
+                (__CRB, 0x20),
+                (__MR, 0x0)]
+    T = transaction (M)
+    for (register, value) in defaults:
+        (status, message) = stage (T, register, 0xff, value)
+        if not status:
+            return (False, "Error while writing the default value of the %s register of the magnetometer device. Error message was: %s" % (register.get_name (), message))
 
-    # Write the default value of the MR register
-    (status, message) = write (M, __MR, 0xff, 0x0)
+    (status, message) = commit (T)
     if not status:
-        return (False, "Error while writing the default value of the MR register of the magnetometer device. Error message was: " + message)
+        return (False, "Error while writing the default values of the registers of the magnetometer device. Error message was: " + message)
 
     # Finished test
     if delete_mag:
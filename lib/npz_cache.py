@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+# Cache of the calibration files (npz) of the devices. numpy.load only
+# opens the zip file and each access to an array decompresses and
+# parses it again, so the arrays are read once and served from memory
+# while the modification time of the file does not change
+#
+# Example:
+#   cal_matrix = npz_cache.load ("cal_matrix.npz")['data']
+
+import collections
+import numpy
+import os
+import threading
+
+MAX_FILES = 8               # Number of files kept in memory
+
+__files = collections.OrderedDict ()    # path -> (mtime, arrays), oldest first
+__lock = threading.Lock ()
+
+def load (path):
+    '''
+    Get the arrays of a npz file as a dictionary indexed by their names.
+    The dictionary is shared by the callers, so it must not be modified.
+    Raises IOError or OSError if the file can not be read
+    path: path to the npz file
+    '''
+    mtime = os.stat (path).st_mtime
+
+    __lock.acquire ()
+    try:
+        entry = __files.pop (path, None)
+        if entry != None and entry[0] == mtime:
+            # Most recently used file
+            __files[path] = entry
+            return entry[1]
+    finally:
+        __lock.release ()
+
+    # Read all the arrays and close the file
+    data = numpy.load (path)
+    try:
+        arrays = dict ([(key, data[key]) for key in data.files])
+    finally:
+        data.close ()
+
+    __lock.acquire ()
+    try:
+        __files[path] = (mtime, arrays)
+        while len (__files) > MAX_FILES:
+            __files.popitem (last = False)
+    finally:
+        __lock.release ()
+
+    return arrays
+
+def clear ():
+    ''' Forget the loaded files '''
+    __lock.acquire ()
+    __files.clear ()
+    __lock.release ()
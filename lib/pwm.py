@@ -3,7 +3,6 @@
 # Library for the Raspberry Pi that interfaces with PCA9685
 # PWM controller on Adafruit board
 
-from smbus import SMBus
 from common_i2c import *
 import bitOps
 import numpy
@@ -16,24 +15,40 @@ CLOCK          = 25000000.0   # Internal clock frequency 25MHz
 RANGE_OF_PERCENTAGE = 1000.0  # Range of percentage begining at 0
 def Init (bus = None, 
           percentage = RANGE_OF_PERCENTAGE, 
-          slaveAddr = DEV_SLAVE_ADDR):
+          slaveAddr = DEV_SLAVE_ADDR,
+          shadow = None):
     '''
     bus:       indicates the bus associated to the i2c device /dev/i2cX
     slaveAddr: indicates the address of the slave device
+    shadow:    indicates the mode of the shadow registers ('cache' or 'check').
+               None disables the shadow
     '''
     P = {}
     P['bus'] = bus
     if bus == None:
         try:
-            P['bus'] = SMBus(DEV_BUS_ID)
+            P['bus'] = open_bus(DEV_BUS_ID)
+            P['bus_id'] = DEV_BUS_ID
         except IOError as e:
             P['error'] = (True, "Unable to power on the PWM. The error was: I/O error (%s): %s" %(e.errno, e.strerror))
             return P
 
     P['addr'] = DEV_SLAVE_ADDR
     P['percentage'] = percentage
+    # The auto-increment is enabled through the MODE1 register and not
+    # through the register address
+    P['ai_flag'] = None
+    # The writes of the motors go before the rest of operations on the bus
+    P['priority'] = PRIORITY_HIGH
     P['error'] = (False, None)
 
+    # Shadow the registers to save the reads of the masked writes
+    if shadow != None:
+        (status, message) = enable_shadow (P, shadow)
+        if not status:
+            P['error'] = (True, message)
+            return P
+
     # Power on the device
     (status, error) = set_powermode (P, 'normal')
     if not status:
@@ -49,7 +64,7 @@ def Init (bus = None,
 # REGISTERS #
 #############
 
-__MODE1               = Register ('MODE1', 0x0, mode = 'rw')
+__MODE1               = Register ('MODE1', 0x0, mode = 'rw', volatile = True)
 __MODE2               = Register ('MODE2', 0x1, mode = 'rw')
 __SUBADR1             = Register ('SUBADR1', 0x2, mode = 'rw')
 __SUBADR2             = Register ('SUBADR2', 0x3, mode = 'rw')
@@ -143,6 +158,13 @@ __ALL_LED_OFF_H       = Register ('ALL_LED_OFF_H', 0xfd, mode = 'rw')
 
 __PRE_SCALE           = Register ('PRE_SCALE', 0xfe, mode = 'rw')
 
+# Registers of the channels indexed by channel number, compiled once so
+# the writes of the channels are plain indexing
+__LED_ON_L            = register_table (globals (), '__LED%d_ON_L', 16)
+__LED_ON_H            = register_table (globals (), '__LED%d_ON_H', 16)
+__LED_OFF_L           = register_table (globals (), '__LED%d_OFF_L', 16)
+__LED_OFF_H           = register_table (globals (), '__LED%d_OFF_H', 16)
+
 #################################
 # MASKS TO MODIFY THE REGISTERS #
 #################################
@@ -348,22 +370,22 @@ def set_pwm (P, channel, duty_cycle, delay = 0, change_delay = True):
     # time
     if change_delay:
         # LOW ON
-        (status, message) = write(P, eval ("__LED" + str (channel) + "_ON_L"), 0xFF, on_l, get_current_value = True) 
+        (status, message) = write(P, __LED_ON_L[channel], 0xFF, on_l, get_current_value = True) 
         if not status:
             return (False, "Unable to set the low on part on the PWM device. The error was %s.", message)
 
         # HIGH ON
-        (status, message) = write(P, eval ("__LED" + str (channel) + "_ON_H"), 0xFF, on_h, get_current_value = True) 
+        (status, message) = write(P, __LED_ON_H[channel], 0xFF, on_h, get_current_value = True) 
         if not status:
             return (False, "Unable to set the high on part on the PWM device. The error was %s.", message)
 
     # LOW OFF
-    (status, message) = write(P, eval ("__LED" + str (channel) + "_OFF_L"), 0xFF, off_l, get_current_value = True) 
+    (status, message) = write(P, __LED_OFF_L[channel], 0xFF, off_l, get_current_value = True) 
     if not status:
         return (False, "Unable to set the low off part on the PWM device. The error was %s." % message)
 
     # HIGH OFF
-    (status, message) = write(P, eval ("__LED" + str (channel) + "_OFF_H"), 0xFF, off_h, get_current_value = True) 
+    (status, message) = write(P, __LED_OFF_H[channel], 0xFF, off_h, get_current_value = True) 
     if not status:
         return (False, "Unable to set the high off part on the PWM device. The error was %s." % message)
 
@@ -384,6 +406,18 @@ def set_pwm_ai (P, start_channel, values):
     if start_channel < 0 or (start_channel + number_of_values-1) > 15:
         return (False, "Unable to set the pwm configuration. The channel is not in the range of (0,15)")
 
+    try:
+        set_pwm_ai_fast (P, start_channel, values)
+    except I2CError as e:
+        return (False, "Unable to set the off part on the PWM device. The error was %s." % e)
+
+    return (True, None)
+
+def set_pwm_ai_fast (P, start_channel, values):
+    '''
+    Set the duty cycle on the channels like set_pwm_ai without checking
+    the parameters. Raises I2CError on failure
+    '''
     values_to_write = []
 
     for value in values:
@@ -407,12 +441,9 @@ def set_pwm_ai (P, start_channel, values):
 
         values_to_write += [on_l, on_h, off_l, off_h]
 
-    # Write values
-    (status, message) = write_block (P, eval ("__LED" + str (start_channel) + "_ON_L").get_addr (), values_to_write)
-    if not status:
-        return (False, "Unable to set the off part on the PWM device. The error was %s." % message)
-
-    return (True, None)
+    # Write values, in blocks of the 8 channels that fit in a SMBus block
+    for offset in xrange (0, len (values_to_write), MAX_BLOCK_LENGTH):
+        write_block_fast (P, __LED_ON_L[start_channel].addr + offset, values_to_write[offset:offset + MAX_BLOCK_LENGTH])
 
 def write_counts (P, channel, off, on = 0):
 
@@ -442,22 +473,22 @@ def write_counts (P, channel, off, on = 0):
     off_l = off & 0xFF
 
     # LOW ON
-    (status, message) = write(P, eval ("__LED" + str (channel) + "_ON_L"), 0xFF, on_l) 
+    (status, message) = write(P, __LED_ON_L[channel], 0xFF, on_l) 
     if not status:
         return (False, "Unable to set the frequency on the PWM device. The error was %s.", message)
 
     # HIGH ON
-    (status, message) = write(P, eval ("__LED" + str (channel) + "_ON_H"), 0xFF, on_h) 
+    (status, message) = write(P, __LED_ON_H[channel], 0xFF, on_h) 
     if not status:
         return (False, "Unable to set the frequency on the PWM device. The error was %s.", message)
 
     # LOW OFF
-    (status, message) = write(P, eval ("__LED" + str (channel) + "_OFF_L"), 0xFF, off_l) 
+    (status, message) = write(P, __LED_OFF_L[channel], 0xFF, off_l) 
     if not status:
         return (False, "Unable to set the frequency on the PWM device. The error was %s.", message)
 
     # HIGH OFF
-    (status, message) = write(P, eval ("__LED" + str (channel) + "_OFF_H"), 0xFF, off_h) 
+    (status, message) = write(P, __LED_OFF_H[channel], 0xFF, off_h) 
     if not status:
         return (False, "Unable to set the frequency on the PWM device. The error was %s.", message)
 
@@ -471,22 +502,22 @@ def get_pwm (P, channel):
         return (False, "Unable to get the duty cycle. The channel is not in the range of (0,15)")
 
     # LOW ON
-    (status, on_l) = read(P, eval ("__LED" + str (channel) + "_ON_L"), 0xFF) 
+    (status, on_l) = read(P, __LED_ON_L[channel], 0xFF) 
     if not status:
         return (False, "Unable to get the duty cycle on the PWM device. The error was %s.", on_l)
 
     # HIGH ON
-    (status, on_h) = read(P, eval ("__LED" + str (channel) + "_ON_H"), 0xFF) 
+    (status, on_h) = read(P, __LED_ON_H[channel], 0xFF) 
     if not status:
         return (False, "Unable to get the duty cycle on the PWM device. The error was %s.", on_h)
 
     # LOW OFF
-    (status, off_l) = read(P, eval ("__LED" + str (channel) + "_OFF_L"), 0xFF) 
+    (status, off_l) = read(P, __LED_OFF_L[channel], 0xFF) 
     if not status:
         return (False, "Unable to get the duty cycle on the PWM device. The error was %s.", off_l)
 
     # HIGH OFF
-    (status, off_h) = read(P, eval ("__LED" + str (channel) + "_OFF_H"), 0xFF) 
+    (status, off_h) = read(P, __LED_OFF_H[channel], 0xFF) 
     if not status:
         return (False, "Unable to get the duty cycle on the PWM device. The error was %s.", off_h)
 
@@ -515,22 +546,22 @@ def full_on (P, channel, enable = True):
     value = int (enable) * 0x10
 
     # LOW ON
-    (status, message) = write(P, eval ("__LED" + str (channel) + "_ON_L"), 0xFF, 0x0) 
+    (status, message) = write(P, __LED_ON_L[channel], 0xFF, 0x0) 
     if not status:
         return (False, "Unable to set the frequency on the PWM device. The error was %s.", message)
 
     # HIGH ON
-    (status, message) = write(P, eval ("__LED" + str (channel) + "_ON_H"), 0xFF, value) 
+    (status, message) = write(P, __LED_ON_H[channel], 0xFF, value) 
     if not status:
         return (False, "Unable to set the frequency on the PWM device. The error was %s.", message)
 
     # LOW OFF
-    (status, message) = write(P, eval ("__LED" + str (channel) + "_OFF_L"), 0xFF, 0x0) 
+    (status, message) = write(P, __LED_OFF_L[channel], 0xFF, 0x0) 
     if not status:
         return (False, "Unable to set the frequency on the PWM device. The error was %s.", message)
 
     # HIGH OFF
-    (status, message) = write(P, eval ("__LED" + str (channel) + "_OFF_H"), 0xFF, 0x0) 
+    (status, message) = write(P, __LED_OFF_H[channel], 0xFF, 0x0) 
     if not status:
         return (False, "Unable to set the frequency on the PWM device. The error was %s.", message)
 
@@ -544,12 +575,12 @@ def isfull_on(P, channel):
         return (False, "Unable to check if the signal on the channel is full on for the PWM device. The channel is not in the range of (0,15)")
 
     # HIGH ON
-    (status, on_h) = read(P, eval ("__LED" + str (channel) + "_ON_H"), 0x10) 
+    (status, on_h) = read(P, __LED_ON_H[channel], 0x10) 
     if not status:
         return (False, "Unable to check if the signal on the channel is full on for the PWM device. The error was %s.", on_h)
 
     # HIGH OFF
-    (status, off_h) = read(P, eval ("__LED" + str (channel) + "_OFF_H"), 0x10) 
+    (status, off_h) = read(P, __LED_OFF_H[channel], 0x10) 
     if not status:
         return (False, "Unable to check if the signal on the channel is full on for the PWM device. The error was %s.", off_h)
 
@@ -568,22 +599,22 @@ def full_off (P, channel, enable = True):
     value = int (enable) * 0x10
 
     # LOW ON
-    (status, message) = write(P, eval ("__LED" + str (channel) + "_ON_L"), 0xFF, 0x0) 
+    (status, message) = write(P, __LED_ON_L[channel], 0xFF, 0x0) 
     if not status:
         return (False, "Unable to set the frequency on the PWM device. The error was %s.", message)
 
     # HIGH ON
-    (status, message) = write(P, eval ("__LED" + str (channel) + "_ON_H"), 0xFF, 0x00) 
+    (status, message) = write(P, __LED_ON_H[channel], 0xFF, 0x00) 
     if not status:
         return (False, "Unable to set the frequency on the PWM device. The error was %s.", message)
 
     # LOW OFF
-    (status, message) = write(P, eval ("__LED" + str (channel) + "_OFF_L"), 0xFF, 0x0) 
+    (status, message) = write(P, __LED_OFF_L[channel], 0xFF, 0x0) 
     if not status:
         return (False, "Unable to set the frequency on the PWM device. The error was %s.", message)
 
     # HIGH OFF
-    (status, message) = write(P, eval ("__LED" + str (channel) + "_OFF_H"), 0xFF, value) 
+    (status, message) = write(P, __LED_OFF_H[channel], 0xFF, value) 
     if not status:
         return (False, "Unable to set the frequency on the PWM device. The error was %s.", message)
 
@@ -597,7 +628,7 @@ def isfull_off(P, channel):
         return (False, "Unable to check if the signal on the channel is full off for the PWM device. The channel is not in the range of (0,15)")
 
     # HIGH OFF
-    (status, off_h) = read(P, eval ("__LED" + str (channel) + "_OFF_H"), 0x10) 
+    (status, off_h) = read(P, __LED_OFF_H[channel], 0x10) 
     if not status:
         return (False, "Unable to check if the signal on the channel is full off for the PWM device. The error was %s.", off_h)
     
@@ -616,6 +647,9 @@ def reset (P = None):
         if P['error'][0]:
             return (False, "Error while creating the PWM. Error message was: " + P['error'][1])
 
+    # Forget the shadowed values as all the registers are going to be rewritten
+    invalidate_shadow (P)
+
     # Write the default value of the MODE1 register
     (status, message) = write (P, __MODE1, 0xff, 0x00)
     if not status:
@@ -648,19 +682,19 @@ def reset (P = None):
 
     # Write the default value of the LEDX register
     for i in xrange (16):
-        (status, message) = write (P, eval ("__LED" + str (i) + "_ON_L"), 0xff, 0x0)
+        (status, message) = write (P, __LED_ON_L[i], 0xff, 0x0)
         if not status:
             return (False, "Error while writing the default value of the LEDX_ON_L register of the PWM device. Error message was: " + message)
 
-        (status, message) = write (P, eval ("__LED" + str (i) + "_ON_H"), 0xff, 0x0)
+        (status, message) = write (P, __LED_ON_H[i], 0xff, 0x0)
         if not status:
             return (False, "Error while writing the default value of the LEDX_ON_H register of the PWM device. Error message was: " + message)
 
-        (status, message) = write (P, eval ("__LED" + str (i) + "_OFF_L"), 0xff, 0x0)
+        (status, message) = write (P, __LED_OFF_L[i], 0xff, 0x0)
         if not status:
             return (False, "Error while writing the default value of the LEDX_OFF_L register of the PWM device. Error message was: " + message)
 
-        (status, message) = write (P, eval ("__LED" + str (i) + "_OFF_H"), 0xff, 0x10)
+        (status, message) = write (P, __LED_OFF_H[i], 0xff, 0x10)
         if not status:
             return (False, "Error while writing the default value of the LEDX_OFF_H register of the PWM device. Error message was: " + message)
     
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# Raw backend of the I2C bus for the Raspberry Pi. It talks to the i2c
+# device interface /dev/i2c-N with the I2C_RDWR ioctl through messages
+# prepared once, and reads the blocks straight into the buffers of the
+# callers, so the reads do not create lists of integers. The bus can be
+# used wherever a smbus.SMBus is expected
+#
+# Example:
+#   common_i2c.set_bus_factory (raw_i2c.RawBus)
+#   buf = bytearray (192)
+#   nbytes = common_i2c.read_block_into_fast (G, 0xa8, buf, 6*level)
+#   samples = gyro.decode_block_xyz_array (G, bitOps.BytesToArray (buf)[:nbytes])
+
+import common_i2c
+import ctypes
+import errno
+import fcntl
+import os
+
+MAX_BLOCK_LENGTH = 32       # Length of the blocks of the list API (as smbus)
+MAX_TRANSFER     = 8192     # Maximum length of a message of the i2c-dev interface
+
+class RawBus (object):
+    '''
+    Bus with the same interface as smbus.SMBus plus read_i2c_block_into
+    to read into preallocated buffers
+    '''
+
+    def __init__ (self, bus_id = 1):
+        '''
+        bus_id: indicates the bus associated to the i2c device /dev/i2cX
+        '''
+        try:
+            self.fd = os.open ("/dev/i2c-%s" % bus_id, os.O_RDWR)
+        except OSError as e:
+            raise IOError (e.errno, e.strerror)
+
+        # Register address and data of the writes
+        self.command = (ctypes.c_uint8 * (MAX_BLOCK_LENGTH + 1)) ()
+        # Data of the reads of the list API
+        self.block = (ctypes.c_uint8 * MAX_BLOCK_LENGTH) ()
+
+        # Write of the register address followed by a read with repeated
+        # start. The writes only use the first message
+        self.msgs = (common_i2c.I2CMsg * 2) ()
+        self.msgs[0].flags = 0
+        self.msgs[0].buf = self.command
+        self.msgs[1].flags = common_i2c.I2C_M_RD
+        self.read_data = common_i2c.I2CRdwrData (self.msgs, 2)
+        self.write_data = common_i2c.I2CRdwrData (self.msgs, 1)
+
+        # Buffer of the caller the last read was performed into
+        self.target = None
+        self.target_buf = None
+
+    def __read (self, addr, reg, buf, nbytes):
+        ''' Read nbytes into the ctypes buffer '''
+        self.command[0] = reg
+        self.msgs[0].addr = addr
+        self.msgs[0].len = 1
+        self.msgs[1].addr = addr
+        self.msgs[1].len = nbytes
+        self.msgs[1].buf = buf
+        fcntl.ioctl (self.fd, common_i2c.I2C_RDWR, self.read_data)
+
+    def __write (self, addr, reg, values):
+        ''' Write the values starting on the register '''
+        self.command[0] = reg
+        for i in xrange (len (values)):
+            self.command[i + 1] = values[i]
+        self.msgs[0].addr = addr
+        self.msgs[0].len = len (values) + 1
+        fcntl.ioctl (self.fd, common_i2c.I2C_RDWR, self.write_data)
+
+    def read_byte_data (self, addr, reg):
+        self.__read (addr, reg, self.block, 1)
+        return self.block[0]
+
+    def write_byte_data (self, addr, reg, value):
+        self.__write (addr, reg, [value])
+
+    def read_i2c_block_data (self, addr, reg, nbytes):
+        nbytes = min (nbytes, MAX_BLOCK_LENGTH)
+        self.__read (addr, reg, self.block, nbytes)
+        return self.block[:nbytes]
+
+    def write_i2c_block_data (self, addr, reg, values):
+        if len (values) > MAX_BLOCK_LENGTH:
+            raise IOError (errno.EINVAL, os.strerror (errno.EINVAL))
+        self.__write (addr, reg, values)
+
+    def read_i2c_block_into (self, addr, reg, buf, nbytes):
+        '''
+        Read a block of data into the first nbytes of the buffer
+        buf: writable buffer (bytearray) kept by the caller between reads
+        '''
+        if nbytes > len (buf) or nbytes > MAX_TRANSFER:
+            raise IOError (errno.EINVAL, os.strerror (errno.EINVAL))
+
+        # The messages point to the memory of the buffer, which is
+        # resolved again only when the caller changes the buffer
+        if buf is not self.target:
+            self.target_buf = (ctypes.c_uint8 * len (buf)).from_buffer (buf)
+            self.target = buf
+        self.__read (addr, reg, self.target_buf, nbytes)
+
+    def close (self):
+        # Release the buffer of the caller
+        self.target = None
+        self.target_buf = None
+        os.close (self.fd)
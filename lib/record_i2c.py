@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+# Recording and replay of the I2C traffic for the Raspberry Pi. The
+# buses of this module can be used wherever a smbus.SMBus is expected
+
+import struct
+import time
+import errno
+import os
+
+# Header of the files: magic string and version of the format
+MAGIC = 'I2CR'
+VERSION = 2
+HEADER = struct.Struct ('<4sB')
+
+# Each operation is stored as a record followed by its data:
+# time since the start of the recording, operation, slave address,
+# register, errno (0 if the operation succeeded), number of bytes
+# requested and length of the data (0 for the failed reads)
+RECORD = struct.Struct ('<dBBBBBB')
+
+# Operations
+READ_BYTE   = 0
+WRITE_BYTE  = 1
+READ_BLOCK  = 2
+WRITE_BLOCK = 3
+
+OPERATIONS = {READ_BYTE: 'read_byte_data', WRITE_BYTE: 'write_byte_data',
+              READ_BLOCK: 'read_i2c_block_data', WRITE_BLOCK: 'write_i2c_block_data'}
+
+class ReplayError (IOError):
+    '''
+    Error raised when the operations requested to a replay bus do not
+    follow the recording
+    '''
+    pass
+
+class RecordBus (object):
+    '''
+    Bus that forwards the operations to another bus and records them,
+    with their results, in a file
+    '''
+
+    def __init__ (self, bus, path):
+        '''
+        bus:  bus to forward the operations (usually a smbus.SMBus)
+        path: path of the file to store the recording
+        '''
+        self.bus = bus
+        self.file = open (path, 'wb')
+        self.file.write (HEADER.pack (MAGIC, VERSION))
+        self.start = time.time ()
+
+    def record (self, op, addr, reg, error, nbytes, data):
+        ''' Store an operation in the file '''
+        self.file.write (RECORD.pack (time.time () - self.start, op, addr, reg, error, nbytes, len (data)))
+        self.file.write (str (bytearray (data)))
+
+    def read_byte_data (self, addr, reg):
+        try:
+            value = self.bus.read_byte_data (addr, reg)
+        except IOError as e:
+            self.record (READ_BYTE, addr, reg, e.errno or errno.EIO, 1, [])
+            raise
+        self.record (READ_BYTE, addr, reg, 0, 1, [value])
+        return value
+
+    def write_byte_data (self, addr, reg, value):
+        try:
+            self.bus.write_byte_data (addr, reg, value)
+        except IOError as e:
+            self.record (WRITE_BYTE, addr, reg, e.errno or errno.EIO, 1, [value])
+            raise
+        self.record (WRITE_BYTE, addr, reg, 0, 1, [value])
+
+    def read_i2c_block_data (self, addr, reg, nbytes):
+        try:
+            values = self.bus.read_i2c_block_data (addr, reg, nbytes)
+        except IOError as e:
+            self.record (READ_BLOCK, addr, reg, e.errno or errno.EIO, nbytes, [])
+            raise
+        self.record (READ_BLOCK, addr, reg, 0, nbytes, values)
+        return values
+
+    def write_i2c_block_data (self, addr, reg, values):
+        try:
+            self.bus.write_i2c_block_data (addr, reg, values)
+        except IOError as e:
+            self.record (WRITE_BLOCK, addr, reg, e.errno or errno.EIO, len (values), values)
+            raise
+        self.record (WRITE_BLOCK, addr, reg, 0, len (values), values)
+
+    def close (self):
+        ''' Finish the recording '''
+        self.file.close ()
+
+class ReplayBus (object):
+    '''
+    Bus that serves the results of a recording. The operations have to
+    be requested in the same order as they were recorded, on the same
+    slave address, register and number of bytes, or ReplayError is
+    raised
+    '''
+
+    def __init__ (self, path, realtime = False, check_writes = False):
+        '''
+        path:         path of the file with the recording
+        realtime:     indicates if the operations have to be delayed to
+                      follow the timestamps of the recording
+        check_writes: indicates if the written values have to match
+                      with the recorded ones
+        '''
+        data = open (path, 'rb').read ()
+        (magic, version) = HEADER.unpack_from (data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ReplayError (errno.EINVAL, "The file %s is not a recording of the i2c traffic with version %s" % (path, VERSION))
+
+        # Load the records
+        self.records = []
+        offset = HEADER.size
+        while offset < len (data):
+            (t, op, addr, reg, error, nbytes, length) = RECORD.unpack_from (data, offset)
+            offset += RECORD.size
+            values = [ord (c) for c in data[offset:offset + length]]
+            offset += length
+            self.records.append ((t, op, addr, reg, error, nbytes, values))
+
+        self.index = 0
+        self.realtime = realtime
+        self.check_writes = check_writes
+        self.start = time.time ()
+
+    def replay (self, op, addr, reg, nbytes, values = None):
+        ''' Serve the next record of the recording '''
+        if self.index >= len (self.records):
+            raise ReplayError (errno.ENODATA, "The recording has finished after %s operations" % self.index)
+
+        (t, rop, raddr, rreg, error, rnbytes, rvalues) = self.records[self.index]
+        if (rop, raddr, rreg, rnbytes) != (op, addr, reg, nbytes):
+            raise ReplayError (errno.EINVAL, "The operation %s %s of %s bytes on %s/%s differs from the recorded one %s of %s bytes on %s/%s" %
+                               (self.index, OPERATIONS[op], nbytes, hex (addr), hex (reg), OPERATIONS[rop], rnbytes, hex (raddr), hex (rreg)))
+        if self.check_writes and values != None and list (values) != rvalues:
+            raise ReplayError (errno.EINVAL, "The values %s written by the operation %s differ from the recorded ones %s" % (values, self.index, rvalues))
+
+        self.index += 1
+
+        if self.realtime:
+            delay = self.start + t - time.time ()
+            if delay > 0:
+                time.sleep (delay)
+
+        if error != 0:
+            raise IOError (error, os.strerror (error))
+
+        return rvalues
+
+    def read_byte_data (self, addr, reg):
+        return self.replay (READ_BYTE, addr, reg, 1)[0]
+
+    def write_byte_data (self, addr, reg, value):
+        self.replay (WRITE_BYTE, addr, reg, 1, [value])
+
+    def read_i2c_block_data (self, addr, reg, nbytes):
+        return self.replay (READ_BLOCK, addr, reg, nbytes)
+
+    def write_i2c_block_data (self, addr, reg, values):
+        self.replay (WRITE_BLOCK, addr, reg, len (values), values)
+
+    def close (self):
+        ''' Finish the replay '''
+        pass
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+# Declarative description of the registers of the devices. The drivers
+# declare the fields of their registers once and obtain from them the
+# accessors (get_x/isenabled_x and set_x/enable_x) and the reader of
+# the configuration, which reads each register once and decodes all
+# its fields from the values read. The ranges of adjacent registers
+# declared as blocks are read with one auto-increment block read
+#
+# Example:
+#   __Map = regmap.RegisterMap ('gyroscope')
+#   __Xen = __Map.field ('x axis enable', __CTRL_REG1, __MASK_Xen, __Enable)
+#   isenabled_x = __Map.getter (__Xen, 'Check if x axis is enabled')
+#   enable_x = __Map.setter (__Xen, 'Enable x axis')
+#   get_conf = __Map.conf ([('ctrl1', [('xen', __Xen)])], [(__CTRL_REG1, __REFERENCE)])
+
+from common_i2c import AUTO_INCREMENT, PRIORITY_LOW, I2CError, read_block_fast, read_fast, with_priority, write_fast
+import bitOps
+import errno
+
+class Field (object):
+    '''
+    Bits of a register under a mask. The value of the field is the name
+    that maps the bits in the dictionary, or the bits themselves when
+    there is no dictionary
+    '''
+
+    def __init__ (self, name, register, mask = 0xff, dictionary = None):
+        '''
+        name:       name of the field in the messages
+        register:   instance of the class Register
+        mask:       mask of the field in the register
+        dictionary: name/value mapping of the field or None
+        '''
+        self.name = name
+        self.register = register
+        self.registers = (register,)
+        self.mask = mask
+        self.dictionary = dictionary
+        self.field = bitOps.GetField (mask, dictionary)
+
+    def decode (self, current):
+        ''' Get the value of the field (None if no name maps it) '''
+        if self.dictionary == None:
+            return self.field.get (current)
+        return self.field.match (current)
+
+    def encode (self, value):
+        ''' Get the bits of the field for the value (None if not valid) '''
+        if self.dictionary == None:
+            return value
+        return self.dictionary.get (value)
+
+class Derived (object):
+    '''
+    Value computed from the values of one or more registers, for the
+    values that do not map to the bits of a single field
+    '''
+
+    def __init__ (self, name, function, *registers):
+        '''
+        name:      name of the value in the messages
+        function:  function receiving the values of the registers and
+                   returning the value (None if the values are not valid)
+        registers: instances of the class Register
+        '''
+        self.name = name
+        self.function = function
+        self.registers = registers
+
+    def decode (self, *values):
+        return self.function (*values)
+
+def flatten (dictionary):
+    '''
+    Convert a nested mapping {a: {b: value}} into the mapping
+    {(a, b): value} to be used as the dictionary of a field
+    '''
+    flat = {}
+    for outer in dictionary.keys():
+        for inner in dictionary[outer].keys():
+            flat[(outer, inner)] = dictionary[outer][inner]
+    return flat
+
+def read_registers_fast (DEV, registers, values = None):
+    '''
+    Read the registers whose values are not read yet
+    values: values of the registers indexed by address
+    '''
+    if values == None:
+        values = {}
+    for register in registers:
+        if not register.addr in values:
+            values[register.addr] = read_fast (DEV, register, 0xff)
+    return values
+
+def read_blocks_fast (DEV, blocks, values = None):
+    '''
+    Read the ranges of adjacent registers with one block read each. The
+    devices without auto-increment (ai_flag None) do not read them
+    blocks: list of (first register, last register) ranges
+    values: values of the registers indexed by address
+    '''
+    if values == None:
+        values = {}
+    ai_flag = DEV.get ('ai_flag', AUTO_INCREMENT)
+    if ai_flag == None:
+        return values
+    for (first, last) in blocks:
+        nbytes = last.addr - first.addr + 1
+        block = read_block_fast (DEV, first.addr | ai_flag, nbytes)
+        for i in xrange (nbytes):
+            values[first.addr + i] = block[i]
+    return values
+
+def decode_fast (DEV, item, values):
+    '''
+    Decode a field or a derived value from the values of the registers
+    values: values of the registers indexed by address
+    '''
+    value = item.decode (*[values[register.addr] for register in item.registers])
+    if value == None:
+        raise I2CError ('read', DEV['addr'], item.registers[0], errno.EINVAL, "The %s does not match with any valid value", (item.name,))
+    return value
+
+class RegisterMap (object):
+    '''
+    Fields of the registers of a device generating its accessors
+    '''
+
+    def __init__ (self, device):
+        '''
+        device: name of the device in the messages
+        '''
+        self.device = device
+
+    def field (self, name, register, mask = 0xff, dictionary = None):
+        ''' Declare a field of a register '''
+        return Field (name, register, mask, dictionary)
+
+    def derived (self, name, function, *registers):
+        ''' Declare a value computed from the values of the registers '''
+        return Derived (name, function, *registers)
+
+    def get_fast (self, DEV, item):
+        ''' Read the registers of a field or derived value and decode it '''
+        return decode_fast (DEV, item, read_registers_fast (DEV, item.registers))
+
+    def set_fast (self, DEV, field, value):
+        ''' Write the bits of the value in the field '''
+        bits = field.encode (value)
+        if bits == None:
+            raise I2CError ('write', DEV['addr'], field.register, errno.EINVAL, "The value %s is not valid for the %s", (value, field.name))
+        write_fast (DEV, field.register, field.mask, bits)
+
+    def getter (self, item, doc = None, priority = None):
+        '''
+        Generate the function get (DEV) returning the (status, value)
+        tuple of a field or derived value
+        priority: priority of the reads (PRIORITY_LOW for the telemetry)
+                  or None for the priority of the device
+        '''
+        def get (DEV):
+            try:
+                if priority != None:
+                    return (True, with_priority (priority, self.get_fast, DEV, item))
+                return (True, self.get_fast (DEV, item))
+            except I2CError as e:
+                return (False, "Unable to get the %s of the %s device. The error was: %s" % (item.name, self.device, e))
+        get.__doc__ = doc
+        return get
+
+    def setter (self, field, doc = None):
+        '''
+        Generate the function set (DEV, value) writing the value in a
+        field and returning the (status, None) tuple
+        '''
+        def set (DEV, value):
+            try:
+                self.set_fast (DEV, field, value)
+            except I2CError as e:
+                return (False, "Unable to set the %s of the %s device. The error was: %s" % (field.name, self.device, e))
+            return (True, None)
+        set.__doc__ = doc
+        return set
+
+    def conf (self, layout, blocks = ()):
+        '''
+        Generate the function get_conf (DEV) storing the values of the
+        layout in DEV['conf']. All the registers are read before the
+        values are decoded: the blocks with one read each and the rest
+        of the registers one by one
+        layout: list of (key, field) and (key, [(key, field), ...])
+        blocks: list of (first register, last register) ranges whose
+                registers can be read together (the reads of the
+                registers in between must not have side effects, like
+                the reads of the outputs of a FIFO)
+        '''
+        registers = []
+        for (key, item) in layout:
+            if type (item) == list:
+                for (subkey, subitem) in item:
+                    registers.extend (subitem.registers)
+            else:
+                registers.extend (item.registers)
+
+        def get_conf (DEV):
+            ''' Get the configuration of the device '''
+            try:
+                # The configuration is telemetry, so the control loop
+                # goes first on the bus
+                values = with_priority (PRIORITY_LOW, read_blocks_fast, DEV, blocks)
+                with_priority (PRIORITY_LOW, read_registers_fast, DEV, registers, values)
+                conf = {}
+                for (key, item) in layout:
+                    if type (item) == list:
+                        conf[key] = {}
+                        for (subkey, subitem) in item:
+                            conf[key][subkey] = decode_fast (DEV, subitem, values)
+                    else:
+                        conf[key] = decode_fast (DEV, item, values)
+            except I2CError as e:
+                return (False, "Unable to get the %s configuration. The error was %s" % (self.device, e))
+
+            DEV['conf'] = conf
+            return (True, False)
+        return get_conf
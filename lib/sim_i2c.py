@@ -0,0 +1,775 @@
+# -*- coding: utf-8 -*-
+
+# Simulated I2C bus and device models for the Raspberry Pi. The bus can
+# be used wherever a smbus.SMBus is expected, so the drivers and the
+# regression tests can run without the hardware
+
+import collections
+import errno
+import os
+import time
+
+#########
+# CLOCK #
+#########
+
+class VirtualClock (object):
+    '''
+    Clock of the simulation. The time only advances through the bus
+    transfers or explicit calls to advance
+    '''
+
+    def __init__ (self, start = 0.0):
+        self.now = start
+
+    def time (self):
+        return self.now
+
+    def advance (self, dt):
+        ''' Move the clock dt seconds forward '''
+        self.now += dt
+
+class RealClock (object):
+    '''
+    Clock following the wall time, to benchmark the loops with the
+    injected latency of the bus
+    '''
+
+    def time (self):
+        return time.time ()
+
+    def advance (self, dt):
+        ''' Sleep dt seconds '''
+        time.sleep (dt)
+
+#######
+# BUS #
+#######
+
+MAX_BLOCK_LENGTH = 32       # Length of the blocks of the list API (as smbus)
+
+class SimBus (object):
+    '''
+    Bus with the same interface as smbus.SMBus that serves the
+    operations with the attached device models. The blocks of the list
+    API are limited to 32 bytes like on the hardware
+    '''
+
+    def __init__ (self, clock = None, speed = 100000, latency = 0.0):
+        '''
+        clock:   clock of the simulation (VirtualClock by default). A
+                 RealClock makes the bus sleep the transfer times
+        speed:   speed of the bus in bits per second used to obtain
+                 the transfer times. None disables the transfer times
+        latency: extra time in seconds added to each transfer
+        '''
+        if clock == None:
+            clock = VirtualClock ()
+        self.clock = clock
+        self.speed = speed
+        self.latency = latency
+        self.devices = {}
+
+        # Counters of the traffic
+        self.transfers = 0
+        self.bytes = 0
+        self.busy = 0.0
+
+        # Number of the next transfers failing, to test the recovery,
+        # after the number of transfers to serve before
+        self.faults = 0
+        self.skip = 0
+
+    def attach (self, device):
+        ''' Connect a device model to the bus '''
+        device.clock = self.clock
+        device.reset ()
+        self.devices[device.addr] = device
+        return device
+
+    def fail (self, count, skip = 0):
+        '''
+        Make count transfers fail with an I/O error after serving the
+        next skip transfers
+        '''
+        self.faults = count
+        self.skip = skip
+
+    def device (self, addr):
+        ''' Get the device model answering to the slave address '''
+        if not self.devices.has_key (addr):
+            raise IOError (errno.EREMOTEIO, os.strerror (errno.EREMOTEIO))
+        return self.devices[addr]
+
+    def transfer (self, nbytes, read):
+        '''
+        Account the time of a transfer: slave address, register and
+        data, plus the repeated start with the slave address on the reads
+        '''
+        frames = 2 + nbytes
+        if read:
+            frames += 1
+        dt = self.latency
+        if self.speed != None:
+            dt += frames * 9.0 / self.speed
+
+        self.transfers += 1
+        self.bytes += frames
+        self.busy += dt
+        if dt > 0:
+            self.clock.advance (dt)
+
+        # The failed transfers take their time as well
+        if self.skip > 0:
+            self.skip -= 1
+        elif self.faults > 0:
+            self.faults -= 1
+            raise IOError (errno.EIO, os.strerror (errno.EIO))
+
+    def read_byte_data (self, addr, reg):
+        device = self.device (addr)
+        self.transfer (1, True)
+        return device.read (reg, 1)[0]
+
+    def write_byte_data (self, addr, reg, value):
+        device = self.device (addr)
+        self.transfer (1, False)
+        device.write (reg, [value])
+
+    def __read (self, addr, reg, nbytes):
+        ''' Read a block of any length '''
+        device = self.device (addr)
+        self.transfer (nbytes, True)
+        return device.read (reg, nbytes)
+
+    def read_i2c_block_data (self, addr, reg, nbytes):
+        if nbytes > MAX_BLOCK_LENGTH:
+            raise IOError (errno.EINVAL, os.strerror (errno.EINVAL))
+        return self.__read (addr, reg, nbytes)
+
+    def read_i2c_block_into (self, addr, reg, buf, nbytes):
+        ''' Read a block into a buffer like raw_i2c.RawBus '''
+        if nbytes > len (buf):
+            raise IOError (errno.EINVAL, os.strerror (errno.EINVAL))
+        buf[:nbytes] = bytearray (self.__read (addr, reg, nbytes))
+
+    def write_i2c_block_data (self, addr, reg, values):
+        if len (values) > MAX_BLOCK_LENGTH:
+            raise IOError (errno.EINVAL, os.strerror (errno.EINVAL))
+        device = self.device (addr)
+        self.transfer (len (values), False)
+        device.write (reg, values)
+
+    def close (self):
+        pass
+
+##########
+# DEVICE #
+##########
+
+class SimDevice (object):
+    '''
+    Base of the device models: bank of 256 registers with the power up
+    values and the read only registers. The subclasses model the
+    behaviour of the registers
+    '''
+    DEFAULTS = {}               # Power up values of the registers
+    READ_ONLY = ()              # Registers not writable
+
+    def __init__ (self, addr):
+        self.addr = addr
+        self.clock = VirtualClock ()
+        self.reset ()
+
+    def reset (self):
+        ''' Restore the power up values of the registers '''
+        self.registers = bytearray (256)
+        for (register, value) in self.DEFAULTS.items ():
+            self.registers[register] = value
+
+    def update (self):
+        ''' Bring the device to the time of the clock '''
+        pass
+
+    def decode_address (self, reg):
+        ''' Get the register address and if it has to be auto-incremented '''
+        return (reg & 0x7f, reg & 0x80 != 0)
+
+    def next_address (self, reg):
+        ''' Address following reg on the auto-increment '''
+        return (reg + 1) & 0x7f
+
+    def read_register (self, reg):
+        return self.registers[reg]
+
+    def write_register (self, reg, value):
+        if not reg in self.READ_ONLY:
+            self.registers[reg] = value
+
+    def read (self, reg, nbytes):
+        ''' Serve a read of nbytes starting on reg '''
+        self.update ()
+        (reg, ai) = self.decode_address (reg)
+        values = []
+        for i in xrange (nbytes):
+            values.append (self.read_register (reg))
+            if ai:
+                reg = self.next_address (reg)
+        return values
+
+    def write (self, reg, values):
+        ''' Serve a write of the values starting on reg '''
+        self.update ()
+        (reg, ai) = self.decode_address (reg)
+        for value in values:
+            self.write_register (reg, value & 0xff)
+            if ai:
+                reg = self.next_address (reg)
+
+def to_counts (value, gain, bits):
+    ''' Convert a value into the counts of a signed output of bits '''
+    counts = int (round (value / gain))
+    limit = 1 << (bits - 1)
+    return max (-limit, min (limit - 1, counts))
+
+def to_u2 (counts, nbytes):
+    ''' Bytes, from the most significant, of a two's complement value '''
+    data = counts & ((1 << (8 * nbytes)) - 1)
+    return [(data >> (8 * (nbytes - 1 - i))) & 0xff for i in xrange (nbytes)]
+
+#####################
+# SENSORS WITH FIFO #
+#####################
+
+class SimFIFOSensor (SimDevice):
+    '''
+    Common model of the L3GD20 and the accelerometer of the LSM303DLHC:
+    three axis output on 0x28-0x2D, status register, 32 levels FIFO and
+    output data rate driven by the clock
+    '''
+    CTRL_REG1     = 0x20
+    CTRL_REG4     = 0x23
+    CTRL_REG5     = 0x24
+    STATUS_REG    = 0x27
+    OUT_X_L       = 0x28
+    OUT_Z_H       = 0x2d
+    FIFO_CTRL_REG = 0x2e
+    FIFO_SRC_REG  = 0x2f
+
+    MASK_BLE      = 0x40      # Big/little endian selection (CTRL_REG4)
+    MASK_FIFO_EN  = 0x40      # FIFO enable (CTRL_REG5)
+    MASK_BOOT     = 0x80      # Reboot memory content (CTRL_REG5)
+    MASK_THR      = 0x1f      # FIFO threshold (FIFO_CTRL_REG)
+    MASK_ZYXDA    = 0x0f      # New data available (STATUS_REG)
+    MASK_ZYXOR    = 0xf0      # Data overrun (STATUS_REG)
+    MASK_WTM      = 0x80      # Watermark status (FIFO_SRC_REG)
+    MASK_OVRN     = 0x40      # Overrun status (FIFO_SRC_REG)
+    MASK_EMPTY    = 0x20      # FIFO empty (FIFO_SRC_REG)
+    MASK_FSS      = 0x1f      # FIFO stored data level (FIFO_SRC_REG)
+
+    FIFO_DEPTH    = 32
+    FM_SHIFT      = 5         # Position of the FIFO mode bits
+    FIFO_MODES    = {}        # FIFO mode bits: 'bypass', 'FIFO' or 'stream'
+    BITS          = 16        # Resolution of the output
+
+    def __init__ (self, addr, signal = None):
+        '''
+        addr:   slave address
+        signal: function receiving the time and returning the (x, y, z)
+                values on the units of the device
+        '''
+        if signal == None:
+            signal = lambda t: (0.0, 0.0, 0.0)
+        self.signal = signal
+        SimDevice.__init__ (self, addr)
+
+    def reset (self):
+        SimDevice.reset (self)
+        self.fifo = collections.deque ()
+        self.out = [0] * 6
+        self.last = self.clock.time ()
+
+    def odr (self):
+        ''' Output data rate in Hz (0 when not producing samples) '''
+        return 0
+
+    def gain (self):
+        ''' Units per count of the output '''
+        return 1.0
+
+    def fifo_mode (self):
+        if not self.registers[self.CTRL_REG5] & self.MASK_FIFO_EN:
+            return 'bypass'
+        return self.FIFO_MODES.get (self.registers[self.FIFO_CTRL_REG] >> self.FM_SHIFT, 'stream')
+
+    def encode (self, values):
+        ''' Output bytes, from X_L to Z_H, of the values '''
+        shift = 16 - self.BITS
+        out = []
+        for value in values:
+            (h, l) = to_u2 (to_counts (value, self.gain (), self.BITS) << shift, 2)
+            if self.registers[self.CTRL_REG4] & self.MASK_BLE:
+                out.extend ([h, l])
+            else:
+                out.extend ([l, h])
+        return out
+
+    def update (self):
+        now = self.clock.time ()
+        rate = self.odr ()
+        if rate == 0:
+            self.last = now
+            return
+
+        period = 1.0 / rate
+        n = int ((now - self.last) / period)
+        if n <= 0:
+            return
+        self.last += n * period
+
+        # Older samples would be discarded by the newer ones
+        for i in xrange (max (0, n - self.FIFO_DEPTH - 1), n):
+            self.produce (self.encode (self.signal (self.last - (n - 1 - i) * period)))
+
+    def produce (self, sample):
+        ''' Store a new sample on the output registers or on the FIFO '''
+        mode = self.fifo_mode ()
+        if mode == 'bypass':
+            if self.registers[self.STATUS_REG] & self.MASK_ZYXDA:
+                self.registers[self.STATUS_REG] |= self.MASK_ZYXOR
+            self.registers[self.STATUS_REG] |= self.MASK_ZYXDA
+            self.out = sample
+        elif len (self.fifo) < self.FIFO_DEPTH:
+            self.fifo.append (sample)
+        elif mode == 'stream':
+            self.fifo.popleft ()
+            self.fifo.append (sample)
+
+    def read_register (self, reg):
+        if reg == self.STATUS_REG and self.fifo_mode () != 'bypass':
+            if len (self.fifo) == 0:
+                return 0
+            status = self.MASK_ZYXDA
+            if len (self.fifo) == self.FIFO_DEPTH:
+                status |= self.MASK_ZYXOR
+            return status
+
+        if reg == self.FIFO_SRC_REG:
+            level = len (self.fifo)
+            value = min (level, self.MASK_FSS)
+            if level == 0:
+                value |= self.MASK_EMPTY
+            if level == self.FIFO_DEPTH:
+                value |= self.MASK_OVRN
+            if level >= (self.registers[self.FIFO_CTRL_REG] & self.MASK_THR):
+                value |= self.MASK_WTM
+            return value
+
+        if self.OUT_X_L <= reg <= self.OUT_Z_H:
+            if self.fifo_mode () != 'bypass' and len (self.fifo) > 0:
+                self.out = self.fifo[0]
+                if reg == self.OUT_Z_H:
+                    self.fifo.popleft ()
+            elif reg == self.OUT_Z_H:
+                self.registers[self.STATUS_REG] = 0
+            return self.out[reg - self.OUT_X_L]
+
+        return SimDevice.read_register (self, reg)
+
+    def write_register (self, reg, value):
+        if reg == self.CTRL_REG5 and value & self.MASK_BOOT:
+            # The reboot of the memory content is self cleared
+            value &= ~self.MASK_BOOT
+        SimDevice.write_register (self, reg, value)
+
+        # The bypass mode resets the FIFO
+        if reg in (self.CTRL_REG5, self.FIFO_CTRL_REG) and self.fifo_mode () == 'bypass':
+            self.fifo.clear ()
+
+    def next_address (self, reg):
+        # The reads of the FIFO roll back from OUT_Z_H to OUT_X_L
+        if reg == self.OUT_Z_H and self.fifo_mode () != 'bypass':
+            return self.OUT_X_L
+        return SimDevice.next_address (self, reg)
+
+class SimL3GD20 (SimFIFOSensor):
+    '''
+    Model of the L3GD20 gyroscope. The signal is in dps
+    '''
+    WHO_AM_I = 0x0f
+    OUT_TEMP = 0x26
+
+    DEFAULTS = {WHO_AM_I: 0xd4, SimFIFOSensor.CTRL_REG1: 0x07}
+    READ_ONLY = tuple ([WHO_AM_I, OUT_TEMP, 0x27] + range (0x28, 0x2e) + [0x2f, 0x31])
+
+    FM_SHIFT   = 5
+    FIFO_MODES = {0x0: 'bypass', 0x1: 'FIFO', 0x2: 'stream'}
+
+    MASK_PD    = 0x08
+    MASK_XYZ   = 0x07
+    RATES      = [95, 190, 380, 760]
+    GAINS      = [0.00875, 0.0175, 0.07, 0.07]
+
+    def __init__ (self, addr = 0x6b, signal = None, temperature = 25):
+        '''
+        temperature: value of the OUT_TEMP register
+        '''
+        self.temperature = temperature
+        SimFIFOSensor.__init__ (self, addr, signal)
+
+    def reset (self):
+        SimFIFOSensor.reset (self)
+        self.registers[self.OUT_TEMP] = self.temperature & 0xff
+
+    def odr (self):
+        ctrl = self.registers[self.CTRL_REG1]
+        if not ctrl & self.MASK_PD or not ctrl & self.MASK_XYZ:
+            return 0
+        return self.RATES[ctrl >> 6]
+
+    def gain (self):
+        return self.GAINS[(self.registers[self.CTRL_REG4] >> 4) & 0x3]
+
+class SimLSM303Accel (SimFIFOSensor):
+    '''
+    Model of the accelerometer of the LSM303DLHC, with 12 bits left
+    justified outputs. The signal is in g
+    '''
+    DEFAULTS = {SimFIFOSensor.CTRL_REG1: 0x07}
+    READ_ONLY = tuple ([0x27] + range (0x28, 0x2e) + [0x2f, 0x31, 0x35])
+
+    FM_SHIFT   = 6
+    FIFO_MODES = {0x0: 'bypass', 0x1: 'FIFO', 0x2: 'stream', 0x3: 'stream'}
+    BITS       = 12
+
+    MASK_LPEN  = 0x08
+    MASK_XYZ   = 0x07
+    RATES      = [0, 1, 10, 25, 50, 100, 200, 400, 1620, 1344]
+    GAINS      = [0.001, 0.002, 0.004, 0.012]
+
+    def __init__ (self, addr = 0x19, signal = None):
+        if signal == None:
+            signal = lambda t: (0.0, 0.0, 1.0)
+        SimFIFOSensor.__init__ (self, addr, signal)
+
+    def odr (self):
+        ctrl = self.registers[self.CTRL_REG1]
+        if not ctrl & self.MASK_XYZ:
+            return 0
+        dr = ctrl >> 4
+        if dr == 0x9 and ctrl & self.MASK_LPEN:
+            return 5376
+        if dr >= len (self.RATES):
+            return 0
+        return self.RATES[dr]
+
+    def gain (self):
+        return self.GAINS[(self.registers[self.CTRL_REG4] >> 4) & 0x3]
+
+################
+# MAGNETOMETER #
+################
+
+class SimLSM303Mag (SimDevice):
+    '''
+    Model of the magnetometer of the LSM303DLHC. The outputs are big
+    endian on the order X, Z, Y and the address is always
+    auto-incremented. The signal is in gauss
+    '''
+    CRA        = 0x00
+    CRB        = 0x01
+    MR         = 0x02
+    OUT_X_H    = 0x03
+    OUT_Y_L    = 0x08
+    SR         = 0x09
+    TEMP_OUT_H = 0x31
+    TEMP_OUT_L = 0x32
+
+    DEFAULTS = {CRA: 0x10, CRB: 0x20, MR: 0x03, 0x0a: 0x48, 0x0b: 0x34, 0x0c: 0x33}
+    READ_ONLY = tuple (range (0x03, 0x0d) + [TEMP_OUT_H, TEMP_OUT_L])
+
+    MASK_TEMP_EN = 0x80
+    MASK_DRDY    = 0x01
+    MASK_LOCK    = 0x02
+    RATES        = [0.75, 1.5, 3.0, 7.5, 15, 30, 75, 220]
+    GAINS_XY     = [1100, 1100, 855, 670, 450, 400, 330, 230]
+    GAINS_Z      = [980, 980, 760, 600, 400, 355, 295, 205]
+
+    def __init__ (self, addr = 0x1e, signal = None, temperature = 25.0):
+        '''
+        signal:      function receiving the time and returning the
+                     (x, y, z) magnetic field in gauss
+        temperature: temperature in celsius degrees
+        '''
+        if signal == None:
+            signal = lambda t: (0.2, 0.0, -0.4)
+        self.signal = signal
+        self.temperature = temperature
+        SimDevice.__init__ (self, addr)
+
+    def reset (self):
+        SimDevice.reset (self)
+        self.last = self.clock.time ()
+        self.read_out = set ()
+
+    def decode_address (self, reg):
+        return (reg & 0x7f, True)
+
+    def next_address (self, reg):
+        if reg == self.OUT_Y_L:
+            return self.OUT_X_H
+        return SimDevice.next_address (self, reg)
+
+    def update (self):
+        now = self.clock.time ()
+        mode = self.registers[self.MR] & 0x3
+        if mode > 1:
+            self.last = now
+            return
+
+        period = 1.0 / self.RATES[(self.registers[self.CRA] >> 2) & 0x7]
+        if now - self.last < period:
+            return
+        self.last += int ((now - self.last) / period) * period
+
+        # The outputs are not updated while they are being read
+        if not self.registers[self.SR] & self.MASK_LOCK:
+            gn = self.registers[self.CRB] >> 5
+            (x, y, z) = self.signal (self.last)
+            out = (to_u2 (to_counts (x, 1.0 / self.GAINS_XY[gn], 12), 2) +
+                   to_u2 (to_counts (z, 1.0 / self.GAINS_Z[gn], 12), 2) +
+                   to_u2 (to_counts (y, 1.0 / self.GAINS_XY[gn], 12), 2))
+            self.registers[self.OUT_X_H:self.OUT_Y_L + 1] = bytearray (out)
+            self.registers[self.SR] |= self.MASK_DRDY
+
+            if self.registers[self.CRA] & self.MASK_TEMP_EN:
+                (h, l) = to_u2 (to_counts (self.temperature, 1.0 / 8, 12) << 4, 2)
+                self.registers[self.TEMP_OUT_H] = h
+                self.registers[self.TEMP_OUT_L] = l
+
+        # Single conversion mode goes to sleep after the measurement
+        if mode == 1:
+            self.registers[self.MR] |= 0x3
+
+    def read_register (self, reg):
+        if self.OUT_X_H <= reg <= self.OUT_Y_L:
+            self.read_out.add (reg)
+            self.registers[self.SR] &= ~self.MASK_DRDY
+            if len (self.read_out) == 6:
+                self.read_out = set ()
+                self.registers[self.SR] &= ~self.MASK_LOCK
+            else:
+                self.registers[self.SR] |= self.MASK_LOCK
+        return SimDevice.read_register (self, reg)
+
+    def write_register (self, reg, value):
+        SimDevice.write_register (self, reg, value)
+        if reg == self.MR:
+            # Start the conversions from now
+            self.last = self.clock.time ()
+            self.read_out = set ()
+            self.registers[self.SR] &= ~self.MASK_LOCK
+
+#############
+# ALTIMETER #
+#############
+
+class SimLPS331AP (SimDevice):
+    '''
+    Model of the LPS331AP pressure sensor. The signal returns the
+    pressure in mbar and the temperature in celsius degrees
+    '''
+    REF_P_XL     = 0x08
+    WHO_AM_I     = 0x0f
+    RES_CONF     = 0x10
+    CTRL_REG1    = 0x20
+    CTRL_REG2    = 0x21
+    STATUS       = 0x27
+    PRESS_OUT_XL = 0x28
+    PRESS_OUT_H  = 0x2a
+    TEMP_OUT_L   = 0x2b
+    TEMP_OUT_H   = 0x2c
+
+    DEFAULTS = {WHO_AM_I: 0xbb, RES_CONF: 0x7a}
+    READ_ONLY = (WHO_AM_I, 0x24, STATUS, 0x28, 0x29, 0x2a, 0x2b, 0x2c)
+
+    MASK_PD        = 0x80
+    MASK_BOOT      = 0x80
+    MASK_SWRESET   = 0x04
+    MASK_AUTO_ZERO = 0x02
+    MASK_ONE_SHOT  = 0x01
+    MASK_T_DA      = 0x01
+    MASK_P_DA      = 0x02
+    MASK_T_OR      = 0x10
+    MASK_P_OR      = 0x20
+    RATES          = [0, 1, 7, 12.5, 25, 7, 12.5, 25]
+
+    def __init__ (self, addr = 0x5d, signal = None):
+        if signal == None:
+            signal = lambda t: (1013.25, 20.0)
+        self.signal = signal
+        SimDevice.__init__ (self, addr)
+
+    def reset (self):
+        SimDevice.reset (self)
+        self.last = self.clock.time ()
+        self.raw = 0
+
+    def measure (self):
+        ''' Store a new pressure and temperature measurement '''
+        (pressure, temperature) = self.signal (self.clock.time ())
+        ref = (self.registers[self.REF_P_XL + 2] << 16) + (self.registers[self.REF_P_XL + 1] << 8) + self.registers[self.REF_P_XL]
+        raw = to_counts (pressure, 1.0 / 4096, 24)
+        (h, l, xl) = to_u2 (raw - ref, 3)
+        self.registers[self.PRESS_OUT_XL:self.PRESS_OUT_H + 1] = bytearray ([xl, l, h])
+        (h, l) = to_u2 (to_counts (temperature - 42.5, 1.0 / 480, 16), 2)
+        self.registers[self.TEMP_OUT_L] = l
+        self.registers[self.TEMP_OUT_H] = h
+
+        status = self.registers[self.STATUS]
+        if status & self.MASK_P_DA:
+            status |= self.MASK_P_OR
+        if status & self.MASK_T_DA:
+            status |= self.MASK_T_OR
+        self.registers[self.STATUS] = status | self.MASK_P_DA | self.MASK_T_DA
+        self.raw = raw
+
+    def update (self):
+        now = self.clock.time ()
+        ctrl = self.registers[self.CTRL_REG1]
+        rate = self.RATES[(ctrl >> 4) & 0x7]
+        if not ctrl & self.MASK_PD or rate == 0:
+            self.last = now
+            return
+
+        period = 1.0 / rate
+        if now - self.last >= period:
+            self.last += int ((now - self.last) / period) * period
+            self.measure ()
+
+    def read_register (self, reg):
+        if reg == self.PRESS_OUT_H:
+            self.registers[self.STATUS] &= ~(self.MASK_P_DA | self.MASK_P_OR)
+        elif reg == self.TEMP_OUT_H:
+            self.registers[self.STATUS] &= ~(self.MASK_T_DA | self.MASK_T_OR)
+        return SimDevice.read_register (self, reg)
+
+    def write_register (self, reg, value):
+        if reg == self.CTRL_REG1:
+            # The first conversion is available as soon as the device
+            # is powered up
+            powerup = value & self.MASK_PD and not self.registers[reg] & self.MASK_PD
+            SimDevice.write_register (self, reg, value)
+            if powerup and self.RATES[(value >> 4) & 0x7] != 0:
+                self.last = self.clock.time ()
+                self.measure ()
+            return
+
+        if reg != self.CTRL_REG2:
+            SimDevice.write_register (self, reg, value)
+            return
+
+        # The bits of CTRL_REG2 are self cleared
+        if value & (self.MASK_BOOT | self.MASK_SWRESET):
+            self.reset ()
+            return
+        if value & self.MASK_ONE_SHOT and self.registers[self.CTRL_REG1] & self.MASK_PD:
+            self.measure ()
+        if value & self.MASK_AUTO_ZERO:
+            self.registers[self.REF_P_XL:self.REF_P_XL + 3] = bytearray (reversed (to_u2 (self.raw, 3)))
+        self.registers[reg] = value & ~(self.MASK_BOOT | self.MASK_SWRESET | self.MASK_AUTO_ZERO | self.MASK_ONE_SHOT)
+
+#######
+# PWM #
+#######
+
+class SimPCA9685 (SimDevice):
+    '''
+    Model of the PCA9685 PWM controller. The auto-increment is enabled
+    through the MODE1 register and the writes to the ALL_LED registers
+    are applied to the 16 channels
+    '''
+    MODE1        = 0x00
+    MODE2        = 0x01
+    LED0_ON_L    = 0x06
+    ALL_LED_ON_L = 0xfa
+    PRE_SCALE    = 0xfe
+
+    DEFAULTS = dict ([(MODE1, 0x11), (MODE2, 0x04), (0x02, 0xe2), (0x03, 0xe4),
+                      (0x04, 0xe8), (0x05, 0xe0), (PRE_SCALE, 0x1e)] +
+                     [(LED0_ON_L + 4*channel + 3, 0x10) for channel in xrange (16)])
+    CHANNELS = 16
+    OSCILLATOR = 25000000.0
+
+    MASK_RESTART = 0x80
+    MASK_AI      = 0x20
+    MASK_SLEEP   = 0x10
+
+    def __init__ (self, addr = 0x40):
+        SimDevice.__init__ (self, addr)
+
+    def decode_address (self, reg):
+        return (reg, self.registers[self.MODE1] & self.MASK_AI != 0)
+
+    def next_address (self, reg):
+        return (reg + 1) & 0xff
+
+    def read_register (self, reg):
+        # The ALL_LED registers are write only
+        if self.ALL_LED_ON_L <= reg < self.PRE_SCALE:
+            return 0
+        return SimDevice.read_register (self, reg)
+
+    def write_register (self, reg, value):
+        if reg == self.MODE1:
+            old = self.registers[reg]
+            # Writing 1 on RESTART clears it while writing 0 has no effect
+            restart = old & self.MASK_RESTART and not value & self.MASK_RESTART
+            if value & self.MASK_SLEEP and not old & self.MASK_SLEEP and self.active ():
+                restart = True
+            value &= ~self.MASK_RESTART
+            if restart:
+                value |= self.MASK_RESTART
+        elif reg == self.PRE_SCALE:
+            # The prescaler is only writable on sleep mode
+            if not self.registers[self.MODE1] & self.MASK_SLEEP:
+                return
+            value = max (value, 0x03)
+        elif self.ALL_LED_ON_L <= reg < self.PRE_SCALE:
+            for channel in xrange (self.CHANNELS):
+                self.registers[self.LED0_ON_L + 4*channel + reg - self.ALL_LED_ON_L] = value
+            return
+        SimDevice.write_register (self, reg, value)
+
+    def active (self):
+        ''' Check if any channel is not fully off '''
+        for channel in xrange (self.CHANNELS):
+            if not self.registers[self.LED0_ON_L + 4*channel + 3] & 0x10:
+                return True
+        return False
+
+    def channel (self, channel):
+        ''' Get the (on, off) counts of a channel '''
+        base = self.LED0_ON_L + 4*channel
+        values = self.registers[base:base + 4]
+        return (((values[1] & 0x1f) << 8) + values[0], ((values[3] & 0x1f) << 8) + values[2])
+
+    def frequency (self):
+        ''' Get the frequency of the outputs in Hz '''
+        return self.OSCILLATOR / (4096 * (self.registers[self.PRE_SCALE] + 1))
+
+def imu_bus (clock = None, speed = 100000, latency = 0.0):
+    '''
+    Create a simulated bus with the gyro, the accelerometer, the
+    magnetometer and the pressure sensor of the IMU
+    '''
+    bus = SimBus (clock, speed, latency)
+    for device in (SimL3GD20 (), SimLSM303Accel (), SimLSM303Mag (), SimLPS331AP ()):
+        bus.attach (device)
+    return bus
+
+def pwm_bus (clock = None, speed = 100000, latency = 0.0):
+    ''' Create a simulated bus with the PWM controller '''
+    bus = SimBus (clock, speed, latency)
+    bus.attach (SimPCA9685 (0x40))
+    return bus
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+# Bias of the gyro depending on the temperature of the die. The bias is
+# fitted from logged data of the device at rest (angular rates and
+# temperatures) and tabulated for each unit of temperature, so the
+# runtime gets the bias of a temperature with a linear interpolation
+# between two entries of the table
+#
+# Example:
+#   table = temp_bias.fit (temps, rates)
+#   temp_bias.save ("temp_bias.npz", table)
+#   bias = temp_bias.load ("temp_bias.npz").lookup (gyro.get_temp_fast (G))
+
+import npz_cache
+import numpy
+
+DEGREE = 2                  # Degree of the polynomials fitted to the bias
+STEP   = 1.0                # Temperature between the entries of the table
+
+class BiasTable (object):
+    '''
+    Bias of each axis tabulated at evenly spaced temperatures
+    '''
+
+    def __init__ (self, start, step, bias):
+        '''
+        start: temperature of the first entry
+        step:  temperature between the entries
+        bias:  (N,3) array with the bias of each axis on each entry
+        '''
+        if len (bias) == 0:
+            raise ValueError ("The table of the bias has no entries")
+        self.start = float (start)
+        self.step = float (step)
+        self.bias = numpy.asarray (bias, dtype = float)
+
+    def temps (self):
+        ''' Get the temperatures of the entries '''
+        return self.start + self.step * numpy.arange (len (self.bias))
+
+    def lookup (self, temp):
+        '''
+        Get the bias of each axis at the temperature, interpolated
+        between the two nearest entries. The temperatures out of the
+        table get the bias of the nearest end
+        '''
+        last = len (self.bias) - 1
+        position = min (max ((temp - self.start) / self.step, 0.0), last)
+        i = min (int (position), max (last - 1, 0))
+        if i == last:
+            return self.bias[i]
+        return self.bias[i] + (position - i) * (self.bias[i + 1] - self.bias[i])
+
+def fit (temps, rates, degree = DEGREE, step = STEP):
+    '''
+    Fit a polynomial of the temperature to the bias of each axis and
+    tabulate it over the range of the logged temperatures
+    temps: temperatures of the samples
+    rates: (N,3) array with the angular rates of the device at rest
+    '''
+    temps = numpy.asarray (temps, dtype = float)
+    rates = numpy.asarray (rates, dtype = float)
+    if len (temps) != len (rates) or len (temps) == 0:
+        raise ValueError ("The logged data has %s temperatures and %s angular rates" % (len (temps), len (rates)))
+
+    # A polynomial needs more distinct temperatures than its degree
+    degree = min (degree, len (numpy.unique (temps)) - 1)
+
+    start = numpy.floor (temps.min () / step) * step
+    grid = numpy.arange (start, temps.max () + step, step)
+    bias = numpy.empty ((len (grid), 3))
+    for axis in xrange (3):
+        bias[:,axis] = numpy.polyval (numpy.polyfit (temps, rates[:,axis], degree), grid)
+    # end for
+
+    return BiasTable (start, step, bias)
+
+def save (path, table):
+    ''' Save the table in a npz file '''
+    numpy.savez (path, start = table.start, step = table.step, bias = table.bias)
+
+def load (path):
+    '''
+    Load the table of a npz file. Raises IOError or OSError if the file
+    can not be read
+    '''
+    data = npz_cache.load (path)
+    return BiasTable (data['start'], data['step'], data['bias'])
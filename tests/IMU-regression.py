@@ -11,10 +11,28 @@ import accel
 import mag
 import alt
 import common_i2c
+import bitOps
+import record_i2c
+import sim_i2c
+import io_worker
+import async_i2c
+import npz_cache
+import lowpass
+import temp_bias
+import numpy
 import inspect
+import errno
+import os
+import threading
+import tempfile
+import shutil
 
 imu_ex = "../examples/IMU/"
 
+# Factory of the buses of the run, restored by the tests creating their
+# own simulated bus
+bus_factory = None
+
 ####################
 # regression tests #
 ####################
@@ -2534,74 +2552,1830 @@ def test_11 ():
 
     return True
 
-###########################
-# infrastructure support #
-###########################
+##########
+# SHADOW #
+##########
 
-def lineno():
-    """Returns the current line number in our program."""
-    return inspect.currentframe().f_back.f_lineno
+def test_12 ():
+    '''
+    Check the shadow registers of the gyro device
+    '''
 
-def info (msg):
-    print "[ INFO  ] : " + msg
+    G = gyro.Init (shadow = 'check')
+    if G['error'][0]:
+        error (lineno(),"Error while creating the gyro. Error message was: " + G['error'][1])
+        return False
 
-def error (line, msg):
-    if line != None:
-        print "[ ERROR ] line %s: %s"  % (line, msg)
-    else:
-        print "[ ERROR ]: %s"  % msg
+    # Reset the values of the registers
+    reset_g (G)
 
-def ok (msg):
-    print "[  OK   ] : " + msg
+    # Modify several fields of the same registers
+    (status, message) = gyro.enable_x (G, False)
+    if not status:
+        error (lineno(),"Error while disabling axis X. Error message was: " + message)
+        return False
 
-def run_all_tests ():
-    test_count = 0
-    for test in tests:
-        
-         # print log
-        info ("TEST-" + str(test_count) + ": Running " + test[1])
-        
-        # call test
-        if not test[0]():
-            error (None, "detected test failure at: " + test[1])
+    (status, message) = gyro.set_scale (G, '2000dps')
+    if not status:
+        error (lineno(),"Error while setting the scale. Error message was: " + message)
+        return False
+
+    (status, message) = gyro.set_endianness (G, 'little_endian')
+    if not status:
+        error (lineno(),"Error while setting the endianness. Error message was: " + message)
+        return False
+
+    # Compare the shadowed values against the device
+    for register in [gyro.__CTRL_REG1, gyro.__CTRL_REG4]:
+        (status, value) = common_i2c.read (G, register, 0xff)
+        if not status:
+            error (lineno(),"Error while reading the register %s. Error message was: %s" % (register.get_name (), value))
             return False
 
-        # next test
-        test_count += 1
-    
-    ok ("All tests ok!")
+    (status, mismatches) = common_i2c.get_shadow_mismatches (G)
+    if not status or mismatches != []:
+        error (lineno(),"The shadowed values differ from the values of the device: %s" % str (mismatches))
+        return False
+
+    (status, value) = common_i2c.read (G, gyro.__CTRL_REG1, 0xff)
+    if value != 0xE:
+        error (lineno(),"Error while checking the shadow. The value of the register CTRL_REG1 is incorrect")
+        return False
+
+    # A block write with auto-increment updates the shadowed registers
+    # at their addresses
+    (status, message) = common_i2c.write_block (G, gyro.__CTRL_REG1.get_addr () | common_i2c.AUTO_INCREMENT, [0xF, 0x0, 0x0, 0x30])
+    if not status:
+        error (lineno(),"Error while writing the block. Error message was: " + message)
+        return False
+
+    (status, value) = common_i2c.read (G, gyro.__CTRL_REG4, 0xff)
+    if not status or value != 0x30:
+        error (lineno(),"Error while checking the shadow. The value of the register CTRL_REG4 was not updated by the block write")
+        return False
+
+    (status, mismatches) = common_i2c.get_shadow_mismatches (G)
+    if mismatches != [] or max (G['shadow']['values'].keys ()) >= common_i2c.AUTO_INCREMENT:
+        error (lineno(),"The block write left the shadow %s with the mismatches %s" % (G['shadow']['values'], mismatches))
+        return False
+
+    # The shadow is forgotten after a reset
+    reset_g (G)
+    if G['shadow']['values'] != {gyro.__CTRL_REG1.get_addr (): 0xF, gyro.__CTRL_REG2.get_addr (): 0x0, 
+                                 gyro.__CTRL_REG3.get_addr (): 0x0, gyro.__CTRL_REG4.get_addr (): 0x0, 
+                                 gyro.__CTRL_REG5.get_addr (): 0x0, gyro.__REFERENCE.get_addr (): 0x0, 
+                                 gyro.__FIFO_CTRL_REG.get_addr (): 0x0}:
+        error (lineno(),"Error while checking the shadow. The shadowed values were not updated by the reset")
+        return False
+
+    # Finished test
+    del G
+
     return True
 
-# declare list of tests available
-tests = [
-   (reset_g,   "Reset the values of the registers of the gyro device"),
-   (create_g,  "Check the creation of the gyro context"),
-   (test_00,   "Check the defaults values of each register of the gyro device"),
-   (test_01,   "Check that the read only registers of the gyro device are not writable"),
-   (test_02,   "Check the functions of the gyro API"),
-   (reset_g,   "Reset the values of the registers of the gyro device"),
-   (reset_a,   "Reset the values of the registers of the accelerometer device"),
-   (create_a,  "Check the creation of the accelerometer context"),
-   (test_03,   "Check the defaults values of each register of the accelerometer device"),
-   (test_04,   "Check that the read only registers of the accelerometer device are not writable"),
-   (test_05,   "Check the functions of the accelerometer API"),
-   (reset_a,   "Reset the values of the registers of the accelerometer device"),
-   (reset_m,   "Reset the values of the registers of the magnetometer device"),
-   (create_m,  "Check the creation of the magnetometer context"),
-   (test_06,   "Check the defaults values of each register of the magnetometer device"),
-   (test_07,   "Check that the read only registers of the magnetometer device are not writable"),
-   (test_08,   "Check the functions of the magnetometer API"),
-   (reset_m,   "Reset the values of the registers of the magnetometer device"),
-   (reset_p,   "Reset the values of the registers of the pressure sensor"),
-   (create_p,  "Check the creation of the magnetometer context"),
-   (test_09,   "Check the defaults values of each register of the pressure sensor"),
-   (test_10,   "Check that the read only registers of the pressure sensor are not writable"),
-   (test_11,   "Check the functions of the altimeter API"),
-   (reset_p,   "Reset the values of the registers of the pressure sensor")
+def test_13 ():
+    '''
+    Check the reference pressure rewritten by the pressure sensor
+    through the shadow registers
+    '''
 
-]
+    P = alt.Init (shadow = 'cache')
+    if P['error'][0]:
+        error (lineno(),"Error while creating the pressure sensor. Error message was: " + P['error'][1])
+        return False
 
-if __name__ == '__main__':
+    (status, message) = alt.poweron (P)
+    if not status:
+        error (lineno(),"Error while powering on the device. Error message was: " + message)
+        return False
+
+    time.sleep (0.2)
+
+    # The device stores the pressure as the reference on every AUTO_ZERO
+    for active in [True, False, True]:
+        (status, message) = alt.set_ref (P, active)
+        if not status:
+            error (lineno(),"Error while setting the reference. Error message was: " + message)
+            return False
+
+        (status, ref) = alt.get_ref (P)
+        if not status:
+            error (lineno(),"Error while getting the reference. Error message was: " + str (ref))
+            return False
+
+        if (ref != 0.0) != active:
+            error (lineno(),"The reference pressure %s does not follow the AUTO_ZERO %s" % (ref, active))
+            return False
+    # end for
+
+    # Reset the values of the registers
+    reset_p (P)
+
+    # Finished test
+    del P
+
+    return True
+
+################
+# TRANSACTIONS #
+################
+
+class FailingBus (object):
+    '''
+    Bus passing the transfers to another bus, counting them and failing
+    them with an I/O error when it is asked to
+    '''
+
+    def __init__ (self, bus):
+        self.bus = bus
+        self.transfers = 0
+        self.faults = 0
+        self.skip = 0
+
+    def fail (self, count, skip = 0):
+        '''
+        Make count transfers fail after serving the next skip transfers
+        '''
+        self.faults = count
+        self.skip = skip
+
+    def __getattr__ (self, name):
+        method = getattr (self.bus, name)
+        def transfer (*args):
+            self.transfers += 1
+            if self.skip > 0:
+                self.skip -= 1
+            elif self.faults > 0:
+                self.faults -= 1
+                raise IOError (errno.EIO, os.strerror (errno.EIO))
+            return method (*args)
+        return transfer
+
+def test_14 ():
+    '''
+    Check the transactions of the gyro device: the merge of the staged
+    writes, the runs written with auto-increment and the shadow after a
+    commit failing partway
+    '''
+
+    G = gyro.Init (shadow = 'cache')
+    if G['error'][0]:
+        error (lineno(),"Error while creating the gyro. Error message was: " + G['error'][1])
+        return False
+
+    # The transfers of the device are counted and failed by the test
+    bus = FailingBus (G['bus'])
+    G['bus'] = bus
+    CTRL_REG1 = gyro.__CTRL_REG1.get_addr ()
+
+    # The writes on the same register are merged, the last one wins on
+    # the bits of both (the values are given under the masks)
+    T = common_i2c.transaction (G)
+    common_i2c.stage (T, gyro.__CTRL_REG1, 0x08, 0x1)
+    common_i2c.stage (T, gyro.__CTRL_REG1, 0x07, 0x05)
+    common_i2c.stage (T, gyro.__CTRL_REG1, 0x01, 0x00)
+    if T['masks'][CTRL_REG1] != 0x0F or T['values'][CTRL_REG1] != 0x0C:
+        error (lineno(),"The staged writes were merged into the mask %s and the value %s" % (hex (T['masks'][CTRL_REG1]), hex (T['values'][CTRL_REG1])))
+        return False
+
+    # The adjacent registers are grouped in runs up to a SMBus block
+    runs = common_i2c.__runs ([0x20, 0x21, 0x22, 0x24], common_i2c.AUTO_INCREMENT)
+    if runs != [(0x20, 3), (0x24, 1)]:
+        error (lineno(),"The addresses were grouped in the runs %s" % runs)
+        return False
+
+    runs = common_i2c.__runs (range (40), common_i2c.AUTO_INCREMENT)
+    if runs != [(0, common_i2c.MAX_BLOCK_LENGTH), (common_i2c.MAX_BLOCK_LENGTH, 40 - common_i2c.MAX_BLOCK_LENGTH)]:
+        error (lineno(),"The long run was split in %s" % runs)
+        return False
+
+    if common_i2c.__runs ([0x20, 0x21], None) != [(0x20, 1), (0x21, 1)]:
+        error (lineno(),"The runs were grouped without auto-increment")
+        return False
+
+    # The five adjacent registers are written with one block write
+    values = {gyro.__CTRL_REG2: 0x05, gyro.__CTRL_REG3: 0x08, gyro.__CTRL_REG4: 0x30,
+              gyro.__CTRL_REG5: 0x40, gyro.__REFERENCE: 0x12}
+    for (register, value) in values.items ():
+        common_i2c.stage (T, register, 0xff, value)
+    # end for
+
+    transfers = bus.transfers
+    (status, message) = common_i2c.commit (T)
+    if not status:
+        error (lineno(),"Error while committing the transaction. Error message was: " + message)
+        return False
+
+    if bus.transfers - transfers != 1:
+        error (lineno(),"The commit took %s transfers instead of one block write" % (bus.transfers - transfers))
+        return False
+
+    values[gyro.__CTRL_REG1] = 0x0C
+    for (register, value) in values.items ():
+        addr = register.get_addr ()
+        if bus.bus.read_byte_data (G['addr'], addr) != value or G['shadow']['values'][addr] != value:
+            error (lineno(),"The register %s was written with %s instead of %s" % (register.get_name (), hex (bus.bus.read_byte_data (G['addr'], addr)), hex (value)))
+            return False
+    # end for
+
+    # The commit fails after writing the first run: the shadow forgets
+    # all the staged registers, which are read again from the device,
+    # and the transaction is kept to be committed again
+    common_i2c.stage (T, gyro.__CTRL_REG1, 0xff, 0x0F)
+    common_i2c.stage (T, gyro.__CTRL_REG5, 0xff, 0x00)
+    bus.fail (1, skip = 1)
+    (status, message) = common_i2c.commit (T)
+    if status:
+        error (lineno(),"The failure of the commit was not reported")
+        return False
+
+    for register in [gyro.__CTRL_REG1, gyro.__CTRL_REG5]:
+        if register.get_addr () in G['shadow']['values']:
+            error (lineno(),"The shadow kept the register %s after the failed commit" % register.get_name ())
+            return False
+    # end for
+
+    (status, reg1) = common_i2c.read (G, gyro.__CTRL_REG1, 0xff)
+    (status, reg5) = common_i2c.read (G, gyro.__CTRL_REG5, 0xff)
+    if (reg1, reg5) != (0x0F, 0x40):
+        error (lineno(),"The registers read after the failed commit were %s and %s instead of 0xf and 0x40" % (hex (reg1), hex (reg5)))
+        return False
+
+    (status, message) = common_i2c.commit (T)
+    if not status or bus.bus.read_byte_data (G['addr'], gyro.__CTRL_REG5.get_addr ()) != 0x00 or T['registers'] != {}:
+        error (lineno(),"The transaction was not committed again")
+        return False
+
+    # Reset the values of the registers
+    G['bus'] = bus.bus
+    reset_g (G)
+
+    # Finished test
+    del G
+
+    return True
+
+#############
+# SNAPSHOTS #
+#############
+
+def test_15 ():
+    '''
+    Check the plans of the snapshots of the IMU devices and the decoding
+    of the blocks of their requests against the reads of the drivers
+    '''
+
+    G = gyro.Init ()
+    if G['error'][0]:
+        error (lineno(),"Error while creating the gyro. Error message was: " + G['error'][1])
+        return False
+
+    A = accel.Init (dr = 100)
+    if A['error'][0]:
+        error (lineno(),"Error while creating the accelerometer. Error message was: " + A['error'][1])
+        return False
+
+    M = mag.Init ()
+    if M['error'][0]:
+        error (lineno(),"Error while creating the magnetometer. Error message was: " + M['error'][1])
+        return False
+
+    P = alt.Init ()
+    if P['error'][0]:
+        error (lineno(),"Error while creating the pressure sensor. Error message was: " + P['error'][1])
+        return False
+
+    # The blocks are read with the auto-increment flag on their address
+    requests = [gyro.fifolevel_request (G), gyro.block_xyz_request (G), accel.fifolevel_request (A),
+                accel.block_xyz_request (A), mag.block_xyz_request (M), alt.alt_ai_request (P)]
+    expected = [(G, gyro.__FIFO_SRC_REG.get_addr (), 1), (G, gyro.__OUT_X_L.get_addr () | common_i2c.AUTO_INCREMENT, 6),
+                (A, accel.__FIFO_SRC_REG.get_addr (), 1), (A, accel.__OUT_X_L.get_addr () | common_i2c.AUTO_INCREMENT, 6),
+                (M, mag.__OUT_X_H.get_addr () | common_i2c.AUTO_INCREMENT, 6), (P, alt.__PRESS_OUT_XL.get_addr () | common_i2c.AUTO_INCREMENT, 5)]
+    for (request, (DEV, start_address, nbytes)) in zip (requests, expected):
+        if request[0] is not DEV or request[1:] != (start_address, nbytes):
+            error (lineno(),"The request %s differs from %s" % (request[1:], (hex (start_address), nbytes)))
+            return False
+    # end for
+
+    # Each block is a write of its start address followed by a read
+    (status, S) = common_i2c.snapshot_plan (-1, requests)
+    if not status:
+        error (lineno(),"Error while preparing the snapshot. Error message was: " + S)
+        return False
+
+    if len (S['msgs']) != 2 * len (requests):
+        error (lineno(),"The snapshot of %s blocks has %s messages" % (len (requests), len (S['msgs'])))
+        return False
+
+    for (i, (DEV, start_address, nbytes)) in enumerate (requests):
+        (write, read) = (S['msgs'][2*i], S['msgs'][2*i + 1])
+        if (write.addr, write.flags, write.len, write.buf[0]) != (DEV['addr'], 0, 1, start_address):
+            error (lineno(),"The write of the block %s is not valid" % i)
+            return False
+
+        if (read.addr, read.flags, read.len) != (DEV['addr'], common_i2c.I2C_M_RD, nbytes):
+            error (lineno(),"The read of the block %s is not valid" % i)
+            return False
+    # end for
+
+    # The blocks beyond the messages of one transfer are refused
+    (status, message) = common_i2c.snapshot_plan (-1, requests[:1] * (common_i2c.I2C_RDWR_MAX_MSGS / 2 + 1))
+    if status:
+        error (lineno(),"The snapshot with too many blocks was prepared")
+        return False
+
+    # The snapshot fails on a bad descriptor of the i2c device interface
+    (status, message) = common_i2c.snapshot (S)
+    if status:
+        error (lineno(),"The snapshot was taken without the i2c device interface")
+        return False
+
+    # The FIFOs keep their levels and the devices their outputs while
+    # they are powered down
+    for (module, D) in [(gyro, G), (accel, A)]:
+        (status, message) = module.enable_fifo (D, True)
+        if not status:
+            error (lineno(),"Error while enabling the FIFO. Error message was: " + message)
+            return False
+
+        (status, message) = module.set_fifomode (D, 'stream')
+        if not status:
+            error (lineno(),"Error while setting the FIFO mode. Error message was: " + message)
+            return False
+    # end for
+
+    time.sleep (0.1)
+
+    for (status, message) in [gyro.set_powerdownmode (G), accel.set_powerdownmode (A), mag.set_powermode (M, 'sleep'), alt.powerdown (P)]:
+        if not status:
+            error (lineno(),"Error while powering down the devices. Error message was: " + message)
+            return False
+    # end for
+
+    for (module, D) in [(gyro, G), (accel, A)]:
+        (status, block) = common_i2c.read_block (*module.fifolevel_request (D))
+        if not status:
+            error (lineno(),"Error while reading the FIFO level. Error message was: " + block)
+            return False
+
+        (status, level) = module.get_fifolevel (D)
+        if not status or module.decode_fifolevel (D, block) != level or level == 0:
+            error (lineno(),"The decoded FIFO level %s differs from %s" % (module.decode_fifolevel (D, block), level))
+            return False
+
+        (status, message) = module.enable_fifo (D, False)
+        if not status:
+            error (lineno(),"Error while disabling the FIFO. Error message was: " + message)
+            return False
+    # end for
+
+    for (module, D) in [(gyro, G), (accel, A), (mag, M)]:
+        (status, block) = common_i2c.read_block (*module.block_xyz_request (D))
+        if not status:
+            error (lineno(),"Error while reading the samples. Error message was: " + block)
+            return False
+
+        (status, xyz) = module.get_block_xyz (D)
+        if not status or module.decode_block_xyz (D, block) != xyz:
+            error (lineno(),"The decoded sample %s differs from %s" % (module.decode_block_xyz (D, block), xyz))
+            return False
+    # end for
+
+    (status, block) = common_i2c.read_block (*alt.alt_ai_request (P))
+    if not status:
+        error (lineno(),"Error while reading the pressure and the temperature. Error message was: " + block)
+        return False
+
+    if alt.decode_alt_ai (P, block) != alt.get_alt_ai (P):
+        error (lineno(),"The decoded altitude %s differs from %s" % (alt.decode_alt_ai (P, block), alt.get_alt_ai (P)))
+        return False
+
+    # Reset the values of the registers
+    reset_g (G)
+    reset_a (A)
+    reset_m (M)
+    reset_p (P)
+
+    # Finished test
+    del G, A, M, P
+
+    return True
+
+##########
+# BITOPS #
+##########
+
+def test_16 ():
+    '''
+    Check the fields compiled by bitOps against the masks and the
+    linear search on the dictionaries
+    '''
+
+    # Several names map the same value: the first one found wins
+    dictionary = {'off': 0x0, 'low': 0x1, 'slow': 0x1, 'high': 0x3}
+    for mask in [0x03, 0x0C, 0x30, 0xC0, 0x06, 0xFF]:
+        field = bitOps.GetField (mask, dictionary)
+        if field.shift != bitOps.MaskShift (mask):
+            error (lineno(),"The shift %s of the mask %s is incorrect" % (field.shift, hex (mask)))
+            return False
+
+        for value in xrange (256):
+            bits = bitOps.GetValueUnderMask (value, mask)
+            if field.get (value) != bits:
+                error (lineno(),"The field %s of %s is %s instead of %s" % (hex (mask), hex (value), field.get (value), bits))
+                return False
+
+            expected = None
+            for key in dictionary.keys ():
+                if dictionary[key] == bits:
+                    expected = key
+                    break
+            # end for
+            if field.match (value) != expected:
+                error (lineno(),"The name of %s under %s is %s instead of %s" % (hex (value), hex (mask), field.match (value), expected))
+                return False
+
+            for name in dictionary.keys ():
+                if field.encode (name, value) != bitOps.SetValueUnderMask (dictionary[name], value, mask):
+                    error (lineno(),"The encoding of %s in %s under %s is incorrect" % (name, hex (value), hex (mask)))
+                    return False
+            # end for
+        # end for
+    # end for
+
+    # The fields are compiled once by mask and dictionary
+    if bitOps.GetField (0x0C, dictionary) is not bitOps.GetField (0x0C, dictionary):
+        error (lineno(),"The field was compiled again for the same mask and dictionary")
+        return False
+
+    other = dict (dictionary)
+    other['high'] = 0x2
+    if bitOps.GetField (0x0C, other).match (0x08) != 'high' or bitOps.GetField (0x0C, dictionary).match (0x08) != None:
+        error (lineno(),"The field of a dictionary was served for another one")
+        return False
+
+    return True
+
+#####################
+# RECORD AND REPLAY #
+#####################
+
+def gyro_session (bus = None):
+    '''
+    Operations of the gyro device recorded and replayed by test_17.
+    Returns the results or the error message
+    bus: bus failing the last operation or None when it is replayed
+    '''
+    G = gyro.Init ()
+    if G['error'][0]:
+        return G['error'][1]
+
+    results = []
+    for function in [gyro.get_scale, gyro.get_block_xyz]:
+        (status, value) = function (G)
+        if not status:
+            return value
+        results.append (value)
+    # end for
+
+    # An operation failing on the bus
+    if bus != None:
+        bus.fail (1)
+    # end if
+    (status, message) = gyro.set_scale (G, '500dps')
+    results.append (status)
+
+    return results
+
+def test_17 ():
+    '''
+    Check that a session of the gyro device is replayed with the same
+    results it was recorded with, and that the replay fails when the
+    operations diverge from the recording
+    '''
+
+    (fd, path) = tempfile.mkstemp (suffix = '.i2c')
+    os.close (fd)
+    try:
+        return check_replay (path)
+    finally:
+        common_i2c.set_bus_factory (bus_factory)
+        os.remove (path)
+
+def check_replay (path):
+    ''' Body of test_17 with the recording in the path '''
+
+    bus = FailingBus (common_i2c.open_bus (gyro.DEV_BUS_ID))
+    recorder = record_i2c.RecordBus (bus, path)
+    common_i2c.set_bus_factory (lambda bus_id: recorder)
+    recorded = gyro_session (bus)
+    recorder.close ()
+    if type (recorded) != list:
+        error (lineno(),"Error while recording the session. Error message was: %s" % recorded)
+        return False
+
+    if recorded[-1]:
+        error (lineno(),"The failure of the last operation of the session was not recorded")
+        return False
+
+    replayer = record_i2c.ReplayBus (path)
+    common_i2c.set_bus_factory (lambda bus_id: replayer)
+    replayed = gyro_session ()
+    if type (replayed) != list:
+        error (lineno(),"Error while replaying the session. Error message was: %s" % replayed)
+        return False
+
+    if str (replayed) != str (recorded) or replayer.index != len (replayer.records):
+        error (lineno(),"The replayed session %s differs from the recorded one %s" % (replayed, recorded))
+        return False
+
+    # A read of a different length diverges from the recording
+    replayer = record_i2c.ReplayBus (path)
+    common_i2c.set_bus_factory (lambda bus_id: replayer)
+    blocks = [record for record in replayer.records if record[1] == record_i2c.READ_BLOCK]
+    (t, op, addr, reg, code, nbytes, values) = blocks[0]
+    replayer.index = replayer.records.index (blocks[0])
+    try:
+        replayer.read_i2c_block_data (addr, reg, nbytes + 1)
+        error (lineno(),"The read of %s bytes was replayed from the record of %s bytes" % (nbytes + 1, nbytes))
+        return False
+    except record_i2c.ReplayError:
+        pass
+    # end try
+
+    return True
+
+##############
+# STATISTICS #
+##############
+
+def test_18 ():
+    '''
+    Check the statistics of the operations on a simulated bus and the
+    percentiles of their latency histograms
+    '''
+
+    bus = sim_i2c.imu_bus (sim_i2c.VirtualClock ())
+    common_i2c.set_bus_factory (lambda bus_id: bus)
+    try:
+        return check_stats (bus)
+    finally:
+        common_i2c.enable_stats (False)
+        common_i2c.set_bus_factory (bus_factory)
+
+def check_stats (bus):
+    ''' Body of test_18 on the simulated bus '''
+
+    # The highest latency of each bucket is above the latencies of the
+    # bucket by less than the error of the histograms
+    precision = 1.0 / (1 << (common_i2c.HIST_BITS - 1))
+    last = 0
+    for latency in range (1000) + range (1000, 10000000, 997):
+        bucket = common_i2c.__bucket (latency)
+        limit = common_i2c.__bucket_limit (bucket)
+        if bucket < last or not latency <= limit <= latency * (1 + precision):
+            error (lineno(),"The latency %s is in the bucket %s with the limit %s" % (latency, bucket, limit))
+            return False
+        last = bucket
+    # end for
+
+    # 90 operations of 10 us and 10 of 1000 us
+    histogram = {common_i2c.__bucket (10): 90, common_i2c.__bucket (1000): 10}
+    entry = {'count': 100, 'max': 1000, 'histogram': histogram}
+    for (percentile, expected) in [(50, 10), (90, 10), (91, 1000), (99.9, 1000)]:
+        latency = common_i2c.stats_percentile (entry, percentile)
+        if latency != expected:
+            error (lineno(),"The percentile %s is %s instead of %s" % (percentile, latency, expected))
+            return False
+    # end for
+
+    G = gyro.Init ()
+    if G['error'][0]:
+        error (lineno(),"Error while creating the gyro. Error message was: " + G['error'][1])
+        return False
+
+    # The operations are counted by slave address, register and operation
+    common_i2c.enable_stats ()
+    for i in xrange (5):
+        common_i2c.read (G, gyro.__CTRL_REG1, 0xff)
+    # end for
+    bus.fail (1)
+    common_i2c.read (G, gyro.__CTRL_REG1, 0xff)
+    common_i2c.read_block (G, gyro.__CTRL_REG1.get_addr () | common_i2c.AUTO_INCREMENT, 5)
+
+    (status, stats) = common_i2c.get_stats ()
+    entry = stats[(G['addr'], gyro.__CTRL_REG1.get_addr (), 'read_byte')]
+    if (entry['count'], entry['bytes'], entry['errors']) != (6, 5, 1) or sum (entry['histogram'].values ()) != 6:
+        error (lineno(),"The statistics of the reads are incorrect: %s" % entry)
+        return False
+
+    entry = stats[(G['addr'], gyro.__CTRL_REG1.get_addr () | common_i2c.AUTO_INCREMENT, 'read_block')]
+    if (entry['count'], entry['bytes']) != (1, 5):
+        error (lineno(),"The statistics of the block read are incorrect: %s" % entry)
+        return False
+
+    (status, lines) = common_i2c.format_stats ()
+    if not status or len (lines) != len (stats) + 1:
+        error (lineno(),"The statistics were formatted in %s lines" % len (lines))
+        return False
+
+    # Finished test
+    del G
+
+    return True
+
+###################
+# BUS ARBITRATION #
+###################
+
+def wait_queue (arbiter, length):
+    ''' Wait until there are length operations waiting for the bus '''
+    for i in xrange (1000):
+        if len (arbiter.waiting) >= length:
+            return True
+        time.sleep (0.001)
+    # end for
+    return False
+
+def test_19 ():
+    '''
+    Check that the bus is granted to the high priority operations
+    before the low priority ones waiting since earlier, and that the
+    telemetry reads wait with the low priority
+    '''
+
+    arbiter = common_i2c.BusArbiter ()
+    order = []
+    def operation (priority, name):
+        arbiter.acquire (priority)
+        order.append (name)
+        arbiter.release ()
+
+    # The low priority operation is queued before the high priority one
+    arbiter.acquire (common_i2c.PRIORITY_HIGH)
+    low = threading.Thread (target = operation, args = (common_i2c.PRIORITY_LOW, 'low'))
+    low.start ()
+    wait_queue (arbiter, 1)
+    high = threading.Thread (target = operation, args = (common_i2c.PRIORITY_HIGH, 'high'))
+    high.start ()
+    if not wait_queue (arbiter, 2):
+        error (lineno(),"The operations are not waiting for the bus")
+        return False
+    arbiter.release ()
+    low.join ()
+    high.join ()
+
+    if order != ['high', 'low']:
+        error (lineno(),"The bus was granted in the order %s instead of ['high', 'low']" % order)
+        return False
+
+    G = gyro.Init ()
+    if G['error'][0]:
+        error (lineno(),"Error while creating the gyro. Error message was: " + G['error'][1])
+        return False
+
+    M = mag.Init ()
+    if M['error'][0]:
+        error (lineno(),"Error while creating the magnetometer. Error message was: " + M['error'][1])
+        return False
+
+    # The temperatures of the gyro and the magnetometer are read with
+    # the low priority
+    common_i2c.set_arbiter (arbiter)
+    try:
+        count = arbiter.stats[common_i2c.PRIORITY_LOW]['count']
+        for (status, temp) in [gyro.get_temp (G), mag.get_temp (M)]:
+            if not status:
+                error (lineno(),"Error while getting the temperature. Error message was: " + temp)
+                return False
+        # end for
+    finally:
+        common_i2c.set_arbiter (None)
+    # end try
+
+    if arbiter.stats[common_i2c.PRIORITY_LOW]['count'] < count + 3:
+        error (lineno(),"The telemetry reads were not arbitrated with the low priority")
+        return False
+
+    # Finished test
+    del G, M
+
+    return True
+
+##############
+# I2C WORKER #
+##############
+
+def test_20 ():
+    '''
+    Check the requests performed by the i2c worker on a simulated bus:
+    their order, the timeouts of the futures and the errors of the
+    requests
+    '''
+
+    bus = sim_i2c.imu_bus (sim_i2c.VirtualClock ())
+    common_i2c.set_bus_factory (lambda bus_id: bus)
+    worker = io_worker.start ()
+    try:
+        return check_worker (bus, worker)
+    finally:
+        worker.stop ()
+        common_i2c.set_bus_factory (bus_factory)
+
+def check_worker (bus, worker):
+    ''' Body of test_20 with the worker on the simulated bus '''
+
+    G = gyro.Init ()
+    if G['error'][0]:
+        error (lineno(),"Error while creating the gyro. Error message was: " + G['error'][1])
+        return False
+
+    # The requests are performed in order of arrival
+    worker.write (G, gyro.__CTRL_REG4, 0x30, 0x3)
+    future = worker.read (G, gyro.__CTRL_REG4, 0x30)
+    if future.result (1.0) != (True, 0x3):
+        error (lineno(),"The read after the write returned %s" % str (future.result (0)))
+        return False
+
+    # The wait for a held request times out
+    gate = threading.Event ()
+    held = worker.submit (lambda: (True, gate.wait (1.0)))
+    (status, message) = held.result (0.01)
+    if status or held.done ():
+        error (lineno(),"The held request finished before the gate was opened")
+        return False
+
+    gate.set ()
+    if held.result (1.0) != (True, True) or not held.done ():
+        error (lineno(),"The held request returned %s" % str (held.result (0)))
+        return False
+
+    # The errors of the bus and the exceptions are returned as failures
+    bus.fail (1)
+    (status, message) = worker.read (G, gyro.__CTRL_REG4, 0x30).result (1.0)
+    if status:
+        error (lineno(),"The failure of the bus was not returned")
+        return False
+
+    (status, message) = worker.submit (lambda: 1 / 0).result (1.0)
+    if status or not 'division' in message:
+        error (lineno(),"The exception of the request was returned as %s" % message)
+        return False
+
+    # The worker keeps serving requests after the failures
+    (status, block) = worker.read_block (G, gyro.__CTRL_REG1.get_addr () | common_i2c.AUTO_INCREMENT, 4).result (1.0)
+    if not status or len (block) != 4 or block[3] & 0x30 != 0x30:
+        error (lineno(),"The block read after the failures returned %s" % str (block))
+        return False
+
+    # Finished test
+    del G
+
+    return True
+
+#####################
+# COOPERATIVE TASKS #
+#####################
+
+def test_21 ():
+    '''
+    Check the callbacks of the futures and the tasks of the cooperative
+    front-end on a simulated bus: the nested tasks, the waits for the
+    data and the watermark, their timeouts and the tasks failing
+    '''
+
+    bus = sim_i2c.imu_bus (sim_i2c.RealClock ())
+    common_i2c.set_bus_factory (lambda bus_id: bus)
+    loop = async_i2c.Loop ()
+    try:
+        return check_tasks (loop)
+    finally:
+        loop.close ()
+        common_i2c.set_bus_factory (bus_factory)
+
+def check_tasks (loop):
+    ''' Body of test_21 with the loop on the simulated bus '''
+
+    G = gyro.Init ()
+    if G['error'][0]:
+        error (lineno(),"Error while creating the gyro. Error message was: " + G['error'][1])
+        return False
+
+    # The worker is held while the callbacks are added
+    gate = threading.Event ()
+    held = loop.worker.submit (lambda: (True, gate.wait (1.0)))
+    called = []
+    held.add_done_callback (lambda f: called.append (f.result (0)))
+    if called != []:
+        error (lineno(),"The callback was called before the request was performed")
+        return False
+
+    gate.set ()
+    held.result (1.0)
+    held.add_done_callback (lambda f: called.append ('late'))
+    if called != [(True, True), 'late']:
+        error (lineno(),"The callbacks were called with %s" % called)
+        return False
+
+    device = async_i2c.Device (G, gyro, loop)
+
+    # A task waiting for a nested task before reading the sample
+    def sample ():
+        (status, values) = yield device.data_available (timeout = 1.0)
+        if not status:
+            raise async_i2c.Return ((False, values))
+        block = yield device.read_block (gyro.__OUT_X_L.get_addr () | common_i2c.AUTO_INCREMENT, 6)
+        raise async_i2c.Return (block)
+
+    (status, block) = loop.run_until_complete (sample ())
+    if not status or len (block) != 6:
+        error (lineno(),"The task waiting for the data returned %s" % str (block))
+        return False
+
+    # The watermark is waited for until the FIFO reaches the threshold
+    for (function, value) in [(gyro.set_fifoth, 4), (gyro.enable_fifo, True), (gyro.set_fifomode, 'stream')]:
+        (status, message) = function (G, value)
+        if not status:
+            error (lineno(),"Error while configuring the FIFO. Error message was: " + message)
+            return False
+    # end for
+
+    (status, value) = loop.run_until_complete (device.watermark (timeout = 1.0))
+    if not status or value != 'equal_greater':
+        error (lineno(),"The wait for the watermark returned %s" % value)
+        return False
+
+    (status, level) = gyro.get_fifolevel (G)
+    if not status or level < 4:
+        error (lineno(),"The FIFO level %s is below the watermark" % level)
+        return False
+
+    # The waits fail when the condition is not met in time
+    (status, message) = loop.run_until_complete (device.wait_for (gyro.isdata_available, lambda value: False, timeout = 0.01))
+    if status:
+        error (lineno(),"The wait did not time out")
+        return False
+
+    # The failure of a nested task is its result
+    def failing ():
+        yield async_i2c.sleep (0.01)
+        1 / 0
+
+    def waiting ():
+        result = yield failing ()
+        raise async_i2c.Return (result)
+
+    (status, message) = loop.run_until_complete (waiting ())
+    if status or not 'division' in message:
+        error (lineno(),"The failure of the task was returned as %s" % message)
+        return False
+
+    # Finished test
+    del G
+
+    return True
+
+#############
+# FAST PATH #
+#############
+
+def test_22 ():
+    '''
+    Check the fast path on a simulated bus: the values returned as the
+    (status, value) API does and the I2CError raised with the operation,
+    the device, the register and the errno of the failures
+    '''
+
+    bus = sim_i2c.imu_bus (sim_i2c.VirtualClock ())
+    common_i2c.set_bus_factory (lambda bus_id: bus)
+    try:
+        return check_fast_path (bus)
+    finally:
+        common_i2c.set_bus_factory (bus_factory)
+
+def check_fast_path (bus):
+    ''' Body of test_22 on the simulated bus '''
+
+    G = gyro.Init ()
+    if G['error'][0]:
+        error (lineno(),"Error while creating the gyro. Error message was: " + G['error'][1])
+        return False
+
+    # The values are returned straight away
+    common_i2c.write_fast (G, gyro.__CTRL_REG4, 0x30, 0x2)
+    for (fast, function, args) in [(common_i2c.read_fast, common_i2c.read, (gyro.__CTRL_REG4, 0x30)),
+                                   (common_i2c.read_block_fast, common_i2c.read_block, (gyro.__CTRL_REG1.get_addr () | common_i2c.AUTO_INCREMENT, 5))]:
+        value = fast (G, *args)
+        if function (G, *args) != (True, value):
+            error (lineno(),"The value %s of %s differs from %s" % (value, fast.__name__, function (G, *args)))
+            return False
+    # end for
+
+    if common_i2c.read_fast (G, gyro.__CTRL_REG4, 0x30) != 0x2:
+        error (lineno(),"The value written by the fast path was not read")
+        return False
+
+    # The failures raise the details of the operation and the message
+    # is only formatted when it is read
+    bus.fail (1)
+    try:
+        common_i2c.read_fast (G, gyro.__CTRL_REG4, 0x30)
+        error (lineno(),"The failure of the read was not raised")
+        return False
+    except common_i2c.I2CError as e:
+        if not isinstance (e, IOError) or (e.operation, e.addr, e.register, e.errno) != ('read', G['addr'], gyro.__CTRL_REG4, errno.EIO):
+            error (lineno(),"The error of the read %s is not valid" % str ((e.operation, e.addr, e.register, e.errno)))
+            return False
+
+        if e.message == str (e) or str (e) != e.message % e.values:
+            error (lineno(),"The message of the error %s is not formatted from %s" % (str (e), e.message))
+            return False
+    # end try
+
+    # The rest of the API returns the message of the error
+    bus.fail (1)
+    (status, message) = common_i2c.read_block (G, gyro.__CTRL_REG1.get_addr () | common_i2c.AUTO_INCREMENT, 5)
+    if status or not os.strerror (errno.EIO) in message:
+        error (lineno(),"The failure of the block read was returned as %s" % message)
+        return False
+
+    # Finished test
+    del G
+
+    return True
+
+############
+# RECOVERY #
+############
+
+def test_23 ():
+    '''
+    Check the retries, the backoff, the stale results and the
+    re-initialization of the recovery with failures injected on a
+    simulated bus
+    '''
+
+    clock = sim_i2c.VirtualClock ()
+    bus = sim_i2c.imu_bus (clock)
+    common_i2c.set_bus_factory (lambda bus_id: bus)
+    try:
+        return check_recovery (bus, clock)
+    finally:
+        common_i2c.set_bus_factory (bus_factory)
+
+def check_recovery (bus, clock):
+    ''' Body of test_23 on the simulated bus '''
+
+    G = gyro.Init (shadow = 'cache')
+    if G['error'][0]:
+        error (lineno(),"Error while creating the gyro. Error message was: " + G['error'][1])
+        return False
+
+    (status, message) = gyro.set_scale (G, '2000dps')
+    if not status:
+        error (lineno(),"Error while setting the scale. Error message was: " + message)
+        return False
+
+    R = common_i2c.recovery (budget = 5000, backoff = 0.02, max_backoff = 0.08, clock = clock)
+    common_i2c.set_reinit (R, 'temp', common_i2c.reinit_device_fast, G)
+    temp = gyro.get_temp_fast (G)
+
+    # The failures within the budget are retried in the same call
+    bus.fail (2)
+    value = common_i2c.recovered_fast (R, 'temp', gyro.get_temp_fast, G)
+    if value != temp or R['retries'] != 2 or common_i2c.isstale (R, 'temp'):
+        error (lineno(),"The read was not retried: value %s, retries %s" % (value, R['retries']))
+        return False
+
+    # Once the budget is spent the last good result is served and the
+    # backoff doubles on every failure up to its maximum
+    bus.fail (1000)
+    delays = []
+    for i in xrange (4):
+        value = common_i2c.recovered_fast (R, 'temp', gyro.get_temp_fast, G)
+        if value != temp or not common_i2c.isstale (R, 'temp'):
+            error (lineno(),"The stale value %s differs from %s" % (value, temp))
+            return False
+
+        entry = R['entries']['temp']
+        delays.append (entry['delay'])
+
+        # The device is skipped while it is backing off
+        transfers = bus.transfers
+        common_i2c.recovered_fast (R, 'temp', gyro.get_temp_fast, G)
+        if bus.transfers != transfers:
+            error (lineno(),"The device was read while backing off")
+            return False
+
+        clock.advance (entry['next_try'] - clock.time ())
+    # end for
+
+    if not numpy.allclose (delays, [0.02, 0.04, 0.08, 0.08]):
+        error (lineno(),"The backoff %s does not double up to its maximum" % delays)
+        return False
+
+    # The device lost its configuration: the shadowed registers are
+    # written back before the read is tried again
+    bus.fail (0)
+    device = bus.devices[G['addr']]
+    device.reset ()
+    value = common_i2c.recovered_fast (R, 'temp', gyro.get_temp_fast, G)
+    if common_i2c.isstale (R, 'temp') or R['reinits'] != 1 or R['recoveries'] != 1:
+        error (lineno(),"The device was not recovered: reinits %s, recoveries %s" % (R['reinits'], R['recoveries']))
+        return False
+
+    for (addr, shadowed) in G['shadow']['values'].items ():
+        if device.registers[addr] != shadowed:
+            error (lineno(),"The register %s was not written back on the re-initialization" % hex (addr))
+            return False
+    # end for
+
+    # Without a good result the error is raised
+    bus.fail (1000)
+    try:
+        common_i2c.recovered_fast (R, 'level', gyro.read_fast, G, gyro.__FIFO_SRC_REG, 0xff)
+        error (lineno(),"The failure of an operation without results was not raised")
+        return False
+    except common_i2c.I2CError:
+        pass
+    # end try
+
+    # The writes are not skipped nor served stale: each call tries the
+    # device and raises the error once the budget is spent
+    for i in xrange (2):
+        transfers = bus.transfers
+        try:
+            common_i2c.retried_fast (R, 'write', common_i2c.write_fast, G, gyro.__CTRL_REG2, 0xff, 0x0, False)
+            error (lineno(),"The failure of the write was not raised")
+            return False
+        except common_i2c.I2CError:
+            pass
+        # end try
+
+        if bus.transfers == transfers:
+            error (lineno(),"The write was skipped after a failure")
+            return False
+    # end for
+    bus.fail (0)
+
+    # Finished test
+    del G
+
+    return True
+
+##############
+# RAW BUFFER #
+##############
+
+def test_24 ():
+    '''
+    Check the reads into preallocated buffers of the gyro device
+    '''
+
+    G = gyro.Init ()
+    if G['error'][0]:
+        error (lineno(),"Error while creating the gyro. Error message was: " + G['error'][1])
+        return False
+
+    # Read the control registers with and without the buffer
+    (status, block) = common_i2c.read_block (G, gyro.__CTRL_REG1.get_addr () + 0x80, 5)
+    if not status:
+        error (lineno(),"Error while reading the control registers. Error message was: " + block)
+        return False
+
+    buf = bytearray (12)
+    (status, nbytes) = common_i2c.read_block_into (G, gyro.__CTRL_REG1.get_addr () + 0x80, buf, 5)
+    if not status:
+        error (lineno(),"Error while reading the control registers into the buffer. Error message was: " + nbytes)
+        return False
+
+    if nbytes != 5 or list (buf[:nbytes]) != list (block):
+        error (lineno(),"The block read into the buffer %s differs from the block read %s" % (list (buf[:nbytes]), list (block)))
+        return False
+
+    # The blocks greater than the buffer are refused
+    (status, message) = common_i2c.read_block_into (G, gyro.__CTRL_REG1.get_addr () + 0x80, buf, 13)
+    if status:
+        error (lineno(),"The read of a block greater than the buffer did not fail")
+        return False
+
+    # The samples read into the buffer are decoded without copies
+    (status, nbytes) = common_i2c.read_block_into (G, gyro.__OUT_X_L.get_addr () + 0x80, buf, 6)
+    if not status:
+        error (lineno(),"Error while reading the sample into the buffer. Error message was: " + nbytes)
+        return False
+
+    samples = gyro.decode_block_xyz_array (G, bitOps.BytesToArray (buf)[:nbytes])
+    if samples.shape != (1, 3) or tuple (samples[0]) != gyro.decode_block_xyz (G, buf):
+        error (lineno(),"The decoded sample %s differs from %s" % (samples, gyro.decode_block_xyz (G, buf)))
+        return False
+
+    # Finished test
+    del G
+
+    return True
+
+##############
+# BUS BUDGET #
+##############
+
+def test_25 ():
+    '''
+    Check the budget of bus time of the iterations: the operations
+    spend it, the low priority work is skipped when it does not fit and
+    the overruns are counted when a new iteration starts
+    '''
+
+    G = gyro.Init ()
+    if G['error'][0]:
+        error (lineno(),"Error while creating the gyro. Error message was: " + G['error'][1])
+        return False
+
+    budget = common_i2c.BusBudget (0.001)
+    common_i2c.set_budget (budget)
+    try:
+        # The operations on the bus spend the budget
+        budget.start ()
+        common_i2c.read (G, gyro.__CTRL_REG1, 0xff)
+        if budget.used <= 0.0:
+            error (lineno(),"The read did not spend the budget")
+            return False
+
+        # The work is allowed while it fits in the time left (on a new
+        # budget, the read could take longer than the limit)
+        budget = common_i2c.BusBudget (0.001)
+        common_i2c.set_budget (budget)
+        budget.start ()
+        budget.spend (0.0009)
+        if common_i2c.budget_allows ('mag', 0.0002) or not common_i2c.budget_allows ('alt', 0.00005):
+            error (lineno(),"The work was not allowed by the time left %s" % budget.left ())
+            return False
+
+        if budget.skipped != {'mag': 1}:
+            error (lineno(),"The skipped work %s is incorrect" % budget.skipped)
+            return False
+
+        # The iteration above the limit is an overrun
+        budget.spend (0.0011)
+        used = budget.start ()
+        if abs (used - 0.002) > 1e-9 or budget.overruns != 1 or budget.max_used != used or budget.used != 0.0:
+            error (lineno(),"The iteration using %s was accounted with %s overruns" % (used, budget.overruns))
+            return False
+    finally:
+        common_i2c.set_budget (None)
+    # end try
+
+    # Without budget all the work is allowed
+    if not common_i2c.budget_allows ('mag', 1.0):
+        error (lineno(),"The work was not allowed without a budget")
+        return False
+
+    # Finished test
+    del G
+
+    return True
+
+################
+# REGISTER MAP #
+################
+
+def test_26 ():
+    '''
+    Check the configuration read from the register maps of the devices
+    '''
+
+    A = accel.Init ()
+    if A['error'][0]:
+        error (lineno(),"Error while creating the accelerometer. Error message was: " + A['error'][1])
+        return False
+
+    # Modify several fields of the same registers
+    (status, message) = accel.set_dr (A, 100)
+    if not status:
+        error (lineno(),"Error while setting the data rate. Error message was: " + message)
+        return False
+
+    (status, message) = accel.set_powermode (A, 'low_power')
+    if not status:
+        error (lineno(),"Error while setting the power mode. Error message was: " + message)
+        return False
+
+    (status, message) = accel.set_hpcf (A, 32)
+    if not status:
+        error (lineno(),"Error while setting the high pass filter cutoff frequency. Error message was: " + message)
+        return False
+
+    # The values not in the dictionaries are refused
+    (status, message) = accel.set_hpcf (A, 33)
+    if status:
+        error (lineno(),"The high pass filter cutoff frequency 33 was set")
+        return False
+
+    # Compare the configuration against the accessors
+    (status, message) = accel.get_conf (A)
+    if not status:
+        error (lineno(),"Error while getting the configuration. Error message was: " + message)
+        return False
+
+    for (group, key, function) in [('ctrl1', 'lpen', accel.get_powermode), ('ctrl1', 'dr', accel.get_dr),
+                                   ('ctrl2', 'hpcf', accel.get_hpcf), ('ctrl4', 'fs', accel.get_scale),
+                                   ('fifo_ctrl', 'fifo_mode', accel.get_fifomode)]:
+        (status, value) = function (A)
+        if not status or A['conf'][group][key] != value:
+            error (lineno(),"The value %s of %s in the configuration differs from %s" % (A['conf'][group][key], key, value))
+            return False
+
+    if A['conf']['ctrl1']['lpen'] != 'low_power' or A['conf']['ctrl1']['dr'] != 100 or A['conf']['ctrl2']['hpcf'] != 32:
+        error (lineno(),"The configuration %s does not contain the values set" % A['conf'])
+        return False
+
+    # The configuration is read with the low priority of the telemetry
+    arbiter = common_i2c.BusArbiter ()
+    common_i2c.set_arbiter (arbiter)
+    try:
+        (status, message) = accel.get_conf (A)
+    finally:
+        common_i2c.set_arbiter (None)
+    # end try
+
+    stats = arbiter.stats
+    if not status or stats[common_i2c.PRIORITY_LOW]['count'] == 0 or stats[common_i2c.PRIORITY_NORMAL]['count'] != 0:
+        error (lineno(),"The configuration was not read with the low priority")
+        return False
+
+    # The configuration is read without popping samples from the FIFO
+    (status, message) = accel.enable_fifo (A, True)
+    if not status:
+        error (lineno(),"Error while enabling the FIFO. Error message was: " + message)
+        return False
+
+    (status, message) = accel.set_fifomode (A, 'stream')
+    if not status:
+        error (lineno(),"Error while setting the FIFO mode. Error message was: " + message)
+        return False
+
+    time.sleep (0.1)
+
+    (status, before) = accel.get_fifolevel (A)
+    if not status:
+        error (lineno(),"Error while getting the FIFO level. Error message was: " + before)
+        return False
+
+    (status, message) = accel.get_conf (A)
+    if not status:
+        error (lineno(),"Error while getting the configuration. Error message was: " + message)
+        return False
+
+    (status, after) = accel.get_fifolevel (A)
+    if not status:
+        error (lineno(),"Error while getting the FIFO level. Error message was: " + after)
+        return False
+
+    if after < before:
+        error (lineno(),"The FIFO level dropped from %s to %s while reading the configuration" % (before, after))
+        return False
+
+    # Reset the values of the registers
+    reset_a (A)
+
+    # Finished test
+    del A
+
+    return True
+
+def test_27 ():
+    '''
+    Check the drain of the FIFO of the accelerometer device
+    '''
+
+    A = accel.Init (dr = 100)
+    if A['error'][0]:
+        error (lineno(),"Error while creating the accelerometer. Error message was: " + A['error'][1])
+        return False
+
+    # Store the samples on the FIFO
+    (status, message) = accel.enable_fifo (A, True)
+    if not status:
+        error (lineno(),"Error while enabling the FIFO. Error message was: " + message)
+        return False
+
+    (status, message) = accel.set_fifomode (A, 'stream')
+    if not status:
+        error (lineno(),"Error while setting the FIFO mode. Error message was: " + message)
+        return False
+
+    time.sleep (0.2)
+
+    # Read a few samples and then the rest of the FIFO
+    (status, samples) = accel.read_fifo (A, 4)
+    if not status:
+        error (lineno(),"Error while reading the FIFO. Error message was: " + samples)
+        return False
+
+    if samples.shape != (4, 3):
+        error (lineno(),"The shape of the samples read %s is not (4, 3)" % str (samples.shape))
+        return False
+
+    (status, samples) = accel.read_fifo (A)
+    if not status:
+        error (lineno(),"Error while reading the FIFO. Error message was: " + samples)
+        return False
+
+    if samples.shape[0] == 0 or samples.shape[0] > accel.FIFO_DEPTH or samples.shape[1] != 3:
+        error (lineno(),"The shape of the samples read %s is not valid" % str (samples.shape))
+        return False
+
+    # Reset the values of the registers
+    reset_a (A)
+
+    # Finished test
+    del A
+
+    return True
+
+def test_28 ():
+    '''
+    Check the drain of the FIFO of the gyro device
+    '''
+
+    G = gyro.Init ()
+    if G['error'][0]:
+        error (lineno(),"Error while creating the gyro. Error message was: " + G['error'][1])
+        return False
+
+    # Store the samples on the FIFO
+    (status, message) = gyro.enable_fifo (G, True)
+    if not status:
+        error (lineno(),"Error while enabling the FIFO. Error message was: " + message)
+        return False
+
+    (status, message) = gyro.set_fifomode (G, 'stream')
+    if not status:
+        error (lineno(),"Error while setting the FIFO mode. Error message was: " + message)
+        return False
+
+    time.sleep (0.2)
+
+    # Read a few samples and then the rest of the FIFO
+    (status, samples) = gyro.read_fifo (G, 4)
+    if not status:
+        error (lineno(),"Error while reading the FIFO. Error message was: " + samples)
+        return False
+
+    if samples.shape != (4, 3):
+        error (lineno(),"The shape of the samples read %s is not (4, 3)" % str (samples.shape))
+        return False
+
+    (status, samples) = gyro.read_fifo (G)
+    if not status:
+        error (lineno(),"Error while reading the FIFO. Error message was: " + samples)
+        return False
+
+    if samples.shape[0] == 0 or samples.shape[0] > gyro.FIFO_DEPTH or samples.shape[1] != 3:
+        error (lineno(),"The shape of the samples read %s is not valid" % str (samples.shape))
+        return False
+
+    # Reset the values of the registers
+    reset_g (G)
+
+    # Finished test
+    del G
+
+    return True
+
+#####################
+# CALIBRATION FILES #
+#####################
+
+def test_29 ():
+    '''
+    Check the cache of the calibration files: the arrays are read once,
+    read again when the file changes and the least recently used files
+    are evicted
+    '''
+
+    directory = tempfile.mkdtemp ()
+    npz_cache.clear ()
+    try:
+        return check_npz_cache (directory)
+    finally:
+        npz_cache.clear ()
+        shutil.rmtree (directory)
+
+def check_npz_cache (directory):
+    ''' Body of test_29 with the files in the directory '''
+
+    paths = [os.path.join (directory, "cal%s.npz" % i) for i in xrange (npz_cache.MAX_FILES + 1)]
+    for (i, path) in enumerate (paths):
+        numpy.savez (path, data = numpy.arange (3) + i)
+    # end for
+
+    # The arrays are served from memory while the file does not change
+    first = npz_cache.load (paths[0])
+    if not numpy.array_equal (first['data'], [0, 1, 2]) or npz_cache.load (paths[0]) is not first:
+        error (lineno(),"The arrays of the file were not served from memory")
+        return False
+
+    # A file written again is read again
+    numpy.savez (paths[0], data = numpy.arange (3) * 10)
+    mtime = os.stat (paths[0]).st_mtime + 1
+    os.utime (paths[0], (mtime, mtime))
+    first = npz_cache.load (paths[0])
+    if not numpy.array_equal (first['data'], [0, 10, 20]):
+        error (lineno(),"The arrays %s of the modified file were not read again" % first['data'])
+        return False
+
+    # The least recently used file is evicted, the rest are kept
+    second = npz_cache.load (paths[1])
+    npz_cache.load (paths[0])
+    for path in paths[2:]:
+        npz_cache.load (path)
+    # end for
+    if npz_cache.load (paths[0]) is not first or npz_cache.load (paths[1]) is second:
+        error (lineno(),"The least recently used file was not the evicted one")
+        return False
+
+    # The missing files raise the errors of the file system
+    try:
+        npz_cache.load (os.path.join (directory, "missing.npz"))
+        error (lineno(),"The missing file was loaded")
+        return False
+    except (IOError, OSError):
+        pass
+    # end try
+
+    return True
+
+###################
+# LOW-PASS FILTER #
+###################
+
+def test_30 ():
+    '''
+    Check the low-pass filters of the samples drained from the FIFO of
+    the accelerometer device
+    '''
+
+    A = accel.Init (dr = 100)
+    if A['error'][0]:
+        error (lineno(),"Error while creating the accelerometer. Error message was: " + A['error'][1])
+        return False
+
+    (status, message) = accel.enable_fifo (A, True)
+    if not status:
+        error (lineno(),"Error while enabling the FIFO. Error message was: " + message)
+        return False
+
+    (status, message) = accel.set_fifomode (A, 'stream')
+    if not status:
+        error (lineno(),"Error while setting the FIFO mode. Error message was: " + message)
+        return False
+
+    # Filters with a window longer than a drain of the FIFO
+    length = 40
+    window = numpy.zeros ((length, 3))
+    filters = {}
+    for kind in lowpass.FILTERS:
+        filters[kind] = lowpass.create (kind, length, 100, (0, 0, 0))
+    # end for
+
+    for i in xrange (4):
+        time.sleep (0.1)
+        (status, samples) = accel.read_fifo (A)
+        if not status:
+            error (lineno(),"Error while reading the FIFO. Error message was: " + samples)
+            return False
+
+        window = numpy.vstack ((window, samples))[-length:]
+        for kind in lowpass.FILTERS:
+            value = filters[kind].update (samples)
+            if value.shape != (3,):
+                error (lineno(),"The shape of the value of the %s filter %s is not (3,)" % (kind, str (value.shape)))
+                return False
+        # end for
+
+        # The boxcar filter is the mean of the window
+        if not numpy.allclose (filters['boxcar'].value, window.mean (axis = 0)):
+            error (lineno(),"The boxcar filter %s differs from the mean %s" % (filters['boxcar'].value, window.mean (axis = 0)))
+            return False
+    # end for
+
+    # A constant input is kept by all the filters
+    for kind in lowpass.FILTERS:
+        filters[kind].reset ((0, 0, 1))
+        value = filters[kind].update (numpy.tile ((0, 0, 1), (3*length, 1)))
+        if not numpy.allclose (value, (0, 0, 1)):
+            error (lineno(),"The %s filter changed the constant input to %s" % (kind, value))
+            return False
+    # end for
+
+    # Reset the values of the registers
+    reset_a (A)
+
+    # Finished test
+    del A
+
+    return True
+
+##################
+# FIFO WATERMARK #
+##################
+
+def test_31 ():
+    '''
+    Check the watermark and overrun status of the FIFOs of the gyro and
+    the accelerometer devices
+    '''
+
+    # Data rates filling the FIFOs in less than 0.5 s
+    for (module, name, reset_device, conf) in [(gyro, 'gyro', reset_g, {}), (accel, 'accelerometer', reset_a, {'dr': 100})]:
+        D = module.Init (**conf)
+        if D['error'][0]:
+            error (lineno(),"Error while creating the %s. Error message was: %s" % (name, D['error'][1]))
+            return False
+
+        (status, message) = module.enable_fifo (D, True)
+        if not status:
+            error (lineno(),"Error while enabling the FIFO of the %s. Error message was: %s" % (name, message))
+            return False
+
+        (status, message) = module.set_fifomode (D, 'stream')
+        if not status:
+            error (lineno(),"Error while setting the FIFO mode of the %s. Error message was: %s" % (name, message))
+            return False
+
+        # Threshold of the samples of 50 ms
+        (status, threshold) = module.set_watermark (D, 0.05)
+        if not status:
+            error (lineno(),"Error while setting the watermark of the %s. Error message was: %s" % (name, threshold))
+            return False
+
+        (status, value) = module.get_fifoth (D)
+        if not status or value != threshold or not 1 <= threshold < module.FIFO_DEPTH:
+            error (lineno(),"The FIFO threshold of the %s %s differs from the watermark %s" % (name, value, threshold))
+            return False
+
+        # Drain the FIFO so the next drain holds the samples of a period
+        (status, samples) = module.read_fifo (D)
+        if not status:
+            error (lineno(),"Error while reading the FIFO of the %s. Error message was: %s" % (name, samples))
+            return False
+
+        time.sleep (0.1)
+        (status, samples) = module.read_fifo (D)
+        if not status:
+            error (lineno(),"Error while reading the FIFO of the %s. Error message was: %s" % (name, samples))
+            return False
+
+        (level, watermark, overrun) = D['fifo_status']
+        if len (samples) != level or not watermark or overrun:
+            error (lineno(),"The FIFO status of the %s %s is not valid for %s samples" % (name, D['fifo_status'], len (samples)))
+            return False
+
+        # The FIFO gets full when it is not drained
+        time.sleep (0.5)
+        (status, samples) = module.read_fifo (D)
+        if not status:
+            error (lineno(),"Error while reading the FIFO of the %s. Error message was: %s" % (name, samples))
+            return False
+
+        (level, watermark, overrun) = D['fifo_status']
+        if len (samples) != module.FIFO_DEPTH or level != module.FIFO_DEPTH or not overrun:
+            error (lineno(),"The FIFO status of the %s %s is not valid for a full FIFO" % (name, D['fifo_status']))
+            return False
+
+        # Reset the values of the registers
+        reset_device (D)
+
+        # Finished device
+        del D
+    # end for
+
+    # The watermark is refused while the accelerometer is powered down
+    A = accel.Init ()
+    if A['error'][0]:
+        error (lineno(),"Error while creating the accelerometer. Error message was: " + A['error'][1])
+        return False
+
+    (status, message) = accel.set_dr (A, 'power_down')
+    if not status:
+        error (lineno(),"Error while powering down the accelerometer. Error message was: " + message)
+        return False
+
+    (status, threshold) = accel.set_watermark (A, 0.05)
+    if status:
+        error (lineno(),"The watermark of the powered down accelerometer was set to %s" % threshold)
+        return False
+
+    # Reset the values of the registers
+    reset_a (A)
+
+    # Finished test
+    del A
+
+    return True
+
+###############
+# CALIBRATION #
+###############
+
+def test_32 ():
+    '''
+    Check the calibration of the three axis of the gyro device, polling
+    the status and draining the FIFO
+    '''
+
+    G = gyro.Init ()
+    if G['error'][0]:
+        error (lineno(),"Error while creating the gyro. Error message was: " + G['error'][1])
+        return False
+
+    for fifo in [False, True]:
+        if fifo:
+            (status, message) = gyro.enable_fifo (G, True)
+            if not status:
+                error (lineno(),"Error while enabling the FIFO. Error message was: " + message)
+                return False
+
+            (status, message) = gyro.set_fifomode (G, 'stream')
+            if not status:
+                error (lineno(),"Error while setting the FIFO mode. Error message was: " + message)
+                return False
+        # end if
+
+        (status, message) = gyro.calibrate (G, samples = 40)
+        if not status:
+            error (lineno(),"Error while calibrating the gyro. Error message was: " + message)
+            return False
+
+        for axis in ['X', 'Y', 'Z']:
+            if not G['min' + axis] <= G['mean' + axis] <= G['max' + axis] or G['var' + axis] < 0:
+                error (lineno(),"The calibration of the %s axis %s, %s, %s, %s is not valid" % (axis, G['min' + axis], G['mean' + axis], G['max' + axis], G['var' + axis]))
+                return False
+        # end for
+    # end for
+
+    # Reset the values of the registers
+    reset_g (G)
+
+    # Finished test
+    del G
+
+    return True
+
+####################
+# TEMPERATURE BIAS #
+####################
+
+def test_33 ():
+    '''
+    Check the bias of the gyro device depending on its temperature
+    '''
+
+    G = gyro.Init ()
+    if G['error'][0]:
+        error (lineno(),"Error while creating the gyro. Error message was: " + G['error'][1])
+        return False
+
+    # The temperature is read with the low priority of the telemetry
+    arbiter = common_i2c.BusArbiter ()
+    common_i2c.set_arbiter (arbiter)
+    try:
+        temp = gyro.get_temp_fast (G)
+    except common_i2c.I2CError as e:
+        error (lineno(),"Error while getting the temperature. Error message was: %s" % e)
+        return False
+    finally:
+        common_i2c.set_arbiter (None)
+    # end try
+
+    if arbiter.stats[common_i2c.PRIORITY_LOW]['count'] != 1:
+        error (lineno(),"The temperature was not read with the low priority")
+        return False
+
+    if type (temp) != int or not -128 <= temp <= 127:
+        error (lineno(),"The temperature %s is not a signed byte" % temp)
+        return False
+
+    # Table fitted to a bias linear with the temperature
+    temps = numpy.arange (temp - 10, temp + 11)
+    model = numpy.outer (temps, [0.01, -0.02, 0.005]) + [0.5, -0.25, 0.1]
+    table = temp_bias.fit (temps, model)
+    for value in [temp, temp + 0.5, temp - 9.25]:
+        expected = numpy.array ([0.01, -0.02, 0.005]) * value + [0.5, -0.25, 0.1]
+        if not numpy.allclose (table.lookup (value), expected):
+            error (lineno(),"The bias %s at the temperature %s differs from %s" % (table.lookup (value), value, expected))
+            return False
+    # end for
+
+    # The temperatures out of the table get the bias of the nearest end
+    if not numpy.allclose (table.lookup (temp + 50), table.bias[-1]):
+        error (lineno(),"The bias %s out of the table differs from the last entry %s" % (table.lookup (temp + 50), table.bias[-1]))
+        return False
+
+    # Finished test
+    del G
+
+    return True
+
+###########################
+# infrastructure support #
+###########################
+
+def lineno():
+    """Returns the current line number in our program."""
+    return inspect.currentframe().f_back.f_lineno
+
+def info (msg):
+    print "[ INFO  ] : " + msg
+
+def error (line, msg):
+    if line != None:
+        print "[ ERROR ] line %s: %s"  % (line, msg)
+    else:
+        print "[ ERROR ]: %s"  % msg
+
+def ok (msg):
+    print "[  OK   ] : " + msg
+
+def run_all_tests ():
+    test_count = 0
+    for test in tests:
+        
+         # print log
+        info ("TEST-" + str(test_count) + ": Running " + test[1])
+        
+        # call test
+        if not test[0]():
+            error (None, "detected test failure at: " + test[1])
+            return False
+
+        # next test
+        test_count += 1
+    
+    ok ("All tests ok!")
+    return True
+
+# declare list of tests available
+tests = [
+   (reset_g,   "Reset the values of the registers of the gyro device"),
+   (create_g,  "Check the creation of the gyro context"),
+   (test_00,   "Check the defaults values of each register of the gyro device"),
+   (test_01,   "Check that the read only registers of the gyro device are not writable"),
+   (test_02,   "Check the functions of the gyro API"),
+   (reset_g,   "Reset the values of the registers of the gyro device"),
+   (reset_a,   "Reset the values of the registers of the accelerometer device"),
+   (create_a,  "Check the creation of the accelerometer context"),
+   (test_03,   "Check the defaults values of each register of the accelerometer device"),
+   (test_04,   "Check that the read only registers of the accelerometer device are not writable"),
+   (test_05,   "Check the functions of the accelerometer API"),
+   (reset_a,   "Reset the values of the registers of the accelerometer device"),
+   (reset_m,   "Reset the values of the registers of the magnetometer device"),
+   (create_m,  "Check the creation of the magnetometer context"),
+   (test_06,   "Check the defaults values of each register of the magnetometer device"),
+   (test_07,   "Check that the read only registers of the magnetometer device are not writable"),
+   (test_08,   "Check the functions of the magnetometer API"),
+   (reset_m,   "Reset the values of the registers of the magnetometer device"),
+   (reset_p,   "Reset the values of the registers of the pressure sensor"),
+   (create_p,  "Check the creation of the magnetometer context"),
+   (test_09,   "Check the defaults values of each register of the pressure sensor"),
+   (test_10,   "Check that the read only registers of the pressure sensor are not writable"),
+   (test_11,   "Check the functions of the altimeter API"),
+   (reset_p,   "Reset the values of the registers of the pressure sensor"),
+   (test_12,   "Check the shadow registers of the gyro device"),
+   (reset_g,   "Reset the values of the registers of the gyro device"),
+   (test_13,   "Check the reference pressure through the shadow of the pressure sensor"),
+   (test_14,   "Check the transactions of the gyro device"),
+   (test_15,   "Check the snapshots of the IMU devices"),
+   (test_16,   "Check the fields of the registers compiled by bitOps"),
+   (test_17,   "Check the record and the replay of the traffic of the gyro device"),
+   (test_18,   "Check the statistics of the operations on the bus"),
+   (test_19,   "Check the priorities of the arbitration of the bus"),
+   (test_20,   "Check the requests performed by the i2c worker"),
+   (test_21,   "Check the tasks of the cooperative front-end"),
+   (test_22,   "Check the fast path of the operations on the bus"),
+   (test_23,   "Check the recovery of the operations through the failures of the bus"),
+   (test_24,   "Check the reads into preallocated buffers of the gyro device"),
+   (test_25,   "Check the budget of bus time of the iterations"),
+   (test_26,   "Check the configuration read from the register maps of the devices"),
+   (test_27,   "Check the drain of the FIFO of the accelerometer device"),
+   (test_28,   "Check the drain of the FIFO of the gyro device"),
+   (test_29,   "Check the cache of the calibration files"),
+   (test_30,   "Check the low-pass filters of the accelerometer samples"),
+   (test_31,   "Check the watermark and overrun status of the FIFOs"),
+   (test_32,   "Check the calibration of the gyro device"),
+   (test_33,   "Check the bias of the gyro device depending on the temperature")
+
+]
+
+if __name__ == '__main__':
+
+    # --sim runs the tests against the simulated devices, following the
+    # wall time so the waits of the tests let the devices take samples
+    if '--sim' in sys.argv:
+        bus = sim_i2c.imu_bus (sim_i2c.RealClock ())
+        bus_factory = lambda bus_id: bus
+        common_i2c.set_bus_factory (bus_factory)
 
     # call to run all tests
     run_all_tests ()
@@ -8,6 +8,7 @@ sys.path.append ("../lib")
 import time
 import pwm
 import common_i2c
+import sim_i2c
 import inspect
 
 ####################
@@ -369,6 +370,54 @@ def test_02 ():
 
     return True
 
+##################
+# AUTO-INCREMENT #
+##################
+
+def test_03 ():
+    '''
+    Check the writes of all the channels with the auto-increment, split
+    in blocks that fit in a SMBus block
+    '''
+
+    P = pwm.Init ()
+    if P['error'][0]:
+        error (lineno(),"Error while creating the PWM. Error message was: " + P['error'][1])
+        return False
+
+    (status, message) = pwm.enable_ai (P, True)
+    if not status:
+        error (lineno(),"Error while enabling the auto-increment. Error message was: " + message)
+        return False
+
+    # The 16 channels take 64 bytes
+    values = [(10*channel + 100, 0) for channel in xrange (16)]
+    (status, message) = pwm.set_pwm_ai (P, 0, values)
+    if not status:
+        error (lineno(),"Error while setting the duty cycles. Error message was: " + message)
+        return False
+
+    for channel in xrange (16):
+        (status, value) = pwm.get_pwm (P, channel)
+        if not status or abs (value[0] - values[channel][0]) > 1:
+            error (lineno(),"The duty cycle %s of the channel %s differs from %s" % (str (value), channel, values[channel][0]))
+            return False
+    # end for
+
+    # A single block longer than a SMBus block is refused
+    (status, message) = common_i2c.write_block (P, pwm.__LED_ON_L[0].addr, [0] * 33)
+    if status:
+        error (lineno(),"The block of 33 bytes was written")
+        return False
+
+    # Reset the values of the registers
+    reset_p (P)
+
+    # Finished test
+    del P
+
+    return True
+
 ###########################
 # intrastructure support #
 ###########################
@@ -413,11 +462,18 @@ tests = [
    (create_p,  "Check the creation of the PWM context"),
    (test_01,   "Check the defaults values of each register of the PWM device"),
    (test_02,   "Check the functions of the PWM API"),
+   (test_03,   "Check the writes of all the channels with the auto-increment"),
    (reset_p,   "Reset the values of the registers of the PWM device")
 ]
 
 if __name__ == '__main__':
 
+    # --sim runs the tests against the simulated devices, following the
+    # wall time so the waits of the tests let the devices take samples
+    if '--sim' in sys.argv:
+        bus = sim_i2c.pwm_bus (sim_i2c.RealClock ())
+        common_i2c.set_bus_factory (lambda bus_id: bus)
+
     # call to run all tests
     run_all_tests ()
 